@@ -0,0 +1,223 @@
+"""End-to-end throughput of the subscriber -> render -> SMTP -> email log pipeline
+
+Publishes N events to each channel RedisSubscriber listens on and measures
+until every event is handled. Mail goes to an in-process SMTP sink with
+configurable latency and error rate, and email logs to a scratch SQLite
+database. Results are printed as one JSON document (and appended as a line
+to --output, if given) so runs can be compared across commits.
+
+    cd email_service && python -m benchmarks.bench_pipeline --events 500 --smtp-latency 20
+"""
+import os
+import socket
+import tempfile
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# Settings are read when src is imported, so point SMTP at the sink and the
+# database at a scratch file first
+SMTP_PORT = _free_port()
+SCRATCH_DIR = tempfile.mkdtemp(prefix="kaupskip-bench-")
+os.environ.update({
+    "SMTP_HOST": "127.0.0.1",
+    "SMTP_PORT": str(SMTP_PORT),
+    "SMTP_TLS": "false",
+    "DATABASE_URL": f"sqlite:///{SCRATCH_DIR}/bench.db",
+    "RATE_LIMIT_ENABLED": "false"
+})
+os.environ.setdefault("SMTP_USER", "bench@example.com")
+os.environ.setdefault("SMTP_PASSWORD", "bench")
+
+from prometheus_client import REGISTRY
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import shutil
+import statistics
+import subprocess
+import time
+
+from benchmarks.fake_redis import FakeRedis, FakeRedisManager
+from benchmarks.fake_smtp import FakeSMTPServer
+from src.database import engine, init_db
+from src.services.email_log_writer import EmailLogWriter
+from src.services.email_service import EmailService
+from src.services.redis_subscriber import RedisSubscriber
+from src.services.smtp_transport import SMTPTransport
+
+def registration_event(i: int, email: str) -> dict:
+    return {
+        "user_id": f"user-{i}",
+        "email": email,
+        "verification_token": f"token-{i}",
+        "verification_url": f"https://example.com/verify?token=token-{i}"
+    }
+
+def subscription_event(i: int, email: str) -> dict:
+    return {
+        "event_type": "subscription_created",
+        "user_id": f"user-{i}",
+        "email": email,
+        "tier": "Premium",
+        "subscription_data": {
+            "tier": "Premium",
+            "status": "active",
+            "price": "9.99",
+            "current_period_end": "2026-11-01T00:00:00Z"
+        }
+    }
+
+def marketing_event(i: int, email: str) -> dict:
+    return {
+        "event_type": "marketing:trial_expired",
+        "data": {
+            "email": email,
+            "total_characters": 3,
+            "characters": [{"name": f"Character {n}", "personality": "Curious and kind"} for n in range(3)]
+        }
+    }
+
+EVENTS = {
+    "user_registration": registration_event,
+    "kaupskip:subscription": subscription_event,
+    "kaupskip:marketing": marketing_event
+}
+
+def handled_events() -> float:
+    return sum(
+        REGISTRY.get_sample_value("kaupskip_events_total", {"channel": channel, "outcome": outcome}) or 0
+        for channel in EVENTS
+        for outcome in ("processed", "failed", "duplicate", "invalid")
+    )
+
+def percentile(values, pct: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+async def run(args, sink: FakeSMTPServer) -> dict:
+    await init_db()
+    writer = EmailLogWriter()
+    writer.start()
+    transport = SMTPTransport(max_concurrency=args.concurrency)
+    transport.pool.max_size = args.concurrency
+    await transport.start()
+
+    if args.redis_url:
+        from redis.asyncio import Redis
+        redis = Redis.from_url(args.redis_url, decode_responses=True)
+    else:
+        redis = FakeRedis()
+    subscriber = RedisSubscriber(
+        FakeRedisManager(redis),
+        EmailService(transport=transport, log_writer=writer),
+        channel_concurrency={channel: args.concurrency for channel in EVENTS}
+    )
+    listener = asyncio.create_task(subscriber.start_listening())
+    await asyncio.sleep(0.2)
+
+    total = args.events * len(EVENTS)
+    published = {}
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    for i in range(args.events):
+        for channel, make_event in EVENTS.items():
+            email = f"{channel.split(':')[-1]}-{i}@bench.example.com"
+            published[email] = time.perf_counter()
+            await redis.publish(channel, json.dumps(make_event(i, email)))
+        if args.publish_rate:
+            # Open-loop pacing: latency then reflects service time, not the backlog of a burst
+            await asyncio.sleep(max(0.0, started + (i + 1) / args.publish_rate - time.perf_counter()))
+
+    deadline = started + args.timeout
+    while handled_events() < total and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    await subscriber.stop()
+    listener.cancel()
+    await asyncio.gather(listener, return_exceptions=True)
+    await writer.close()
+    transport.close()
+    await engine.dispose()
+    if args.redis_url:
+        await redis.aclose()
+
+    latencies = sorted(
+        (accepted_at - published[recipient]) * 1000
+        for recipient, accepted_at in sink.deliveries
+        if recipient in published
+    )
+    delivered = len(latencies)
+    cpu_seconds = (
+        usage_after.ru_utime - usage_before.ru_utime + usage_after.ru_stime - usage_before.ru_stime
+    )
+    return {
+        "benchmark": "pipeline",
+        "commit": git_commit(),
+        "redis": "real" if args.redis_url else "fake",
+        "events_per_channel": args.events,
+        "events_total": total,
+        "events_handled": int(handled_events()),
+        "concurrency": args.concurrency,
+        "publish_rate": args.publish_rate,
+        "smtp_latency_ms": args.smtp_latency,
+        "smtp_error_rate": args.error_rate,
+        "delivered": delivered,
+        "smtp_rejections": sink.rejected,
+        "smtp_connections": sink.connections,
+        "elapsed_sec": round(elapsed, 3),
+        "emails_per_sec": round(delivered / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2)
+        },
+        "cpu_seconds": round(cpu_seconds, 3),
+        "cpu_percent": round(100 * cpu_seconds / elapsed, 1) if elapsed else 0.0,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(usage_after.ru_maxrss / 1024, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=200, help="events published to each channel")
+    parser.add_argument("--concurrency", type=int, default=10, help="SMTP sends and workers per channel")
+    parser.add_argument("--smtp-latency", type=float, default=20.0, help="sink delay per message, in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of messages answered with 451")
+    parser.add_argument("--publish-rate", type=float, default=0.0,
+                        help="publish rounds (one event per channel) per second; 0 publishes everything at once")
+    parser.add_argument("--redis-url", help="use a real Redis instead of the in-process stand-in")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds to wait for all events")
+    parser.add_argument("--output", help="append the result as a JSON line to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    sink = FakeSMTPServer(port=SMTP_PORT, latency=args.smtp_latency / 1000, error_rate=args.error_rate).start()
+    try:
+        result = asyncio.run(run(args, sink))
+    finally:
+        sink.stop()
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Template rendering throughput before and after the shared template engine
+
+The "before" case reproduces the old behaviour: every EmailService built its
+own Environment (one per HTTP request), so each render re-parsed and
+re-compiled the template and base.html.
+
+    cd email_service && python -m benchmarks.bench_render
+"""
+import os
+
+os.environ.setdefault("SMTP_USER", "bench@example.com")
+os.environ.setdefault("SMTP_PASSWORD", "bench")
+
+from datetime import datetime
+from jinja2 import Environment, FileSystemLoader
+import argparse
+import json
+import time
+
+from src.config import settings
+from src.services.template_engine import TEMPLATE_DIR, build_template_env, format_date
+
+CASES = {
+    "verification.html": {
+        "code": "abc123",
+        "verification_url": "https://example.com/verify?token=abc123",
+        "expiry_hours": 24
+    },
+    "subscription_receipt.html": {
+        "email": "user@example.com",
+        "subscription_data": {"tier": "Premium", "status": "active", "current_period_end": "2024-02-01T00:00:00Z"}
+    },
+    "welcome.html": {
+        "email": "user@example.com",
+        "user_data": {"email": "user@example.com"}
+    }
+}
+
+def render_per_instance_env(template_name: str, context: dict) -> str:
+    env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=True)
+    env.filters['date'] = format_date
+    context = dict(context)
+    context['service_name'] = settings.SERVICE_NAME
+    context['service_url'] = settings.MAIN_APP_URL
+    context['site_url'] = settings.SITE_URL
+    context['logo_data'] = None
+    context['current_year'] = datetime.now().year
+    return env.get_template(template_name).render(**context)
+
+def measure(render, iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        for template_name, context in CASES.items():
+            render(template_name, context)
+    return iterations * len(CASES) / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args()
+
+    env = build_template_env()
+    shared = lambda template_name, context: env.get_template(template_name).render(context)
+
+    before = measure(render_per_instance_env, args.iterations)
+    after = measure(shared, args.iterations)
+    print(json.dumps({
+        "benchmark": "render",
+        "iterations": args.iterations,
+        "renders_per_sec_before": round(before, 1),
+        "renders_per_sec_after": round(after, 1),
+        "speedup": round(after / before, 1)
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
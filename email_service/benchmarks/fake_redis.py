@@ -0,0 +1,81 @@
+"""In-process stand-in for the parts of redis.asyncio that RedisSubscriber uses
+
+Covers pub/sub (publish, subscribe, get_message with a blocking timeout) and
+the plain keys behind event idempotency (SET NX EX, GET, DELETE). Pass
+--redis-url to the benchmark to measure against a real server instead.
+"""
+from collections import defaultdict
+from typing import Optional
+import asyncio
+import time
+
+class FakePubSub:
+    def __init__(self, redis: "FakeRedis"):
+        self._redis = redis
+        self._channels = set()
+        self._messages: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, *channels):
+        for channel in channels:
+            self._channels.add(channel)
+            self._redis._subscribers[channel].add(self)
+
+    async def unsubscribe(self, *channels):
+        for channel in channels or list(self._channels):
+            self._channels.discard(channel)
+            self._redis._subscribers[channel].discard(self)
+
+    async def get_message(self, ignore_subscribe_messages: bool = False, timeout: Optional[float] = 0.0):
+        try:
+            return await asyncio.wait_for(self._messages.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        await self.unsubscribe()
+
+class FakeRedis:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._values = {}
+
+    def pubsub(self, ignore_subscribe_messages: bool = False) -> FakePubSub:
+        return FakePubSub(self)
+
+    async def publish(self, channel: str, message: str) -> int:
+        subscribers = self._subscribers[channel]
+        for pubsub in subscribers:
+            pubsub._messages.put_nowait({"type": "message", "pattern": None, "channel": channel, "data": message})
+        return len(subscribers)
+
+    def _live(self, key: str):
+        value = self._values.get(key)
+        if value is not None and value[1] is not None and value[1] <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value, nx: bool = False, ex: Optional[float] = None):
+        if nx and self._live(key) is not None:
+            return None
+        self._values[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    async def get(self, key: str):
+        value = self._live(key)
+        return None if value is None else value[0]
+
+    async def delete(self, *keys) -> int:
+        return sum(self._values.pop(key, None) is not None for key in keys)
+
+    async def aclose(self):
+        pass
+
+class FakeRedisManager:
+    """Drop-in for RedisManager handing out one shared connection"""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def get_main_connection(self):
+        return self.redis
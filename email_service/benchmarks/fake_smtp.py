@@ -0,0 +1,107 @@
+"""In-process SMTP sink for benchmarks
+
+Speaks enough ESMTP for smtplib (EHLO, AUTH PLAIN, MAIL, RCPT, DATA, RSET,
+NOOP, QUIT), accepts every message after an optional artificial latency and
+answers a configurable fraction of them with a transient 451. It runs its
+own event loop in a background thread so it does not compete with the
+service's loop.
+"""
+from typing import List, Tuple
+import asyncio
+import random
+import threading
+import time
+
+class FakeSMTPServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        # (recipient, time.perf_counter() when the message was accepted)
+        self.deliveries: List[Tuple[str, float]] = []
+        self.rejected = 0
+        self.connections = 0
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name="fake-smtp", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            self._loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        recipients = []
+        writer.write(b"220 fake-smtp ESMTP ready\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                verb = line[:4].upper()
+                if verb == b"EHLO":
+                    writer.write(b"250-fake-smtp\r\n250-AUTH PLAIN\r\n250-SIZE 52428800\r\n250 8BITMIME\r\n")
+                elif verb == b"HELO":
+                    writer.write(b"250 fake-smtp\r\n")
+                elif verb == b"AUTH":
+                    writer.write(b"235 2.7.0 Authentication successful\r\n")
+                elif verb == b"MAIL":
+                    recipients = []
+                    writer.write(b"250 2.1.0 OK\r\n")
+                elif verb == b"RCPT":
+                    recipients.append(line.split(b"<", 1)[-1].split(b">", 1)[0].decode())
+                    writer.write(b"250 2.1.5 OK\r\n")
+                elif verb == b"DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    while (await reader.readline()) not in (b".\r\n", b""):
+                        pass
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    if self._random.random() < self.error_rate:
+                        self.rejected += 1
+                        writer.write(b"451 4.3.0 Try again later\r\n")
+                    else:
+                        accepted_at = time.perf_counter()
+                        self.deliveries.extend((recipient, accepted_at) for recipient in recipients)
+                        writer.write(b"250 2.0.0 Queued\r\n")
+                elif verb in (b"RSET", b"NOOP"):
+                    writer.write(b"250 2.0.0 OK\r\n")
+                elif verb == b"QUIT":
+                    writer.write(b"221 2.0.0 Bye\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b"502 5.5.2 Command not recognized\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -5,6 +5,7 @@ from alembic import context
 
 from src.database import Base
 from src.models.email_log import EmailLog  # Import all models here
+from src.models.email_log_rollup import EmailLogRollup
 
 config = context.config
 if config.config_file_name is not None:
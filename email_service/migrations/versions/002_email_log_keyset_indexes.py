@@ -0,0 +1,41 @@
+"""email log keyset indexes
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_email_logs_created_at_id': ['created_at', 'id'],
+    'ix_email_logs_email_to_created_at_id': ['email_to', 'created_at', 'id'],
+    'ix_email_logs_email_type_created_at_id': ['email_type', 'created_at', 'id'],
+    'ix_email_logs_status_created_at_id': ['status', 'created_at', 'id'],
+}
+
+def upgrade() -> None:
+    # 001 named the column "metadata" while the model maps "meta_data"
+    with op.batch_alter_table('email_logs') as batch_op:
+        batch_op.alter_column('metadata', new_column_name='meta_data')
+
+    # The composite indexes lead with these columns, so the single-column ones are redundant
+    op.drop_index('ix_email_logs_email_type', table_name='email_logs')
+    op.drop_index('ix_email_logs_email_to', table_name='email_logs')
+    for name, columns in INDEXES.items():
+        op.create_index(name, 'email_logs', columns, unique=False)
+
+def downgrade() -> None:
+    for name in INDEXES:
+        op.drop_index(name, table_name='email_logs')
+    op.create_index('ix_email_logs_email_to', 'email_logs', ['email_to'], unique=False)
+    op.create_index('ix_email_logs_email_type', 'email_logs', ['email_type'], unique=False)
+
+    with op.batch_alter_table('email_logs') as batch_op:
+        batch_op.alter_column('meta_data', new_column_name='metadata')
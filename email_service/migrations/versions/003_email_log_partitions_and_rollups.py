@@ -0,0 +1,94 @@
+"""email log partitions and rollups
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+from datetime import datetime
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_email_logs_created_at_id': ['created_at', 'id'],
+    'ix_email_logs_email_to_created_at_id': ['email_to', 'created_at', 'id'],
+    'ix_email_logs_email_type_created_at_id': ['email_type', 'created_at', 'id'],
+    'ix_email_logs_status_created_at_id': ['status', 'created_at', 'id'],
+}
+COLUMNS = 'id, email_to, email_type, status, meta_data, created_at, sent_at'
+PREMAKE_MONTHS = 2
+
+def _add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def _create_log_table(partitioned):
+    op.execute(
+        "CREATE TABLE email_logs ("
+        "id VARCHAR NOT NULL, "
+        "email_to VARCHAR NOT NULL, "
+        "email_type VARCHAR NOT NULL, "
+        "status VARCHAR NOT NULL, "
+        "meta_data JSON, "
+        "created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        "sent_at TIMESTAMP WITHOUT TIME ZONE, "
+        + ("PRIMARY KEY (id, created_at)) PARTITION BY RANGE (created_at)" if partitioned else "PRIMARY KEY (id))")
+    )
+
+def _swap_log_table(partitioned):
+    """Recreate email_logs (partitioned or plain) and copy the existing rows into it"""
+    for name in INDEXES:
+        op.drop_index(name, table_name='email_logs')
+    op.rename_table('email_logs', 'email_logs_old')
+    # Constraint names are schema-wide in Postgres, so free up the primary key's
+    op.execute("ALTER TABLE email_logs_old RENAME CONSTRAINT email_logs_pkey TO email_logs_old_pkey")
+    _create_log_table(partitioned)
+
+    if partitioned:
+        # Every month that already holds rows needs its partition before the copy
+        oldest = op.get_bind().execute(sa.text("SELECT MIN(created_at) FROM email_logs_old")).scalar()
+        now = datetime.utcnow()
+        month = datetime((oldest or now).year, (oldest or now).month, 1)
+        last = _add_months(datetime(now.year, now.month, 1), PREMAKE_MONTHS)
+        while month <= last:
+            op.execute(
+                f"CREATE TABLE email_logs_p{month:%Y%m} PARTITION OF email_logs "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_add_months(month, 1):%Y-%m-%d}')"
+            )
+            month = _add_months(month, 1)
+        op.execute("CREATE TABLE email_logs_default PARTITION OF email_logs DEFAULT")
+
+    op.execute(f"INSERT INTO email_logs ({COLUMNS}) SELECT {COLUMNS} FROM email_logs_old")
+    op.drop_table('email_logs_old')
+    for name, columns in INDEXES.items():
+        op.create_index(name, 'email_logs', columns, unique=False)
+
+def upgrade() -> None:
+    op.create_table(
+        'email_log_rollups',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('email_type', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'email_type', 'status')
+    )
+    op.execute(
+        "INSERT INTO email_log_rollups (day, email_type, status, count) "
+        "SELECT DATE(created_at), email_type, status, COUNT(*) FROM email_logs "
+        "GROUP BY DATE(created_at), email_type, status"
+    )
+
+    # SQLite has no native partitioning; the service rotates tables there instead
+    if op.get_bind().dialect.name == 'postgresql':
+        _swap_log_table(partitioned=True)
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        _swap_log_table(partitioned=False)
+    op.drop_table('email_log_rollups')
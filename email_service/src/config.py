@@ -1,20 +1,109 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, Optional
 import secrets
 
 class Settings(BaseSettings):
     # Service Info
     SERVICE_NAME: str = "Your Service"
     VERSION: str = "1.0.0"
+    DEBUG: bool = False  # Development mode, e.g. reload edited templates
     
     # Redis Settings
     REDIS_URL: str = "redis://redis:6379"
+    REDIS_MAX_CONNECTIONS: int = 50  # Shared pool size; pub/sub and stream reads each hold one
+    REDIS_POOL_TIMEOUT: float = 5.0  # Seconds a command waits for a free pooled connection
+    
+    # Redis Subscriber
+    SUBSCRIBER_QUEUE_SIZE: int = 1000  # Pending events per channel before reads pause
+    SUBSCRIBER_CHANNEL_CONCURRENCY: Dict[str, int] = {
+        "user_registration": 8,
+        "kaupskip:subscription": 4,
+        "kaupskip:marketing": 2
+    }
+    SUBSCRIBER_DRAIN_TIMEOUT: float = 30.0  # Seconds to finish queued events on shutdown
+    SUBSCRIBER_POLL_TIMEOUT: float = 1.0  # Seconds each pub/sub read blocks while idle
+    SUBSCRIBER_RECONNECT_MAX_BACKOFF: float = 30.0
+    SUBSCRIBER_MODE: str = "pubsub"  # "pubsub" or "streams"
+    IDEMPOTENCY_ENABLED: bool = True  # Drop events already handled (by event_id, else a payload hash)
+    IDEMPOTENCY_KEY_PREFIX: str = "kaupskip:idempotency:"
+    IDEMPOTENCY_TTL: int = 86400  # Seconds a handled event is remembered
+    IDEMPOTENCY_PROCESSING_TTL: int = 300  # Seconds an in-progress claim survives a crashed worker
+    
+    # Leader election (SUBSCRIBER_MODE=pubsub): one process across workers and replicas consumes pub/sub
+    LEADER_ELECTION_ENABLED: bool = True
+    LEADER_KEY: str = "kaupskip:subscriber:leader"
+    LEADER_ID: Optional[str] = None  # Defaults to hostname-pid
+    LEADER_LEASE_TTL: float = 10.0  # Seconds a leader that stops renewing keeps the lease
+    LEADER_RENEW_INTERVAL: float = 2.0  # Seconds between renewals and followers' takeover attempts
+    
+    # Redis Streams (SUBSCRIBER_MODE=streams)
+    STREAM_KEY_PREFIX: str = "kaupskip:stream:"  # Stream per channel, e.g. kaupskip:stream:user_registration
+    STREAM_GROUP: str = "kaupskip-email"
+    STREAM_CONSUMER: Optional[str] = None  # Defaults to hostname-pid
+    STREAM_BATCH_SIZE: int = 50  # Entries per XREADGROUP/XAUTOCLAIM call
+    STREAM_CLAIM_IDLE_MS: int = 60000  # Pending time before another consumer may claim an entry
+    STREAM_CLAIM_INTERVAL: float = 30.0
+    STREAM_MAX_DELIVERIES: int = 5  # Deliveries before an entry is dead-lettered
+    STREAM_DEAD_LETTER_KEY: str = "kaupskip:stream:dead_letter"
+    STREAM_DEAD_LETTER_MAXLEN: int = 10000
+    
+    # Batch sends
+    BATCH_SEND_CONCURRENCY: int = 10  # Recipients in flight per batch job
+    BATCH_MAX_RECIPIENTS: int = 10000  # Per POST /send/batch request or bulk event
+    BATCH_PROGRESS_INTERVAL: int = 100  # Sends between progress updates in Redis
+    BATCH_JOB_TTL: int = 86400  # Seconds a job's progress is kept in Redis
+    BATCH_KEY_PREFIX: str = "kaupskip:batch:"
+    
+    # Outbound retries
+    OUTBOUND_RETRY_KEY: str = "kaupskip:outbound:retry"  # Sorted set of message ids scored by due time
+    OUTBOUND_JOBS_KEY: str = "kaupskip:outbound:jobs"  # Hash of message id -> rendered message
+    OUTBOUND_DEAD_LETTER_KEY: str = "kaupskip:outbound:dead_letter"
+    OUTBOUND_DEAD_LETTER_MAXLEN: int = 10000
+    OUTBOUND_MAX_ATTEMPTS: int = 6  # Delivery attempts, counting the first, before dead-lettering
+    OUTBOUND_BASE_DELAY: float = 30.0  # Seconds before the first retry; doubles per attempt
+    OUTBOUND_MAX_DELAY: float = 3600.0
+    OUTBOUND_CONCURRENCY: int = 2  # Retries in flight, leaving the other SMTP slots to new mail
+    OUTBOUND_POLL_INTERVAL: float = 5.0  # Seconds between checks for due retries when idle
+    OUTBOUND_LEASE: float = 300.0  # Seconds a claimed retry stays hidden before it can be claimed again
+    
+    # Outbound rate limits (token buckets shared by all replicas through Redis)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_KEY_PREFIX: str = "kaupskip:ratelimit:"
+    RATE_LIMIT_RELAY_PER_SECOND: float = 10.0  # The SMTP relay's own cap
+    RATE_LIMIT_RELAY_BURST: int = 20
+    RATE_LIMIT_DOMAIN_PER_SECOND: float = 5.0  # Default per recipient domain
+    RATE_LIMIT_DOMAIN_BURST: int = 10
+    RATE_LIMIT_DOMAINS: Dict[str, float] = {}  # Per-domain overrides, e.g. {"gmail.com": 20}
+    RATE_LIMIT_MAX_WAIT: float = 30.0  # Seconds a send waits for a token before it is deferred
+    THROTTLE_BACKOFF_FACTOR: float = 0.5  # Domain rate multiplier applied on each 421/451 reply
+    THROTTLE_RECOVERY_STEP: float = 0.05  # Added back to the multiplier on each accepted message
+    THROTTLE_MIN_FACTOR: float = 0.1
     
     # SMTP Settings
     SMTP_HOST: str = "smtp.gmail.com"
     SMTP_PORT: int = 587
     SMTP_USER: str
     SMTP_PASSWORD: str
+    SMTP_TLS: bool = True
+    SMTP_MAX_CONCURRENCY: int = 10  # Parallel SMTP sends per process
+    SMTP_SEND_TIMEOUT: float = 30.0  # Seconds before a single send is abandoned
+    SMTP_POOL_MIN_SIZE: int = 1
+    SMTP_POOL_MAX_SIZE: int = 10
+    SMTP_POOL_IDLE_TIMEOUT: float = 60.0  # Seconds an idle connection is kept open
+    SMTP_POOL_MAX_MESSAGES: int = 100  # Messages sent before a connection is recycled
+    SMTP_POOL_HEALTH_CHECK_INTERVAL: float = 15.0  # Idle seconds before NOOP check on reuse
+    
+    # Templates
+    TEMPLATE_BYTECODE_CACHE_DIR: Optional[str] = None  # Persist compiled templates across restarts
+    TEMPLATE_INLINE_CSS: bool = True  # Inline <style> rules into templates at load time
+    TEMPLATE_MINIFY: bool = True  # Strip comments and collapse whitespace at load time
+    EMAIL_ASSETS: Dict[str, str] = {  # Template assets by name, relative to src/assets
+        "logo": "kaupskip-icons/apple-touch-icon/kaupskip-logo-180x180.png"
+    }
+    EMAIL_ASSET_MODE: str = "cid"  # "cid" (shared inline parts), "data_uri" or "off"
+    RENDER_POOL_ENABLED: bool = False  # Render batch campaigns in worker processes
+    RENDER_POOL_WORKERS: int = 0  # Worker processes; 0 uses one per CPU
+    RENDER_POOL_CHUNK_SIZE: int = 50  # Emails rendered per worker round trip
     
     # Security
     SECRET_KEY: str = secrets.token_urlsafe(32)  # Generate a default secret key if not provided
@@ -26,6 +115,20 @@ class Settings(BaseSettings):
     SITE_URL: str = "https://example.com"
     # Database Settings
     DATABASE_URL: str = "sqlite:///./email_service.db"
+    DB_POOL_SIZE: int = 10  # Ignored for SQLite
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800  # Seconds before a pooled connection is replaced
+    EMAIL_LOG_BATCH_SIZE: int = 100  # Rows per bulk insert
+    EMAIL_LOG_FLUSH_INTERVAL: float = 1.0  # Max seconds a row waits before being flushed
+    EMAIL_LOG_BUFFER_SIZE: int = 10000  # Buffered rows before senders wait on the database
+    EMAIL_LOG_FLUSH_TIMEOUT: float = 10.0  # Seconds to flush the buffer on shutdown
+    EMAIL_LOG_WRITE_RETRIES: int = 3  # Retries of a failed bulk insert before its rows are dropped
+    EMAIL_LOG_RETRY_DELAY: float = 0.5  # Seconds before the first retry; doubles per retry
+    EXPORT_BATCH_SIZE: int = 5000  # Rows fetched per server-side cursor batch in exports
+    LOG_RETENTION_DAYS: int = 90  # Raw email logs older than this are dropped a month at a time; 0 keeps them
+    LOG_PARTITION_PREMAKE_MONTHS: int = 2  # Postgres partitions created ahead of the current month
+    LOG_MAINTENANCE_INTERVAL: float = 3600.0  # Seconds between partition/retention passes
     
     class Config:
         env_file = ".env"
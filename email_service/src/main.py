@@ -1,18 +1,30 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import FastAPI, Depends, HTTPException, Query, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, datetime
+from typing import List, Literal, Optional
 import logging
 import asyncio
-from sqlalchemy import text
 
-from src.database import get_db, init_db
-from src.schemas.email import EmailVerificationRequest, EmailVerificationResponse, EmailLogResponse
+from src.database import SessionLocal, engine, get_db, init_db
+from src.schemas.email import (
+    EmailVerificationRequest, EmailVerificationResponse, EmailLogResponse, EmailLogRollupResponse,
+    BatchSendRequest, BatchJobResponse
+)
 from src.services.email_service import EmailService
 from src.services.verification_service import VerificationService
 from src.services.redis_subscriber import RedisSubscriber
+from src.services.batch_sender import BatchSender
+from src.services.leader_election import LeaderElection
+from src.services.outbound_queue import OutboundQueue
+from src.services.rate_limiter import RateLimiter
+from src.services.render_pool import get_render_pool
+from src.services.smtp_transport import get_smtp_transport
+from src.services.email_log_writer import get_email_log_writer
+from src.services.email_log_query import build_log_page_query, encode_cursor, stream_log_export
+from src.services.log_retention import build_rollup_query, get_log_retention_manager
 from src.utils.redis_manager import RedisManager
-from src.models.email_log import EmailLog
+from src.utils.metrics import CONTENT_TYPE_LATEST, render_metrics, update_runtime_gauges
 from src.config import settings
 
 # Configure logging
@@ -26,27 +38,68 @@ app = FastAPI(title=settings.SERVICE_NAME, version=settings.VERSION)
 
 # Store background tasks for cleanup
 background_tasks = set()
+redis_manager = None
 redis_subscriber = None
+subscriber_task = None
+batch_sender = None
+outbound_queue = None
+rate_limiter = None
+leader_election = None
 
 # Dependency Injection
 def get_redis():
-    return RedisManager()
+    if not redis_manager:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Redis is not available"
+        )
+    return redis_manager
 
 def get_verification_service(redis: RedisManager = Depends(get_redis)):
     return VerificationService(redis.get_main_connection())
 
-def get_email_service(db: Session = Depends(get_db)):
-    return EmailService(db)
+def get_email_service():
+    return EmailService(log_writer=get_email_log_writer(), retry_queue=outbound_queue, rate_limiter=rate_limiter)
+
+async def start_subscriber():
+    """Start consuming events in the background; with leader election only the leader calls this"""
+    global redis_subscriber, subscriber_task
+    redis_subscriber = RedisSubscriber(redis_manager, get_email_service(), batch_sender=batch_sender)
+    subscriber_task = asyncio.create_task(redis_subscriber.start_listening())
+    background_tasks.add(subscriber_task)
+    subscriber_task.add_done_callback(background_tasks.discard)
+    logger.info("Started Redis subscriber")
+
+def subscriber_running() -> bool:
+    return subscriber_task is not None and not subscriber_task.done()
+
+async def stop_subscriber():
+    global redis_subscriber
+    subscriber, redis_subscriber = redis_subscriber, None
+    if subscriber:
+        logger.info("Stopping Redis subscriber...")
+        await subscriber.stop()
 
 @app.on_event("startup")
 async def startup_event():
     try:
         # Initialize database
-        init_db()
+        await init_db()
         logger.info("Database initialized")
+        # Makes sure this month's partition exists before the first log row is written
+        retention = get_log_retention_manager()
+        await retention.run_once()
+        retention.start()
+        get_email_log_writer().start()
+        
+        # Open the shared SMTP connection pool
+        await get_smtp_transport().start()
         
-        # Start Redis subscriber in the background
+        # One Redis client and pool for the whole app; connections open lazily,
+        # so request handlers can use it once Redis comes up even if this ping fails
+        global redis_manager
         redis_manager = RedisManager()
+        
         connection = redis_manager.get_main_connection()
         try:
             await connection.execute_command('PING')
@@ -55,16 +108,29 @@ async def startup_event():
             logger.error(f"Redis connection failed: {str(redis_error)}")
             raise
         
-        db = next(get_db())
-        email_service = EmailService(db)
-        global redis_subscriber
-        redis_subscriber = RedisSubscriber(redis_manager, email_service)
+        global batch_sender, outbound_queue, rate_limiter, leader_election
+        if settings.RATE_LIMIT_ENABLED:
+            rate_limiter = RateLimiter(connection)
+        outbound_queue = OutboundQueue(connection, rate_limiter=rate_limiter)
+        outbound_queue.start()
+        render_pool = None
+        if settings.RENDER_POOL_ENABLED:
+            render_pool = get_render_pool()
+            await render_pool.start()
+        batch_sender = BatchSender(connection, get_email_service(), render_pool=render_pool)
         
-        # Start listening in the background
-        task = asyncio.create_task(redis_subscriber.start_listening())
-        background_tasks.add(task)
-        task.add_done_callback(background_tasks.discard)
-        logger.info("Started Redis subscriber")
+        # Every worker and replica receives every pub/sub message, so only the
+        # elected leader subscribes; stream consumer groups already split entries
+        if settings.SUBSCRIBER_MODE == "pubsub" and settings.LEADER_ELECTION_ENABLED:
+            leader_election = LeaderElection(
+                connection,
+                on_elected=start_subscriber,
+                on_demoted=stop_subscriber,
+                is_healthy=subscriber_running
+            )
+            leader_election.start()
+        else:
+            await start_subscriber()
     except Exception as e:
         logger.error(f"Startup failed: {str(e)}")
         # Don't raise the exception - allow the app to start without Redis
@@ -74,10 +140,16 @@ async def startup_event():
 async def shutdown_event():
     logger.info("Shutting down application...")
     
-    # Stop Redis subscriber
-    if redis_subscriber:
-        logger.info("Stopping Redis subscriber...")
-        await redis_subscriber.stop()
+    # Hand leadership over, then stop the Redis subscriber
+    if leader_election:
+        await leader_election.stop()
+    await stop_subscriber()
+    
+    if batch_sender:
+        await batch_sender.close()
+    
+    if outbound_queue:
+        await outbound_queue.stop()
     
     # Cancel all background tasks
     for task in background_tasks:
@@ -88,6 +160,18 @@ async def shutdown_event():
         except asyncio.CancelledError:
             pass
     
+    get_smtp_transport().close()
+    if settings.RENDER_POOL_ENABLED:
+        get_render_pool().close()
+    
+    if redis_manager:
+        await redis_manager.close()
+    
+    # Flush buffered email log rows
+    await get_email_log_writer().close()
+    await get_log_retention_manager().stop()
+    await engine.dispose()
+    
     logger.info("Application shutdown complete")
 
 @app.get("/health")
@@ -97,9 +181,62 @@ async def health_check():
         "status": "healthy"
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    update_runtime_gauges(redis_subscriber, get_smtp_transport(), redis_manager)
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/subscriber/stats")
+async def subscriber_stats():
+    """Redis subscriber loop counters and per-channel backlog"""
+    if not redis_subscriber:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Redis subscriber is not running"
+        )
+    return redis_subscriber.stats()
+
+@app.get("/leader")
+async def leader_status():
+    """Which process consumes pub/sub events, and the age of its lease in seconds"""
+    if not leader_election:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Leader election is not enabled"
+        )
+    return await leader_election.status()
+
+@app.get("/redis/stats")
+async def redis_stats(redis: RedisManager = Depends(get_redis)):
+    """Shared Redis connection pool usage"""
+    return redis.stats()
+
+def get_batch_sender():
+    if not batch_sender:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Batch sending is not available"
+        )
+    return batch_sender
+
+@app.post("/send/batch", response_model=BatchJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def send_batch(request: BatchSendRequest, sender: BatchSender = Depends(get_batch_sender)):
+    """Queue a campaign send; poll GET /send/batch/{job_id} for progress"""
+    job_id = await sender.submit(request.campaign, [r.model_dump() for r in request.recipients])
+    return await sender.get_job(job_id)
+
+@app.get("/send/batch/{job_id}", response_model=BatchJobResponse)
+async def get_batch_job(job_id: str, sender: BatchSender = Depends(get_batch_sender)):
+    job = await sender.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch job not found")
+    return job
+
 @app.post("/verify/email", response_model=EmailVerificationResponse)
 async def request_email_verification(
     request: EmailVerificationRequest,
+    response: Response,
     verification_service: VerificationService = Depends(get_verification_service),
     email_service: EmailService = Depends(get_email_service)
 ):
@@ -111,20 +248,32 @@ async def request_email_verification(
         )
         
         # Send verification email
-        success = await email_service.send_verification_email(
+        delivery = await email_service.send_verification_email(
             request.email,
             verification_code
         )
         
-        if not success:
+        if delivery == "failed":
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to send verification email"
             )
-            
+        if delivery == "sent":
+            return EmailVerificationResponse(
+                success=True,
+                message="Verification email sent successfully"
+            )
+        
+        # Accepted, but not delivered (yet)
+        response.status_code = status.HTTP_202_ACCEPTED
         return EmailVerificationResponse(
             success=True,
-            message="Verification email sent successfully"
+            message=(
+                "Verification email could not be delivered yet and is queued for retry"
+                if delivery == "deferred" else
+                "Verification email delivery could not be confirmed"
+            ),
+            status=delivery
         )
         
     except Exception as e:
@@ -152,12 +301,39 @@ async def check_verification_status(
 
 @app.get("/logs/email", response_model=List[EmailLogResponse])
 async def get_email_logs(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    email_to: Optional[str] = None,
+    email_type: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
 ):
+    """Newest-first email logs; pass the X-Next-Cursor header back as `cursor` for the next page
+
+    On SQLite only the current month is served: earlier months are rotated
+    into `email_logs_pYYYYMM` tables, which can be queried directly until
+    they expire. `/logs/email/rollups` covers every month.
+    """
+    try:
+        query = build_log_page_query(
+            limit,
+            cursor,
+            email_to=email_to,
+            email_type=email_type,
+            status=status_filter,
+            since=since,
+            until=until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     try:
-        logs = db.query(EmailLog).offset(skip).limit(limit).all()
+        result = await db.execute(query)
+        logs = result.scalars().all()
+        if len(logs) == limit:
+            response.headers["X-Next-Cursor"] = encode_cursor(logs[-1].created_at, logs[-1].id)
         return logs
     except Exception as e:
         logger.error(f"Error retrieving email logs: {str(e)}")
@@ -166,6 +342,53 @@ async def get_email_logs(
             detail=str(e)
         )
 
+@app.get("/logs/email/export")
+async def export_email_logs(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    email_to: Optional[str] = None,
+    email_type: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """Stream every matching email log, oldest first, without loading the result set into memory
+
+    On SQLite only the current month is exported; see `/logs/email`.
+    """
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_log_export(
+            SessionLocal,
+            export_format,
+            email_to=email_to,
+            email_type=email_type,
+            status=status_filter,
+            since=since,
+            until=until
+        ),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="email_logs.{export_format}"'}
+    )
+
+@app.get("/logs/email/rollups", response_model=List[EmailLogRollupResponse])
+async def get_email_log_rollups(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    email_type: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Daily email counts by type and status; kept after the raw logs expire"""
+    try:
+        result = await db.execute(build_rollup_query(since, until, email_type, status_filter))
+        return result.scalars().all()
+    except Exception as e:
+        logger.error(f"Error retrieving email log rollups: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     logger.error(f"Unhandled exception: {str(exc)}")
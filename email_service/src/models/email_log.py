@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, JSON
+from sqlalchemy import Column, String, DateTime, JSON, Index
 from sqlalchemy.dialects.postgresql import UUID
 from datetime import datetime
 import uuid
@@ -6,11 +6,21 @@ from ..database import Base
 
 class EmailLog(Base):
     __tablename__ = "email_logs"
+    __table_args__ = (
+        # Keyset pagination on (created_at, id), optionally narrowed by one filter column
+        Index("ix_email_logs_created_at_id", "created_at", "id"),
+        Index("ix_email_logs_email_to_created_at_id", "email_to", "created_at", "id"),
+        Index("ix_email_logs_email_type_created_at_id", "email_type", "created_at", "id"),
+        Index("ix_email_logs_status_created_at_id", "status", "created_at", "id"),
+        # On Postgres the table is split into monthly partitions (see services.log_retention);
+        # the partition key has to be part of the primary key
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     email_to = Column(String, nullable=False)
     email_type = Column(String, nullable=False)
     status = Column(String, nullable=False)
     meta_data = Column(JSON, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    sent_at = Column(DateTime, nullable=True)
\ No newline at end of file
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
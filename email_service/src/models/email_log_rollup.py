@@ -0,0 +1,11 @@
+from sqlalchemy import Column, String, Date, Integer
+from ..database import Base
+
+class EmailLogRollup(Base):
+    """Per-day email counts by type and status, kept in step with email_logs as rows are written"""
+    __tablename__ = "email_log_rollups"
+
+    day = Column(Date, primary_key=True)
+    email_type = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
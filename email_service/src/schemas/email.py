@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
-from datetime import datetime
+from pydantic import BaseModel, EmailStr, Field
+from typing import Any, Dict, List, Literal, Optional
+from datetime import date, datetime
+from ..config import settings
 
 class EmailVerificationRequest(BaseModel):
     user_id: str
@@ -9,6 +10,7 @@ class EmailVerificationRequest(BaseModel):
 class EmailVerificationResponse(BaseModel):
     success: bool
     message: str
+    status: Literal["sent", "deferred", "unknown"] = "sent"  # deferred/unknown: not confirmed delivered yet
 
 class EmailLogResponse(BaseModel):
     id: str
@@ -16,4 +18,28 @@ class EmailLogResponse(BaseModel):
     email_type: str
     status: str
     created_at: datetime
-    sent_at: Optional[datetime]
\ No newline at end of file
+    sent_at: Optional[datetime]
+
+class EmailLogRollupResponse(BaseModel):
+    day: date
+    email_type: str
+    status: str
+    count: int
+
+class BatchRecipient(BaseModel):
+    email: EmailStr
+    context: Dict[str, Any] = {}  # Template variables for this recipient
+
+class BatchSendRequest(BaseModel):
+    campaign: Literal["welcome", "trial_expired"]
+    recipients: List[BatchRecipient] = Field(..., min_length=1, max_length=settings.BATCH_MAX_RECIPIENTS)
+
+class BatchJobResponse(BaseModel):
+    job_id: str
+    campaign: str
+    status: str
+    total: int
+    sent: int
+    failed: int
+    created_at: datetime
+    finished_at: Optional[datetime] = None
\ No newline at end of file
@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+from pydantic import AfterValidator, TypeAdapter, ValidationError
+from typing import Annotated, Any, Dict, List, Optional, Union
+import orjson
+
+# Events are frozen, slotted dataclasses rather than BaseModels: they are
+# created for every message the subscriber reads and only ever read back.
+# Fields the service does not use are dropped during validation.
+
+# Publishers may send numeric ids; they are stored as strings so the
+# idempotency key is the same either way
+EventId = Annotated[Optional[Union[str, int]], AfterValidator(lambda value: None if value is None else str(value))]
+
+@dataclass(frozen=True, slots=True)
+class RegistrationEvent:
+    user_id: Union[str, int]
+    email: str
+    verification_token: str
+    verification_url: str
+    event_id: EventId = None
+    event_type: Optional[str] = None
+
+@dataclass(frozen=True, slots=True)
+class SubscriptionEvent:
+    event_type: str
+    user_id: Union[str, int]
+    email: str
+    tier: str
+    subscription_data: Dict[str, Any]
+    event_id: EventId = None
+
+@dataclass(frozen=True, slots=True)
+class MarketingEvent:
+    event_type: str
+    data: Dict[str, Any]
+    event_id: EventId = None
+
+Event = Union[RegistrationEvent, SubscriptionEvent, MarketingEvent]
+
+# Validators are compiled once, not per message
+EVENT_ADAPTERS: Dict[str, TypeAdapter] = {
+    "user_registration": TypeAdapter(RegistrationEvent),
+    "kaupskip:subscription": TypeAdapter(SubscriptionEvent),
+    "kaupskip:marketing": TypeAdapter(MarketingEvent)
+}
+
+class EventDecodeError(ValueError):
+    """A message that is not valid JSON or does not match its channel's event model
+
+    ``errors`` lists each problem as ``{"field": ..., "error": ...}``.
+    """
+
+    def __init__(self, channel: str, errors: List[Dict[str, str]]):
+        self.channel = channel
+        self.errors = errors
+        super().__init__(f"Invalid {channel} event: " + "; ".join(f"{e['field']}: {e['error']}" for e in errors))
+
+def decode_event(channel: str, raw: Union[str, bytes]) -> Event:
+    """Parse and validate one message from ``channel``, raising EventDecodeError if it is malformed"""
+    try:
+        payload = orjson.loads(raw)
+    except (TypeError, orjson.JSONDecodeError) as e:
+        raise EventDecodeError(channel, [{"field": "", "error": f"undecodable JSON: {str(e)}"}]) from None
+    try:
+        return EVENT_ADAPTERS[channel].validate_python(payload)
+    except ValidationError as e:
+        raise EventDecodeError(channel, [
+            {"field": ".".join(str(part) for part in error["loc"]), "error": error["msg"]}
+            for error in e.errors(include_url=False)
+        ]) from None
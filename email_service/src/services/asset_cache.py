@@ -0,0 +1,96 @@
+from emails import Message
+from emails.store import BaseFile
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+from ..config import settings
+import base64
+import hashlib
+import logging
+import mimetypes
+import os
+
+logger = logging.getLogger(__name__)
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'assets')
+CID_DOMAIN = "kaupskip"
+
+class Asset:
+    """One template asset, read and encoded once
+
+    The Content-ID is derived from the file's SHA-256, so every process and
+    replica references the same image by the same ``cid:`` and a changed
+    file gets a new one. The inline MIME part is built (and base64-encoded)
+    once and attached to every message as is.
+    """
+
+    def __init__(self, name: str, filename: str, data: bytes, mime_type: Optional[str] = None):
+        self.name = name
+        self.filename = filename
+        self.mime_type = mime_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.content_id = f"{self.digest[:32]}@{CID_DOMAIN}"
+        self.data_uri = f"data:{self.mime_type};base64,{base64.b64encode(data).decode()}"
+        self.part = BaseFile(
+            uri=f"asset:{name}",
+            filename=filename,
+            data=data,
+            mime_type=self.mime_type,
+            content_disposition="inline",
+            content_id=self.content_id
+        )
+        # Build the cached MIME part now, before messages are serialized on
+        # the SMTP threads
+        self.part.mime
+
+    @property
+    def src(self) -> str:
+        """Value for an <img src> referencing this asset in the configured mode"""
+        return f"cid:{self.content_id}" if settings.EMAIL_ASSET_MODE == "cid" else self.data_uri
+
+class AssetCache:
+    """Template assets loaded once, by name
+
+    With ``EMAIL_ASSET_MODE=cid`` templates reference assets as ``cid:``
+    URLs and each message carries the shared inline parts; with
+    ``data_uri`` the image is embedded in the body instead, for clients or
+    relays that strip inline parts; ``off`` leaves assets out entirely.
+    """
+
+    def __init__(self, paths: Optional[Dict[str, str]] = None):
+        self.assets: Dict[str, Asset] = {}
+        if settings.EMAIL_ASSET_MODE == "off":
+            return
+        for name, path in (settings.EMAIL_ASSETS if paths is None else paths).items():
+            full_path = path if os.path.isabs(path) else os.path.join(ASSETS_DIR, path)
+            try:
+                with open(full_path, "rb") as f:
+                    self.assets[name] = Asset(name, os.path.basename(full_path), f.read())
+            except OSError as e:
+                logger.error(f"Failed to load email asset {name} from {full_path}: {str(e)}")
+        logger.info(f"Loaded {len(self.assets)} email assets ({settings.EMAIL_ASSET_MODE})")
+
+    def template_globals(self) -> Dict[str, Optional[str]]:
+        """``<name>_src`` for every configured asset; None when it is off or could not be loaded"""
+        return {
+            f"{name}_src": self.assets[name].src if name in self.assets else None
+            for name in settings.EMAIL_ASSETS
+        }
+
+    def attach(self, message: Message, names: Optional[Iterable[str]] = None):
+        """Attach the inline parts for ``names`` (default: every asset) in cid mode"""
+        if settings.EMAIL_ASSET_MODE != "cid":
+            return
+        for name in self.assets if names is None else names:
+            asset = self.assets.get(name)
+            if asset is not None:
+                message.attachments.add(asset.part)
+
+    @staticmethod
+    def attached(message: Message) -> list:
+        """Names of the assets attached to ``message``, so a retry can attach them again"""
+        return [f.uri[len("asset:"):] for f in message.attachments if (f.uri or "").startswith("asset:")]
+
+@lru_cache
+def get_asset_cache() -> AssetCache:
+    """Process-wide asset cache, loaded on first use"""
+    return AssetCache()
@@ -0,0 +1,150 @@
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+from .email_service import EmailService
+from .email_types import EMAIL_TYPES
+from .render_pool import RenderPool
+from ..config import settings
+import asyncio
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+class BatchSender:
+    """Sends a campaign to many recipients in the background, tracking progress in Redis
+
+    Each job's state lives in a Redis hash (``BATCH_KEY_PREFIX<job_id>``), so
+    any replica can report on a job. Recipients are rendered and sent one at
+    a time by ``concurrency`` workers sharing an iterator. Messages are built
+    only when a worker is free to send them, and every send goes through the
+    pooled SMTP transport.
+
+    With a ``render_pool``, workers instead take ``chunk_size`` recipients at
+    a time and render the chunk in the pool's worker processes before sending
+    it, so rendering runs on other cores while the other workers send.
+    """
+
+    # Registered email types that may be sent as a campaign
+    CAMPAIGNS = ("welcome", "trial_expired")
+
+    def __init__(
+        self,
+        redis,
+        email_service: EmailService,
+        concurrency: Optional[int] = None,
+        progress_interval: Optional[int] = None,
+        render_pool: Optional[RenderPool] = None
+    ):
+        self.redis = redis
+        self.email_service = email_service
+        self.render_pool = render_pool
+        self.concurrency = concurrency or settings.BATCH_SEND_CONCURRENCY
+        self.progress_interval = progress_interval or settings.BATCH_PROGRESS_INTERVAL
+        self.job_ttl = settings.BATCH_JOB_TTL
+        self.key_prefix = settings.BATCH_KEY_PREFIX
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.key_prefix}{job_id}"
+
+    async def submit(self, campaign: str, recipients: Iterable[dict], job_id: Optional[str] = None) -> str:
+        """Record a new job and start sending it in the background; returns the job id
+
+        Each recipient is a dict with ``email`` and an optional ``context`` for the template.
+        """
+        if campaign not in self.CAMPAIGNS:
+            raise ValueError(f"Unknown campaign: {campaign}")
+        recipients = list(recipients)
+        job_id = job_id or uuid.uuid4().hex
+        key = self._job_key(job_id)
+        await self.redis.hset(key, mapping={
+            "job_id": job_id,
+            "campaign": campaign,
+            "status": "queued",
+            "total": len(recipients),
+            "sent": 0,
+            "failed": 0,
+            "created_at": datetime.utcnow().isoformat()
+        })
+        await self.redis.expire(key, self.job_ttl)
+
+        task = asyncio.create_task(self._run(job_id, campaign, recipients))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        logger.info(f"Queued batch job {job_id}: {campaign} to {len(recipients)} recipients")
+        return job_id
+
+    async def _run(self, job_id: str, campaign: str, recipients: list):
+        key = self._job_key(job_id)
+        email_type = EMAIL_TYPES[campaign]
+        chunk_size = self.render_pool.chunk_size if self.render_pool else 1
+        pending = (recipients[i:i + chunk_size] for i in range(0, len(recipients), chunk_size))
+        progress = {"sent": 0, "failed": 0}
+        unflushed = 0
+
+        def user_data(recipient: dict) -> dict:
+            return {**(recipient.get("context") or {}), "email": recipient["email"]}
+
+        async def send_one(recipient: dict, html: Optional[str]):
+            nonlocal unflushed
+            email = recipient["email"]
+            try:
+                sent = await self.email_service.send(campaign, email, user_data(recipient), html=html)
+            except Exception as e:
+                logger.error(f"Batch job {job_id} failed to send to {email}: {str(e)}")
+                sent = False
+            progress["sent" if sent else "failed"] += 1
+            unflushed += 1
+            if unflushed >= self.progress_interval:
+                unflushed = 0
+                await self.redis.hset(key, mapping=progress)
+
+        async def render(chunk: list) -> list:
+            if not self.render_pool:
+                return [None] * len(chunk)
+            # A body that fails to render comes back as None and is rendered inline on send
+            contexts = [email_type.build_context(r["email"], user_data(r)) for r in chunk]
+            try:
+                return await self.render_pool.render_many(email_type.template, contexts)
+            except Exception as e:
+                logger.error(f"Batch job {job_id} render pool failed, rendering inline: {str(e)}")
+                return [None] * len(chunk)
+
+        async def worker():
+            # Workers share one iterator, so each recipient is taken exactly once
+            for chunk in pending:
+                for recipient, html in zip(chunk, await render(chunk)):
+                    await send_one(recipient, html)
+
+        status = "failed"
+        try:
+            await self.redis.hset(key, "status", "running")
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(recipients)) or 1)))
+            status = "completed"
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Batch job {job_id} stopped: {str(e)}")
+        finally:
+            await self.redis.hset(key, mapping={
+                **progress,
+                "status": status,
+                "finished_at": datetime.utcnow().isoformat()
+            })
+            logger.info(f"Batch job {job_id} {status}: {progress['sent']} sent, {progress['failed']} failed")
+
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        job = await self.redis.hgetall(self._job_key(job_id))
+        if not job:
+            return None
+        for field in ("total", "sent", "failed"):
+            job[field] = int(job[field])
+        return job
+
+    async def close(self):
+        """Cancel running jobs; their progress so far stays recorded as cancelled"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,105 @@
+from datetime import datetime
+from sqlalchemy import Select, select, tuple_
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from typing import AsyncIterator, Optional, Tuple
+from ..config import settings
+from ..models.email_log import EmailLog
+import base64
+import csv
+import io
+import json
+
+def encode_cursor(created_at: datetime, log_id: str) -> str:
+    """Opaque cursor pointing just past (created_at, id)"""
+    raw = f"{created_at.isoformat()}|{log_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Raises ValueError for cursors that were not produced by encode_cursor"""
+    try:
+        created_at, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), log_id
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+def filter_logs(
+    query: Select,
+    email_to: Optional[str] = None,
+    email_type: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> Select:
+    if email_to is not None:
+        query = query.where(EmailLog.email_to == email_to)
+    if email_type is not None:
+        query = query.where(EmailLog.email_type == email_type)
+    if status is not None:
+        query = query.where(EmailLog.status == status)
+    if since is not None:
+        query = query.where(EmailLog.created_at >= since)
+    if until is not None:
+        query = query.where(EmailLog.created_at < until)
+    return query
+
+def build_log_page_query(limit: int, cursor: Optional[str] = None, **filters) -> Select:
+    """Newest-first page of email logs using keyset pagination on (created_at, id)
+
+    Seeks straight to the cursor through the (…, created_at, id) indexes, so
+    fetching a deep page costs the same as fetching the first one.
+    """
+    query = filter_logs(select(EmailLog), **filters)
+    if cursor:
+        created_at, log_id = decode_cursor(cursor)
+        query = query.where(tuple_(EmailLog.created_at, EmailLog.id) < tuple_(created_at, log_id))
+    return query.order_by(EmailLog.created_at.desc(), EmailLog.id.desc()).limit(limit)
+
+EXPORT_COLUMNS = ("id", "email_to", "email_type", "status", "meta_data", "created_at", "sent_at")
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _encode_ndjson(rows) -> str:
+    return "".join(
+        json.dumps({column: _export_value(value) for column, value in zip(EXPORT_COLUMNS, row)}) + "\n"
+        for row in rows
+    )
+
+def _encode_csv(rows, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([
+            json.dumps(value) if isinstance(value, dict) else _export_value(value)
+            for value in row
+        ])
+    return buffer.getvalue()
+
+async def stream_log_export(
+    session_factory: async_sessionmaker,
+    export_format: str = "ndjson",
+    batch_size: Optional[int] = None,
+    **filters
+) -> AsyncIterator[str]:
+    """Yield email logs oldest-first as NDJSON or CSV chunks
+
+    Rows come from a server-side cursor one ``batch_size`` partition at a
+    time and are encoded per partition, so memory stays flat no matter how
+    many rows match.
+    """
+    table = EmailLog.__table__
+    query = filter_logs(select(*(table.c[column] for column in EXPORT_COLUMNS)), **filters)
+    query = query.order_by(EmailLog.created_at, EmailLog.id).execution_options(
+        yield_per=batch_size or settings.EXPORT_BATCH_SIZE
+    )
+    if export_format == "csv":
+        yield _encode_csv([], header=True)
+
+    async with session_factory() as session:
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            yield _encode_csv(partition) if export_format == "csv" else _encode_ndjson(partition)
@@ -0,0 +1,135 @@
+from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import insert
+from typing import Optional
+from ..config import settings
+from ..database import SessionLocal
+from ..models.email_log import EmailLog
+from .log_retention import record_rollups
+from ..utils.metrics import EMAILS, EMAIL_LOG_ROWS_DROPPED, EMAIL_LOG_WRITE_SECONDS
+import asyncio
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class EmailLogWriter:
+    """Buffers EmailLog rows and writes them with bulk inserts in a background task
+
+    A batch is flushed once it reaches ``batch_size`` rows or ``flush_interval``
+    seconds after its first row, whichever comes first. The buffer holds at
+    most ``max_buffer`` rows; when the database falls behind, ``write`` waits
+    for room instead of letting memory grow. A failed insert is retried
+    ``write_retries`` times with doubling delays, which also holds new rows
+    in the buffer, before its rows are dropped and counted.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_buffer: Optional[int] = None,
+        write_retries: Optional[int] = None,
+        retry_delay: Optional[float] = None
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size or settings.EMAIL_LOG_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.EMAIL_LOG_FLUSH_INTERVAL
+        self.write_retries = settings.EMAIL_LOG_WRITE_RETRIES if write_retries is None else write_retries
+        self.retry_delay = settings.EMAIL_LOG_RETRY_DELAY if retry_delay is None else retry_delay
+        self._buffer = asyncio.Queue(maxsize=max_buffer or settings.EMAIL_LOG_BUFFER_SIZE)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Started email log writer")
+
+    async def write(self, email_to: str, email_type: str, status: str, meta_data: dict = None):
+        EMAILS.labels(email_type, status).inc()
+        now = datetime.utcnow()
+        row = {
+            "id": str(uuid.uuid4()),
+            "email_to": email_to,
+            "email_type": email_type,
+            "status": status,
+            "meta_data": meta_data,
+            "created_at": now,
+            "sent_at": now if status == "sent" else None
+        }
+        if self._task is None:
+            # Not started (e.g. startup failed): write through rather than
+            # buffering rows nothing will flush
+            await self._insert([row])
+            return
+        await self._buffer.put(row)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            row = await self._buffer.get()
+            if row is _STOP:
+                return
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._buffer.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: list):
+        delay = self.retry_delay
+        for attempt in range(self.write_retries + 1):
+            try:
+                # A failed insert rolls back whole, so the batch can be sent again as is
+                await self._insert(batch)
+                return
+            except Exception as e:
+                if attempt == self.write_retries:
+                    EMAIL_LOG_ROWS_DROPPED.inc(len(batch))
+                    logger.error(f"Dropped {len(batch)} email log rows after {attempt + 1} failed writes: {str(e)}")
+                    return
+                logger.warning(f"Failed to write {len(batch)} email log rows, retrying in {delay:.1f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _insert(self, rows: list):
+        with EMAIL_LOG_WRITE_SECONDS.labels("batch").time():
+            async with self.session_factory() as session:
+                await session.execute(insert(EmailLog), rows)
+                await record_rollups(session, rows)
+                await session.commit()
+
+    async def close(self, timeout: Optional[float] = None):
+        """Flush buffered rows, then stop the writer"""
+        if self._task is not None:
+            # Rows queued before the stop marker are flushed before the task exits
+            await self._buffer.put(_STOP)
+            try:
+                await asyncio.wait_for(self._task, timeout=timeout or settings.EMAIL_LOG_FLUSH_TIMEOUT)
+            except asyncio.TimeoutError:
+                dropped = self._buffer.qsize()
+                EMAIL_LOG_ROWS_DROPPED.inc(dropped)
+                logger.warning(f"Timed out flushing email log rows; dropped {dropped} on shutdown")
+            self._task = None
+        logger.info("Email log writer stopped")
+
+@lru_cache
+def get_email_log_writer() -> EmailLogWriter:
+    """Process-wide log writer shared by every EmailService instance"""
+    return EmailLogWriter()
@@ -1,268 +1,157 @@
 from emails import Message
-from jinja2 import Environment, FileSystemLoader
 from ..config import settings
+from ..database import SessionLocal
 from ..models.email_log import EmailLog
-from sqlalchemy.orm import Session
+from .asset_cache import get_asset_cache
+from .email_log_writer import EmailLogWriter
+from .email_types import EMAIL_TYPES, MAIL_FROM
+from .log_retention import record_rollups
+from .outbound_queue import OutboundQueue, describe_response
+from .rate_limiter import RateLimiter
+from .smtp_transport import SendOutcomeUnknown, SMTPTransport, get_smtp_transport
+from .template_engine import get_template_env
+from ..utils.metrics import EMAILS, EMAIL_LOG_WRITE_SECONDS, TEMPLATE_RENDER_SECONDS
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from datetime import datetime
 import logging
-import os
-import base64
 
 logger = logging.getLogger(__name__)
 
-def format_date(value):
-    """Convert ISO date string to a more readable format"""
-    if not value:
-        return ""
-    try:
-        if isinstance(value, str):
-            dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
-        else:
-            dt = value
-        return dt.strftime("%B %d, %Y")
-    except Exception as e:
-        logger.error(f"Error formatting date: {str(e)}")
-        return value
-
 class EmailService:
-    def __init__(self, db: Session):
-        self.db = db
-        template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
-        assets_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'assets')
-        # Temporarily disabled logo
-        # self.logo_path = os.path.join(assets_dir, 'apple-touch-icon', 'kaupskip-logo-180x180.png')
-        self.logo_path = None
-        
-        self.jinja_env = Environment(
-            loader=FileSystemLoader(template_dir),
-            autoescape=True
-        )
-        # Register filters
-        self.jinja_env.filters['date'] = format_date
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = SessionLocal,
+        transport: SMTPTransport = None,
+        log_writer: EmailLogWriter = None,
+        retry_queue: OutboundQueue = None,
+        rate_limiter: RateLimiter = None
+    ):
+        # Each log write without a writer gets its own short-lived session
+        self.session_factory = session_factory
+        self.transport = transport or get_smtp_transport()
+        self.log_writer = log_writer
+        # Failed sends are rescheduled here when set; otherwise they are only logged
+        self.retry_queue = retry_queue
+        self.rate_limiter = rate_limiter
+        self.assets = get_asset_cache()
         
-    def _get_logo_data(self):
-        """Read and encode the logo file as base64"""
-        # Temporarily disabled logo functionality
-        return None
-        # try:
-        #     logger.info(f"Attempting to read logo from path: {self.logo_path}")
-        #     if not os.path.exists(self.logo_path):
-        #         logger.error(f"Logo file does not exist at path: {self.logo_path}")
-        #         return None
-                
-        #     with open(self.logo_path, 'rb') as f:
-        #         image_data = f.read()
-        #         encoded_data = f"data:image/png;base64,{base64.b64encode(image_data).decode()}"
-        #         logger.info("Successfully encoded logo data")
-        #         return encoded_data
-        # except Exception as e:
-        #     logger.error(f"Error reading logo file: {str(e)}")
-        #     return None
+        # Shared, precompiled environment; static globals (service_name,
+        # site_url, current_year, logo_src, ...) are registered on it once
+        self.jinja_env = get_template_env()
         
     def _render_template(self, template_name: str, context: dict) -> str:
-        template = self.jinja_env.get_template(template_name)
-        context['service_name'] = settings.SERVICE_NAME
-        context['service_url'] = settings.MAIN_APP_URL
-        context['site_url'] = settings.SITE_URL
-        context['logo_data'] = self._get_logo_data()
-        context['current_year'] = datetime.now().year
-        return template.render(**context)
+        with TEMPLATE_RENDER_SECONDS.labels(template_name).time():
+            return self.jinja_env.get_template(template_name).render(context)
         
-    async def send_verification_email(self, email: str, code: str, verification_url: str = None):
+    async def send(self, email_type: str, email: str, data: dict, html: str = None) -> bool:
+        """Render and deliver one email of a registered type
+
+        ``data`` fills the type's template (see EmailType.build_context).
+        ``html`` is a body already rendered from that template, e.g. by a
+        RenderPool. Errors are logged as a failed send rather than raised.
+        Returns False only if the email failed for good; see send_with_status
+        to tell a delivered email from one queued for retry.
+        """
+        return await self.send_with_status(email_type, email, data, html) != "failed"
+
+    async def send_with_status(self, email_type: str, email: str, data: dict, html: str = None) -> str:
+        """Like send, but returns the logged outcome: sent, deferred, unknown or failed"""
+        kind = EMAIL_TYPES.get(email_type)
+        if kind is None:
+            logger.error(f"Unknown email type: {email_type}")
+            return "failed"
         try:
-            if verification_url is None:
-                verification_url = f"{settings.SITE_URL}/verify?token={code}"
-                
+            missing = kind.missing_fields(data)
+            if missing:
+                raise ValueError(f"Missing fields for {email_type} email: {', '.join(missing)}")
             message = Message(
-                subject="Verify Your Email",
-                html=self._render_template("verification.html", {
-                    "code": code, 
-                    "verification_url": verification_url,
-                    "expiry_hours": settings.VERIFICATION_EXPIRY_HOURS
-                }),
-                mail_from=f'"{settings.SERVICE_NAME}" <{settings.SMTP_USER}>'
-            )
-            
-            response = message.send(
-                to=email,
-                smtp={
-                    "host": settings.SMTP_HOST, #"smtp-relay.gmail.com"
-                    "port": settings.SMTP_PORT,
-                    "user": settings.SMTP_USER,
-                    "password": settings.SMTP_PASSWORD,
-                    "tls": True
-                }
+                subject=kind.build_subject(data),
+                html=html or self._render_template(kind.template, kind.build_context(email, data)),
+                mail_from=MAIL_FROM
             )
-            
-            self._log_email(email, "verification", "sent" if response.status_code == 250 else "failed")
-            return response.status_code == 250
+            self.assets.attach(message)
+            return await self._deliver(message, email, kind.name, kind.priority)
             
         except Exception as e:
-            logger.error(f"Error sending verification email: {str(e)}")
-            self._log_email(email, "verification", "failed", {"error": str(e)})
-            return False
+            logger.error(f"Error sending {email_type} email: {str(e)}")
+            await self._log_email(email, kind.name, "failed", {"error": str(e)})
+            return "failed"
+
+    async def send_verification_email(self, email: str, code: str, verification_url: str = None) -> str:
+        """Send a verification code; returns the outcome so the API can say whether it has gone out"""
+        if verification_url is None:
+            verification_url = f"{settings.SITE_URL}/verify?token={code}"
+        return await self.send_with_status("verification", email, {"code": code, "verification_url": verification_url})
 
     async def send_subscription_receipt(self, email: str, subscription_data: dict):
         """Send a subscription receipt email"""
-        try:
-            message = Message(
-                subject=f"Your {settings.SERVICE_NAME} {subscription_data['tier']} Plan Receipt",
-                html=self._render_template("subscription_receipt.html", {
-                    "email": email,
-                    "subscription_data": subscription_data
-                }),
-                mail_from=f'"{settings.SERVICE_NAME}" <{settings.SMTP_USER}>'
-            )
-            
-            response = message.send(
-                to=email,
-                smtp={
-                    "host": settings.SMTP_HOST, #"smtp-relay.gmail.com"
-                    "port": settings.SMTP_PORT,
-                    "user": settings.SMTP_USER,
-                    "password": settings.SMTP_PASSWORD,
-                    "tls": True
-                }
-            )
-            
-            self._log_email(email, "subscription_receipt", "sent" if response.status_code == 250 else "failed")
-            return response.status_code == 250
-            
-        except Exception as e:
-            logger.error(f"Error sending subscription receipt email: {str(e)}")
-            self._log_email(email, "subscription_receipt", "failed", {"error": str(e)})
-            return False
+        return await self.send("subscription_receipt", email, subscription_data)
 
     async def send_account_change_notification(self, email: str, subscription_data: dict):
         """Send an account change notification email"""
-        try:
-            message = Message(
-                subject=f"Your {settings.SERVICE_NAME} Account Update",
-                html=self._render_template("account_change.html", {
-                    "email": email,
-                    "subscription_data": subscription_data
-                }),
-                mail_from=f'"{settings.SERVICE_NAME}" <{settings.SMTP_USER}>'
-            )
-            
-            response = message.send(
-                to=email,
-                smtp={
-                    "host": settings.SMTP_HOST, #"smtp-relay.gmail.com"
-                    "port": settings.SMTP_PORT,
-                    "user": settings.SMTP_USER,
-                    "password": settings.SMTP_PASSWORD,
-                    "tls": True
-                }
-            )
-            
-            self._log_email(email, "account_change", "sent" if response.status_code == 250 else "failed")
-            return response.status_code == 250
-            
-        except Exception as e:
-            logger.error(f"Error sending account change email: {str(e)}")
-            self._log_email(email, "account_change", "failed", {"error": str(e)})
-            return False
+        return await self.send("account_change", email, subscription_data)
 
     async def send_subscription_cancelled(self, email: str, subscription_data: dict):
-        try:
-            message = Message(
-                subject=f"We'll Miss You at {settings.SERVICE_NAME}",
-                html=self._render_template("subscription_cancelled.html", {
-                    "email": email,
-                    "subscription_data": subscription_data
-                }),
-                mail_from=f'"{settings.SERVICE_NAME}" <{settings.SMTP_USER}>'
-            )
-            
-            response = message.send(
-                to=email,
-                smtp={
-                    "host": settings.SMTP_HOST, #"smtp-relay.gmail.com"
-                    "port": settings.SMTP_PORT,
-                    "user": settings.SMTP_USER,
-                    "password": settings.SMTP_PASSWORD,
-                    "tls": True
-                }
-            )
-            
-            self._log_email(email, "subscription_cancelled", "sent" if response.status_code == 250 else "failed")
-            return response.status_code == 250
+        return await self.send("subscription_cancelled", email, subscription_data)
             
+    async def _deliver(self, message: Message, email: str, email_type: str, priority: int = 0) -> str:
+        """Send a rendered message and log the outcome, which is also returned
+
+        "deferred" means the send failed and was handed to the retry queue. A
+        send that timed out mid-delivery may still arrive, so it is
+        "unknown" and is not sent again.
+        """
+        try:
+            if self.rate_limiter is not None:
+                # Waits before taking an SMTP slot; a send that cannot get a
+                # token in time is deferred like any other transient failure
+                await self.rate_limiter.acquire(email)
+            response = await self.transport.send(message, to=email, priority=priority)
+            status_code, error = describe_response(response)
+        except SendOutcomeUnknown as e:
+            logger.error(f"Outcome of {email_type} email to {email} is unknown, not retrying: {str(e)}")
+            await self._log_email(email, email_type, "unknown", {"error": str(e)})
+            return "unknown"
         except Exception as e:
-            logger.error(f"Error sending subscription cancellation email: {str(e)}")
-            self._log_email(email, "subscription_cancelled", "failed", {"error": str(e)})
-            return False
-            
-    def _log_email(self, email_to: str, email_type: str, status: str, meta_data: dict = None):
+            status_code, error = None, str(e) or type(e).__name__
+        if self.rate_limiter is not None:
+            await self.rate_limiter.observe(email, status_code)
+
+        if status_code == 250:
+            await self._log_email(email, email_type, "sent")
+            return "sent"
+        if self.retry_queue is not None:
+            # The queue logs the deferral or the final failure
+            scheduled = await self.retry_queue.defer(message, email, email_type, status_code, error)
+            return "deferred" if scheduled else "failed"
+        logger.error(f"Failed to send {email_type} email to {email}: {status_code} {error}")
+        await self._log_email(email, email_type, "failed", {"smtp_status": status_code, "error": error})
+        return "failed"
+
+    async def _log_email(self, email_to: str, email_type: str, status: str, meta_data: dict = None):
+        if self.log_writer is not None:
+            await self.log_writer.write(email_to, email_type, status, meta_data)
+            return
+        EMAILS.labels(email_type, status).inc()
+        now = datetime.utcnow()
         log = EmailLog(
             email_to=email_to,
             email_type=email_type,
             status=status,
             meta_data=meta_data,
-            sent_at=datetime.utcnow() if status == "sent" else None
+            created_at=now,
+            sent_at=now if status == "sent" else None
         )
-        self.db.add(log)
-        self.db.commit()
+        with EMAIL_LOG_WRITE_SECONDS.labels("inline").time():
+            async with self.session_factory() as session:
+                session.add(log)
+                await record_rollups(session, [{"created_at": now, "email_type": email_type, "status": status}])
+                await session.commit()
 
-    async def send_welcome_email(self, email: str, user_data: dict):
+    async def send_welcome_email(self, email: str, user_data: dict, html: str = None):
         """Send a welcome email for new users"""
-        try:
-            message = Message(
-                subject=f"Welcome to the {settings.SERVICE_NAME} Family!",
-                html=self._render_template("welcome.html", {
-                    "email": email,
-                    "user_data": user_data
-                }),
-                mail_from=f'"{settings.SERVICE_NAME}" <{settings.SMTP_USER}>'
-            )
-            
-            response = message.send(
-                to=email,
-                smtp={
-                    "host": settings.SMTP_HOST, #"smtp-relay.gmail.com"
-                    "port": settings.SMTP_PORT,
-                    "user": settings.SMTP_USER,
-                    "password": settings.SMTP_PASSWORD,
-                    "tls": True
-                }
-            )
-            
-            self._log_email(email, "welcome", "sent" if response.status_code == 250 else "failed")
-            return response.status_code == 250
-            
-        except Exception as e:
-            logger.error(f"Error sending welcome email: {str(e)}")
-            self._log_email(email, "welcome", "failed", {"error": str(e)})
-            return False
+        return await self.send("welcome", email, user_data, html=html)
 
-    async def send_trial_expired_email(self, email: str, user_data: dict):
+    async def send_trial_expired_email(self, email: str, user_data: dict, html: str = None):
         """Send a trial expired email with re-engagement content"""
-        try:
-            message = Message(
-                subject=f"Your {settings.SERVICE_NAME} Trial Has Expired",
-                html=self._render_template("trial_expired.html", {
-                    "email": email,
-                    "user_data": user_data
-                }),
-                mail_from=f'"{settings.SERVICE_NAME}" <{settings.SMTP_USER}>'
-            )
-            
-            response = message.send(
-                to=email,
-                smtp={
-                    "host": settings.SMTP_HOST, #"smtp-relay.gmail.com",
-                    "port": settings.SMTP_PORT,
-                    "user": settings.SMTP_USER,
-                    "password": settings.SMTP_PASSWORD,
-                    "tls": True
-                }
-            )
-            
-            self._log_email(email, "trial_expired", "sent" if response.status_code == 250 else "failed")
-            return response.status_code == 250
-            
-        except Exception as e:
-            logger.error(f"Error sending trial expired email: {str(e)}")
-            self._log_email(email, "trial_expired", "failed", {"error": str(e)})
-            return False
\ No newline at end of file
+        return await self.send("trial_expired", email, user_data, html=html)
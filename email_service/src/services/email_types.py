@@ -0,0 +1,91 @@
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple, Union
+from ..config import settings
+
+# Lower values take free SMTP slots first, so a verification code is not
+# stuck behind a marketing campaign
+PRIORITY_TRANSACTIONAL = 0
+PRIORITY_ACCOUNT = 1
+PRIORITY_MARKETING = 2
+
+# Built once; emails.Message takes a (name, address) pair without parsing it
+MAIL_FROM = (settings.SERVICE_NAME, settings.SMTP_USER)
+
+@dataclass(frozen=True)
+class EmailType:
+    """How one kind of email is built: its template, subject and what it needs
+
+    ``context_key`` names the template variable the send's data is passed
+    under, next to ``email``; without it the data, on top of ``defaults``,
+    is the whole context. ``required`` lists the keys the data must contain.
+    """
+
+    name: str
+    template: str
+    subject: Union[str, Callable[[dict], str]]
+    required: Tuple[str, ...] = ()
+    priority: int = PRIORITY_ACCOUNT
+    context_key: Optional[str] = None
+    defaults: Mapping[str, Any] = field(default_factory=lambda: MappingProxyType({}))
+
+    def build_subject(self, data: dict) -> str:
+        return self.subject if isinstance(self.subject, str) else self.subject(data)
+
+    def build_context(self, email: str, data: dict) -> dict:
+        if self.context_key is None:
+            return {**self.defaults, **data}
+        return {"email": email, self.context_key: data}
+
+    def missing_fields(self, data: dict) -> Tuple[str, ...]:
+        return tuple(key for key in self.required if key not in data)
+
+EMAIL_TYPES: Dict[str, EmailType] = {}
+
+def register_email_type(email_type: EmailType) -> EmailType:
+    if email_type.name in EMAIL_TYPES:
+        raise ValueError(f"Email type already registered: {email_type.name}")
+    EMAIL_TYPES[email_type.name] = email_type
+    return email_type
+
+register_email_type(EmailType(
+    name="verification",
+    template="verification.html",
+    subject="Verify Your Email",
+    required=("code", "verification_url"),
+    priority=PRIORITY_TRANSACTIONAL,
+    defaults=MappingProxyType({"expiry_hours": settings.VERIFICATION_EXPIRY_HOURS})
+))
+register_email_type(EmailType(
+    name="subscription_receipt",
+    template="subscription_receipt.html",
+    subject=lambda data: f"Your {settings.SERVICE_NAME} {data['tier']} Plan Receipt",
+    required=("tier",),
+    context_key="subscription_data"
+))
+register_email_type(EmailType(
+    name="account_change",
+    template="account_change.html",
+    subject=f"Your {settings.SERVICE_NAME} Account Update",
+    context_key="subscription_data"
+))
+register_email_type(EmailType(
+    name="subscription_cancelled",
+    template="subscription_cancelled.html",
+    subject=f"We'll Miss You at {settings.SERVICE_NAME}",
+    context_key="subscription_data"
+))
+register_email_type(EmailType(
+    name="welcome",
+    template="welcome.html",
+    subject=f"Welcome to the {settings.SERVICE_NAME} Family!",
+    priority=PRIORITY_MARKETING,
+    context_key="user_data"
+))
+register_email_type(EmailType(
+    name="trial_expired",
+    template="trial_expired.html",
+    subject=f"Your {settings.SERVICE_NAME} Trial Has Expired",
+    priority=PRIORITY_MARKETING,
+    context_key="user_data"
+))
@@ -0,0 +1,42 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+from .email_types import EMAIL_TYPES
+from ..schemas.events import Event, MarketingEvent, RegistrationEvent, SubscriptionEvent
+
+@dataclass(frozen=True)
+class EventRoute:
+    """Turns one kind of subscriber event into a send of a registered email type
+
+    ``extract`` takes the validated event and returns the recipient and the
+    email type's data.
+    """
+
+    email_type: str
+    extract: Callable[[Event], Tuple[Optional[str], dict]]
+
+def _registration(event: RegistrationEvent) -> Tuple[Optional[str], dict]:
+    return event.email, {"code": event.verification_token, "verification_url": event.verification_url}
+
+def _subscription(event: SubscriptionEvent) -> Tuple[Optional[str], dict]:
+    return event.email, event.subscription_data
+
+def _marketing(event: MarketingEvent) -> Tuple[Optional[str], dict]:
+    return event.data.get("email"), event.data
+
+# (channel, event_type) -> route; channels whose events carry no event_type
+# are keyed with None
+EVENT_ROUTES: Dict[Tuple[str, Optional[str]], EventRoute] = {}
+
+def register_event_route(channel: str, event_type: Optional[str], route: EventRoute) -> EventRoute:
+    if route.email_type not in EMAIL_TYPES:
+        raise ValueError(f"Unknown email type: {route.email_type}")
+    EVENT_ROUTES[(channel, event_type)] = route
+    return route
+
+register_event_route("user_registration", None, EventRoute("verification", _registration))
+register_event_route("kaupskip:subscription", "subscription_created", EventRoute("subscription_receipt", _subscription))
+register_event_route("kaupskip:subscription", "subscription_cancelled", EventRoute("subscription_cancelled", _subscription))
+register_event_route("kaupskip:subscription", "subscription_downgraded", EventRoute("account_change", _subscription))
+register_event_route("kaupskip:marketing", "marketing:oauth_signup", EventRoute("welcome", _marketing))
+register_event_route("kaupskip:marketing", "marketing:email_verified", EventRoute("welcome", _marketing))
+register_event_route("kaupskip:marketing", "marketing:trial_expired", EventRoute("trial_expired", _marketing))
@@ -0,0 +1,168 @@
+from typing import Awaitable, Callable, Optional
+from datetime import datetime, timezone
+from ..config import settings
+from ..utils.metrics import SUBSCRIBER_LEADER
+import asyncio
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+# Renew the lease if we hold it, take it if nobody does; one round trip per
+# tick for leader and followers alike. The lease's own TTL is stored with it
+# so any process can work out its age from PTTL without trusting clocks.
+_LEASE_SCRIPT = """
+local holder = redis.call('HGET', KEYS[1], 'id')
+if holder == ARGV[1] then
+    redis.call('HSET', KEYS[1], 'ttl_ms', ARGV[3])
+elseif not holder then
+    redis.call('HSET', KEYS[1], 'id', ARGV[1], 'acquired_at', ARGV[2], 'ttl_ms', ARGV[3])
+else
+    return 0
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# Only the holder may give the lease up
+_RELEASE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'id') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class LeaderElection:
+    """Elects the one process, across uvicorn workers and replicas, that runs ``on_elected``
+
+    Leadership is a lease in Redis that the leader renews every
+    ``renew_interval`` and followers try to take on the same schedule. A
+    leader that cannot renew steps down before its lease can expire, so two
+    processes never both believe they lead; one that shuts down releases the
+    lease so a follower takes over on its next tick instead of after the TTL.
+    ``is_healthy``, when given, is checked on every tick while leading; a
+    leader whose duties have died gives the lease up the same way.
+    """
+
+    def __init__(
+        self,
+        redis,
+        on_elected: Callable[[], Awaitable[None]],
+        on_demoted: Callable[[], Awaitable[None]],
+        is_healthy: Optional[Callable[[], bool]] = None,
+        identity: Optional[str] = None,
+        key: Optional[str] = None,
+        lease_ttl: Optional[float] = None,
+        renew_interval: Optional[float] = None
+    ):
+        self.redis = redis
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.is_healthy = is_healthy
+        self.identity = identity or settings.LEADER_ID or f"{socket.gethostname()}-{os.getpid()}"
+        self.key = key or settings.LEADER_KEY
+        self.lease_ttl = lease_ttl or settings.LEADER_LEASE_TTL
+        self.renew_interval = renew_interval or settings.LEADER_RENEW_INTERVAL
+        self._lease = redis.register_script(_LEASE_SCRIPT)
+        self._release = redis.register_script(_RELEASE_SCRIPT)
+        self.is_leader = False
+        # Monotonic time our lease runs out if it is not renewed again
+        self._lease_deadline = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def tick(self):
+        """Renew or try to take the lease once, switching roles if that changed"""
+        started = time.monotonic()
+        try:
+            held = await self._lease(
+                keys=[self.key],
+                args=[self.identity, datetime.now(timezone.utc).isoformat(), int(self.lease_ttl * 1000)]
+            )
+        except Exception as e:
+            logger.error(f"Error renewing leader lease: {str(e)}")
+            # Give up before the lease could expire and a follower take over
+            if self.is_leader and time.monotonic() + self.renew_interval >= self._lease_deadline:
+                logger.warning(f"{self.identity} could not renew its lease in time; stepping down")
+                await self._step_down()
+            return
+
+        if held:
+            self._lease_deadline = started + self.lease_ttl
+            if self.is_leader and self.is_healthy is not None and not self.is_healthy():
+                # Holding the lease without doing the work would stall every replica
+                logger.warning(f"{self.identity} leader duties stopped; giving up the lease")
+                await self._resign()
+            elif not self.is_leader:
+                self.is_leader = True
+                SUBSCRIBER_LEADER.set(1)
+                logger.info(f"{self.identity} elected leader")
+                try:
+                    await self.on_elected()
+                except Exception as e:
+                    logger.error(f"Error starting leader duties: {str(e)}")
+        elif self.is_leader:
+            logger.warning(f"{self.identity} lost its leader lease")
+            await self._step_down()
+
+    async def _step_down(self):
+        self.is_leader = False
+        SUBSCRIBER_LEADER.set(0)
+        try:
+            await self.on_demoted()
+        except Exception as e:
+            logger.error(f"Error stopping leader duties: {str(e)}")
+
+    async def _resign(self):
+        # Released before the duties are stopped so a follower takes over
+        # while this process drains; the overlap is at most one tick
+        try:
+            await self._release(keys=[self.key], args=[self.identity])
+        except Exception as e:
+            logger.error(f"Error releasing leader lease: {str(e)}")
+        await self._step_down()
+
+    async def _run(self):
+        while True:
+            await self.tick()
+            await asyncio.sleep(self.renew_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Started leader election as {self.identity}")
+
+    async def stop(self):
+        """Stop campaigning and hand the lease over if we hold it"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            await self._resign()
+
+    async def status(self) -> dict:
+        """The current leader and its lease, as seen in Redis"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(self.key)
+        pipe.pttl(self.key)
+        lease, remaining_ms = await pipe.execute()
+        if not lease or remaining_ms < 0:
+            return {
+                "leader": None,
+                "leader_since": None,
+                "lease_age": None,
+                "lease_expires_in": None,
+                "identity": self.identity,
+                "is_leader": self.is_leader
+            }
+        return {
+            "leader": lease.get("id"),
+            "leader_since": lease.get("acquired_at"),
+            # Time since the last renewal; stays below renew_interval while the leader is healthy
+            "lease_age": round((int(lease.get("ttl_ms", 0)) - remaining_ms) / 1000, 3),
+            "lease_expires_in": round(remaining_ms / 1000, 3),
+            "identity": self.identity,
+            "is_leader": self.is_leader
+        }
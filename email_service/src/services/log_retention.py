@@ -0,0 +1,221 @@
+from collections import Counter
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from sqlalchemy import column, func, insert, select, table, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from typing import Iterable, List, Optional
+from ..config import settings
+from ..database import engine as default_engine
+from ..models.email_log import EmailLog
+from ..models.email_log_rollup import EmailLogRollup
+import asyncio
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+LOG_TABLE = EmailLog.__tablename__
+DEFAULT_PARTITION = f"{LOG_TABLE}_default"
+_PARTITION_NAME = re.compile(rf"^{LOG_TABLE}_p(\d{{4}})(\d{{2}})$")
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+def add_months(value: datetime, months: int) -> datetime:
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: datetime) -> str:
+    return f"{LOG_TABLE}_p{month:%Y%m}"
+
+def parse_partition_name(name: str) -> Optional[datetime]:
+    """Month covered by a partition table, or None if the name is not one of ours"""
+    match = _PARTITION_NAME.match(name)
+    if not match:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1)
+
+async def record_rollups(session, rows: Iterable[dict]):
+    """Add a batch of email log rows to the daily rollup counts
+
+    Runs in the caller's transaction so the counts commit together with the rows.
+    """
+    counts = Counter((row["created_at"].date(), row["email_type"], row["status"]) for row in rows)
+    if not counts:
+        return
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(EmailLogRollup).values([
+        {"day": day, "email_type": email_type, "status": status, "count": count}
+        for (day, email_type, status), count in counts.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "email_type", "status"],
+        set_={"count": EmailLogRollup.count + stmt.excluded.count}
+    )
+    await session.execute(stmt)
+
+def build_rollup_query(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    email_type: Optional[str] = None,
+    status: Optional[str] = None
+):
+    query = select(EmailLogRollup)
+    if since is not None:
+        query = query.where(EmailLogRollup.day >= since)
+    if until is not None:
+        query = query.where(EmailLogRollup.day <= until)
+    if email_type:
+        query = query.where(EmailLogRollup.email_type == email_type)
+    if status:
+        query = query.where(EmailLogRollup.status == status)
+    return query.order_by(EmailLogRollup.day, EmailLogRollup.email_type, EmailLogRollup.status)
+
+class LogRetentionManager:
+    """Keeps email_logs split into monthly partitions and drops the ones past retention
+
+    On Postgres email_logs is natively range-partitioned by ``created_at``:
+    partitions are created ``premake_months`` ahead and expired ones are
+    dropped whole. SQLite has no partitioning, so the live table is rotated
+    into ``email_logs_pYYYYMM`` once a month and rotated tables are dropped
+    when they expire. Either way retention never runs a bulk DELETE, and the
+    daily rollups outlive the raw rows.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine = default_engine,
+        retention_days: Optional[int] = None,
+        premake_months: Optional[int] = None,
+        interval: Optional[float] = None
+    ):
+        self.engine = engine
+        self.retention_days = settings.LOG_RETENTION_DAYS if retention_days is None else retention_days
+        self.premake_months = settings.LOG_PARTITION_PREMAKE_MONTHS if premake_months is None else premake_months
+        self.interval = interval or settings.LOG_MAINTENANCE_INTERVAL
+        self._task: Optional[asyncio.Task] = None
+
+    def _cutoff(self, now: datetime) -> Optional[datetime]:
+        if self.retention_days <= 0:
+            return None
+        return now - timedelta(days=self.retention_days)
+
+    async def run_once(self, now: Optional[datetime] = None) -> List[str]:
+        """Create upcoming partitions and drop expired ones; returns the dropped table names"""
+        now = now or datetime.utcnow()
+        async with self.engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                return await self._maintain_postgres(conn, now)
+            if conn.dialect.name == "sqlite":
+                return await self._maintain_sqlite(conn, now)
+        logger.warning(f"Log retention is not supported on {conn.dialect.name}")
+        return []
+
+    async def _drop_expired(self, conn: AsyncConnection, names: Iterable[str], now: datetime) -> List[str]:
+        cutoff = self._cutoff(now)
+        if cutoff is None:
+            return []
+        dropped = []
+        for name in sorted(names):
+            month = parse_partition_name(name)
+            # Only drop once every row the partition can hold is past the cutoff
+            if month is None or add_months(month, 1) > cutoff:
+                continue
+            await conn.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+            dropped.append(name)
+            logger.info(f"Dropped expired email log partition {name}")
+        return dropped
+
+    async def _maintain_postgres(self, conn: AsyncConnection, now: datetime) -> List[str]:
+        partitioned = await conn.scalar(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :name)"
+        ), {"name": LOG_TABLE})
+        if not partitioned:
+            logger.warning(f"{LOG_TABLE} is not partitioned; run the migrations to enable retention")
+            return []
+
+        current = month_start(now)
+        for offset in range(self.premake_months + 1):
+            month = add_months(current, offset)
+            await conn.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{partition_name(month)}" PARTITION OF {LOG_TABLE} '
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+            ))
+        # Catches rows outside every monthly range instead of failing the insert
+        await conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{DEFAULT_PARTITION}" PARTITION OF {LOG_TABLE} DEFAULT'))
+
+        result = await conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :name"
+        ), {"name": LOG_TABLE})
+        return await self._drop_expired(conn, result.scalars().all(), now)
+
+    async def _maintain_sqlite(self, conn: AsyncConnection, now: datetime) -> List[str]:
+        boundary = month_start(now)
+        oldest = await conn.scalar(select(func.min(EmailLog.created_at)))
+        if oldest is not None and oldest < boundary:
+            await self._rotate_sqlite(conn, boundary)
+
+        result = await conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :pattern"
+        ), {"pattern": f"{LOG_TABLE}_p%"})
+        return await self._drop_expired(conn, result.scalars().all(), now)
+
+    async def _rotate_sqlite(self, conn: AsyncConnection, boundary: datetime):
+        """Move rows older than ``boundary`` out of the live table into a rotated table"""
+        name = partition_name(add_months(boundary, -1))
+        live = EmailLog.__table__
+        columns = [c.name for c in live.columns]
+        segment = table(name, *[column(c.name, c.type) for c in live.columns])
+        exists = await conn.scalar(text(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = :name"
+        ), {"name": name})
+
+        if exists:
+            # Late rows for a month that was already rotated; there are few of them
+            await conn.execute(
+                insert(segment).from_select(columns, select(live).where(live.c.created_at < boundary))
+            )
+            await conn.execute(live.delete().where(live.c.created_at < boundary))
+            return
+
+        # Renaming is O(1); only the handful of rows written since the boundary are copied back.
+        # Index names are global in SQLite, so the old ones go before the table is recreated.
+        for index in live.indexes:
+            await conn.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+        await conn.execute(text(f'ALTER TABLE {LOG_TABLE} RENAME TO "{name}"'))
+        await conn.run_sync(live.create)
+        await conn.execute(
+            insert(live).from_select(columns, select(segment).where(segment.c.created_at >= boundary))
+        )
+        await conn.execute(segment.delete().where(segment.c.created_at >= boundary))
+        logger.info(f"Rotated {LOG_TABLE} rows before {boundary:%Y-%m-%d} into {name}")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Email log retention pass failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Started email log retention")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+@lru_cache
+def get_log_retention_manager() -> LogRetentionManager:
+    return LogRetentionManager()
@@ -0,0 +1,229 @@
+from emails import Message
+from typing import Optional, Tuple
+from ..config import settings
+from .asset_cache import AssetCache, get_asset_cache
+from .email_log_writer import EmailLogWriter, get_email_log_writer
+from .email_types import EMAIL_TYPES, PRIORITY_ACCOUNT
+from .rate_limiter import RateLimiter
+from .smtp_transport import SendOutcomeUnknown, SMTPTransport, get_smtp_transport
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Atomically take up to ARGV[2] due ids and push their score out by the lease,
+# so a replica that dies mid-send does not lose the message
+_CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, id in ipairs(due) do
+    redis.call('ZADD', KEYS[1], ARGV[3], id)
+end
+return due
+"""
+
+def is_transient(status_code: Optional[int]) -> bool:
+    """4xx replies and sends that got no reply at all (timeouts, dropped
+    connections) may succeed later; 5xx replies will not"""
+    return status_code is None or 400 <= status_code < 500
+
+def describe_response(response) -> Tuple[Optional[int], str]:
+    """SMTP status code and a printable reason for a transport response"""
+    text = response.status_text
+    if isinstance(text, bytes):
+        text = text.decode(errors="replace")
+    if response.error is not None:
+        text = str(response.error)
+    return response.status_code, text or ""
+
+class OutboundQueue:
+    """Redis-backed retry schedule for messages whose delivery failed
+
+    Rendered messages are kept in a hash and their ids in a sorted set scored
+    by when they are next due. Transient failures are retried with
+    exponential backoff and jitter until ``max_attempts``; permanent (5xx)
+    failures and exhausted messages go to a capped dead-letter list. Retries
+    run in their own task with at most ``concurrency`` sends in flight, so
+    they never take more than that share of the SMTP transport from new mail.
+    """
+
+    def __init__(
+        self,
+        redis,
+        transport: SMTPTransport = None,
+        log_writer: EmailLogWriter = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_attempts: Optional[int] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+        concurrency: Optional[int] = None
+    ):
+        self.redis = redis
+        self.transport = transport or get_smtp_transport()
+        self.log_writer = log_writer or get_email_log_writer()
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts or settings.OUTBOUND_MAX_ATTEMPTS
+        self.base_delay = base_delay or settings.OUTBOUND_BASE_DELAY
+        self.max_delay = max_delay or settings.OUTBOUND_MAX_DELAY
+        self.concurrency = concurrency or settings.OUTBOUND_CONCURRENCY
+        self.poll_interval = settings.OUTBOUND_POLL_INTERVAL
+        self.lease = settings.OUTBOUND_LEASE
+        self.retry_key = settings.OUTBOUND_RETRY_KEY
+        self.jobs_key = settings.OUTBOUND_JOBS_KEY
+        self.dead_letter_key = settings.OUTBOUND_DEAD_LETTER_KEY
+        self.dead_letter_maxlen = settings.OUTBOUND_DEAD_LETTER_MAXLEN
+        self._claim = redis.register_script(_CLAIM_SCRIPT)
+        self._inflight = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def backoff(self, attempts: int) -> float:
+        """Delay before the next attempt: doubling per attempt, capped, with the
+        upper half randomised so failures from one outage do not retry in lockstep"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    async def defer(
+        self,
+        message: Message,
+        to: str,
+        email_type: str,
+        status_code: Optional[int],
+        error: str
+    ) -> bool:
+        """Take over a message whose first attempt failed
+
+        Returns True if a retry was scheduled, False if it was dead-lettered.
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "to": to,
+            "email_type": email_type,
+            "subject": message.subject,
+            "html": message.html,
+            "mail_from": list(message.mail_from),
+            # Inline parts are not stored; they are reattached from the asset cache
+            "assets": AssetCache.attached(message),
+            "attempts": 1
+        }
+        return await self._reschedule(job, status_code, error)
+
+    async def _reschedule(self, job: dict, status_code: Optional[int], error: str) -> bool:
+        job["last_status"] = status_code
+        job["last_error"] = error
+        meta = {"attempts": job["attempts"], "smtp_status": status_code, "error": error}
+        if not is_transient(status_code) or job["attempts"] >= self.max_attempts:
+            await self._dead_letter(job)
+            await self.log_writer.write(job["to"], job["email_type"], "failed", meta)
+            return False
+
+        delay = self.backoff(job["attempts"])
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self.jobs_key, job["id"], json.dumps(job))
+        pipe.zadd(self.retry_key, {job["id"]: time.time() + delay})
+        await pipe.execute()
+        logger.warning(
+            f"Delivery to {job['to']} failed ({status_code}: {error}); "
+            f"attempt {job['attempts'] + 1} in {delay:.0f}s"
+        )
+        await self.log_writer.write(job["to"], job["email_type"], "deferred", meta)
+        return True
+
+    async def _dead_letter(self, job: dict):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lpush(self.dead_letter_key, json.dumps(job))
+        pipe.ltrim(self.dead_letter_key, 0, self.dead_letter_maxlen - 1)
+        pipe.zrem(self.retry_key, job["id"])
+        pipe.hdel(self.jobs_key, job["id"])
+        await pipe.execute()
+        logger.error(
+            f"Dead-lettered {job['email_type']} email to {job['to']} after {job['attempts']} attempts: "
+            f"{job['last_status']} {job['last_error']}"
+        )
+
+    async def _remove(self, job_id: str):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zrem(self.retry_key, job_id)
+        pipe.hdel(self.jobs_key, job_id)
+        await pipe.execute()
+
+    async def _attempt(self, job_id: str):
+        raw = await self.redis.hget(self.jobs_key, job_id)
+        if raw is None:
+            await self.redis.zrem(self.retry_key, job_id)
+            return
+        job = json.loads(raw)
+        job["attempts"] += 1
+        message = Message(subject=job["subject"], html=job["html"], mail_from=tuple(job["mail_from"]))
+        get_asset_cache().attach(message, job.get("assets", []))
+        try:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(job["to"])
+            email_type = EMAIL_TYPES.get(job["email_type"])
+            priority = email_type.priority if email_type else PRIORITY_ACCOUNT
+            response = await self.transport.send(message, to=job["to"], priority=priority)
+            status_code, error = describe_response(response)
+        except SendOutcomeUnknown as e:
+            # The relay may still accept it; another attempt could deliver it twice
+            logger.error(f"Outcome of retried email to {job['to']} is unknown, dropping it: {str(e)}")
+            await self._remove(job_id)
+            await self.log_writer.write(job["to"], job["email_type"], "unknown", {"attempts": job["attempts"], "error": str(e)})
+            return
+        except Exception as e:
+            status_code, error = None, str(e) or type(e).__name__
+        if self.rate_limiter is not None:
+            await self.rate_limiter.observe(job["to"], status_code)
+
+        if status_code == 250:
+            await self._remove(job_id)
+            await self.log_writer.write(job["to"], job["email_type"], "sent", {"attempts": job["attempts"]})
+            return
+        await self._reschedule(job, status_code, error)
+
+    async def _attempt_logged(self, job_id: str):
+        try:
+            await self._attempt(job_id)
+        except Exception as e:
+            # The lease expires and the message is picked up again
+            logger.error(f"Error retrying outbound message {job_id}: {str(e)}")
+
+    async def _run(self):
+        while True:
+            claimed = []
+            free = self.concurrency - len(self._inflight)
+            if free > 0:
+                now = time.time()
+                try:
+                    claimed = await self._claim(keys=[self.retry_key], args=[now, free, now + self.lease])
+                except Exception as e:
+                    logger.error(f"Error claiming due retries: {str(e)}")
+            for job_id in claimed:
+                task = asyncio.create_task(self._attempt_logged(job_id))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+            if self._inflight and (claimed or free <= 0):
+                # Busy: wake as soon as a slot frees up
+                await asyncio.wait(self._inflight, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+            elif not claimed:
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Started outbound retry scheduler")
+
+    async def stop(self):
+        """Stop claiming retries and let in-flight attempts finish; any cut off are retried after their lease"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._inflight:
+            await asyncio.wait(self._inflight, timeout=self.transport.send_timeout)
+        for task in list(self._inflight):
+            task.cancel()
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+        logger.info("Outbound retry scheduler stopped")
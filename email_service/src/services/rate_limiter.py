@@ -0,0 +1,151 @@
+from typing import Dict, Optional
+from ..config import settings
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Replies receivers use to say "slow down"
+THROTTLE_CODES = (421, 451)
+
+# Seconds an unused bucket (and any slowdown recorded on it) is kept
+_IDLE_TTL = 600
+
+# Takes one token from every bucket in KEYS, or from none of them. ARGV holds
+# (rate, capacity) per key. Returns the seconds to wait before trying again
+# (0 when granted) and the first bucket's throttle factor. Time comes from the
+# Redis server so replicas with skewed clocks share one view of each bucket.
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local wait = 0
+local buckets = {}
+for i, key in ipairs(KEYS) do
+    local state = redis.call('HMGET', key, 'tokens', 'ts', 'factor')
+    local factor = tonumber(state[3]) or 1
+    local rate = tonumber(ARGV[2 * i - 1]) * factor
+    local capacity = tonumber(ARGV[2 * i])
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+    buckets[i] = {tokens, factor}
+end
+if wait == 0 then
+    for i, key in ipairs(KEYS) do
+        redis.call('HSET', key, 'tokens', buckets[i][1] - 1, 'ts', now)
+        redis.call('EXPIRE', key, ARGV[#ARGV])
+    end
+end
+return {tostring(wait), tostring(buckets[1][2])}
+"""
+
+# Multiplicative decrease / additive increase of a bucket's throttle factor.
+# ARGV: 'down' or 'up', multiplier or step, minimum factor, cooldown, ttl.
+# Decreases closer together than the cooldown count once, so one burst of
+# 421s halves the rate once instead of collapsing it to the minimum.
+_ADJUST_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'factor', 'penalized_at')
+local factor = tonumber(state[1]) or 1
+if ARGV[1] == 'down' then
+    if now - (tonumber(state[2]) or 0) >= tonumber(ARGV[4]) then
+        factor = math.max(tonumber(ARGV[3]), factor * tonumber(ARGV[2]))
+        redis.call('HSET', KEYS[1], 'factor', factor, 'penalized_at', now)
+    end
+else
+    factor = math.min(1, factor + tonumber(ARGV[2]))
+    redis.call('HSET', KEYS[1], 'factor', factor)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return tostring(factor)
+"""
+
+class RateLimitExceeded(Exception):
+    """Raised when no send slot frees up within the limiter's max wait"""
+
+class RateLimiter:
+    """Token buckets per recipient domain and for the relay, shared across replicas
+
+    A send needs a token from both its domain's bucket and the relay bucket.
+    421/451 replies from a domain cut that domain's rate by
+    ``THROTTLE_BACKOFF_FACTOR``; each accepted message adds
+    ``THROTTLE_RECOVERY_STEP`` back until the configured rate is reached.
+    If Redis is unreachable sends go ahead unthrottled rather than stalling.
+    """
+
+    def __init__(
+        self,
+        redis,
+        relay_rate: Optional[float] = None,
+        relay_burst: Optional[int] = None,
+        domain_rate: Optional[float] = None,
+        domain_burst: Optional[int] = None,
+        domain_rates: Optional[Dict[str, float]] = None,
+        max_wait: Optional[float] = None
+    ):
+        self.relay_rate = relay_rate or settings.RATE_LIMIT_RELAY_PER_SECOND
+        self.relay_burst = relay_burst or settings.RATE_LIMIT_RELAY_BURST
+        self.domain_rate = domain_rate or settings.RATE_LIMIT_DOMAIN_PER_SECOND
+        self.domain_burst = domain_burst or settings.RATE_LIMIT_DOMAIN_BURST
+        self.domain_rates = settings.RATE_LIMIT_DOMAINS if domain_rates is None else domain_rates
+        self.max_wait = settings.RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        self.key_prefix = settings.RATE_LIMIT_KEY_PREFIX
+        self._acquire = redis.register_script(_ACQUIRE_SCRIPT)
+        self._adjust = redis.register_script(_ADJUST_SCRIPT)
+        # Last throttle factor seen per domain; saves a round trip per
+        # accepted message when a domain is not being throttled
+        self._factors: Dict[str, float] = {}
+
+    @staticmethod
+    def domain_of(email: str) -> str:
+        return email.rsplit("@", 1)[-1].lower()
+
+    def _domain_key(self, domain: str) -> str:
+        return f"{self.key_prefix}domain:{domain}"
+
+    async def acquire(self, email: str):
+        """Wait for a send slot to ``email``'s domain, raising RateLimitExceeded after ``max_wait``"""
+        domain = self.domain_of(email)
+        rate = self.domain_rates.get(domain, self.domain_rate)
+        keys = [self._domain_key(domain), f"{self.key_prefix}relay"]
+        args = [rate, max(self.domain_burst, rate), self.relay_rate, self.relay_burst, _IDLE_TTL]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while True:
+            try:
+                wait, factor = await self._acquire(keys=keys, args=args)
+            except Exception as e:
+                logger.warning(f"Rate limiter unavailable, sending unthrottled: {str(e)}")
+                return
+            self._factors[domain] = float(factor)
+            wait = float(wait)
+            if wait <= 0:
+                return
+            if loop.time() + wait > deadline:
+                raise RateLimitExceeded(f"No send slot for {domain} within {self.max_wait}s")
+            await asyncio.sleep(wait)
+
+    async def observe(self, email: str, status_code: Optional[int]):
+        """Feed a send's SMTP reply back into the domain's throttle factor"""
+        domain = self.domain_of(email)
+        if status_code in THROTTLE_CODES:
+            args = ["down", settings.THROTTLE_BACKOFF_FACTOR, settings.THROTTLE_MIN_FACTOR, 1, _IDLE_TTL]
+        elif status_code == 250 and self._factors.get(domain, 1.0) < 1:
+            args = ["up", settings.THROTTLE_RECOVERY_STEP, settings.THROTTLE_MIN_FACTOR, 1, _IDLE_TTL]
+        else:
+            return
+        try:
+            factor = float(await self._adjust(keys=[self._domain_key(domain)], args=args))
+        except Exception as e:
+            logger.warning(f"Failed to update throttle for {domain}: {str(e)}")
+            return
+        if factor < self._factors.get(domain, 1.0):
+            logger.warning(f"{domain} replied {status_code}; sending at {factor:.0%} of its rate")
+        self._factors[domain] = factor
+
+    def throttled_domains(self) -> Dict[str, float]:
+        return {domain: factor for domain, factor in self._factors.items() if factor < 1}
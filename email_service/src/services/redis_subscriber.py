@@ -1,144 +1,469 @@
-import json
+import asyncio
+import hashlib
 import logging
+import os
+import socket
+import time
+import orjson
+from functools import partial
+from typing import Dict, Optional
 from redis import Redis
+from redis.exceptions import (
+    ConnectionError as RedisConnectionError,
+    ResponseError,
+    TimeoutError as RedisTimeoutError
+)
+from .batch_sender import BatchSender
 from .email_service import EmailService
+from .event_routes import EVENT_ROUTES, EventRoute
 from ..config import settings
+from ..schemas.events import Event, EventDecodeError, MarketingEvent, decode_event
+from ..utils.metrics import EVENTS, EVENT_SECONDS, REDIS_RECONNECTS
 
 logger = logging.getLogger(__name__)
 
 class RedisSubscriber:
-    def __init__(self, redis_manager, email_service: EmailService):
+    CHANNELS = ("user_registration", "kaupskip:subscription", "kaupskip:marketing")
+
+    def __init__(
+        self,
+        redis_manager,
+        email_service: EmailService,
+        channel_concurrency: Optional[Dict[str, int]] = None,
+        queue_size: Optional[int] = None,
+        batch_sender: Optional[BatchSender] = None
+    ):
         logger.info("Initializing Redis subscriber...")
         self.redis = redis_manager.get_main_connection()
         self.email_service = email_service
+        self.batch_sender = batch_sender
         self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.channel_concurrency = channel_concurrency or settings.SUBSCRIBER_CHANNEL_CONCURRENCY
+        self.queue_size = queue_size or settings.SUBSCRIBER_QUEUE_SIZE
+        self.drain_timeout = settings.SUBSCRIBER_DRAIN_TIMEOUT
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers = []
+        self.poll_timeout = settings.SUBSCRIBER_POLL_TIMEOUT
+        self.reconnect_max_backoff = settings.SUBSCRIBER_RECONNECT_MAX_BACKOFF
+        self._reconnect_backoff = 1.0
+        self._stats = {
+            "loop_iterations": 0,
+            "messages_received": 0,
+            "idle_polls": 0,
+            "idle_cpu_seconds": 0.0,
+            "reconnects": 0,
+            "claimed_entries": 0,
+            "dead_lettered": 0,
+            "duplicates_skipped": 0
+        }
+        self.mode = settings.SUBSCRIBER_MODE
+        self.stream_prefix = settings.STREAM_KEY_PREFIX
+        self.stream_group = settings.STREAM_GROUP
+        self.stream_consumer = settings.STREAM_CONSUMER or f"{socket.gethostname()}-{os.getpid()}"
+        self.stream_batch_size = settings.STREAM_BATCH_SIZE
+        self.stream_claim_idle_ms = settings.STREAM_CLAIM_IDLE_MS
+        self.stream_claim_interval = settings.STREAM_CLAIM_INTERVAL
+        self.stream_max_deliveries = settings.STREAM_MAX_DELIVERIES
+        self.stream_dead_letter_key = settings.STREAM_DEAD_LETTER_KEY
+        self.stream_dead_letter_maxlen = settings.STREAM_DEAD_LETTER_MAXLEN
+        self.idempotency_enabled = settings.IDEMPOTENCY_ENABLED
+        self.idempotency_prefix = settings.IDEMPOTENCY_KEY_PREFIX
+        self.idempotency_ttl = settings.IDEMPOTENCY_TTL
+        self.idempotency_processing_ttl = settings.IDEMPOTENCY_PROCESSING_TTL
+        # (channel, event_type) -> handler, built once so dispatch is a dict lookup
+        self._routes = {key: partial(self._send_event, route) for key, route in EVENT_ROUTES.items()}
+        self._routes[("kaupskip:marketing", "marketing:bulk")] = self._handle_bulk_event
+        self._claim_task: Optional[asyncio.Task] = None
         self._running = False
+        self._listener_done: Optional[asyncio.Event] = None
         logger.info("Redis subscriber initialized successfully")
 
     async def start_listening(self):
+        self._listener_done = asyncio.Event()
         try:
-            logger.info("Starting Redis subscriber for main API events...")
-            logger.info("Subscribing to channels: user_registration, kaupskip:subscription, kaupskip:marketing")
-            await self.pubsub.subscribe("user_registration", "kaupskip:subscription", "kaupskip:marketing")
-            
-            self._running = True
-            logger.info("Starting message loop...")
-            while self._running:
-                message = await self.pubsub.get_message(ignore_subscribe_messages=True)
-                if message:
-                    try:
-                        logger.debug(f"Received raw message: {message}")
-                        
-                        if message["type"] == "message":
-                            data = json.loads(message["data"])
-                            channel = message["channel"]
-                            if isinstance(channel, bytes):
-                                channel = channel.decode("utf-8")
-                            
-                            if channel == "user_registration":
-                                logger.info(f"Received registration event from main API: {data}")
-                                
-                                # Validate required fields
-                                if not all(k in data for k in ["user_id", "email", "verification_token", "verification_url"]):
-                                    logger.error(f"Missing required fields in message: {data}")
-                                    continue
-                                
-                                # Send verification email
-                                logger.info(f"Sending verification email to {data['email']}")
-                                await self.email_service.send_verification_email(
-                                    email=data["email"],
-                                    code=data["verification_token"],
-                                    verification_url=data["verification_url"]
-                                )
-                                logger.info(f"Successfully processed registration event for {data['email']}")
-                                
-                            elif channel == "kaupskip:subscription":
-                                logger.info(f"Received subscription event: {data}")
-                                
-                                # Validate subscription event fields
-                                if not all(k in data for k in ["user_id", "email", "tier", "subscription_data"]):
-                                    logger.error(f"Missing required fields in subscription event: {data}")
-                                    continue
-                                    
-                                try:
-                                    await self._handle_subscription_event(data)
-                                except Exception as e:
-                                    logger.error(f"Error processing subscription event: {str(e)}")
-                                
-                            elif channel == "kaupskip:marketing":
-                                logger.info(f"Received marketing event: {data}")
-                                
-                                # Validate marketing event fields
-                                if not all(k in data for k in ["event_type", "data"]):
-                                    logger.error(f"Missing required fields in marketing event: {data}")
-                                    continue
-                                    
-                                try:
-                                    await self._handle_marketing_event(data)
-                                except Exception as e:
-                                    logger.error(f"Error processing marketing event: {str(e)}")
-                        
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Failed to decode message data: {str(e)}")
-                    except Exception as e:
-                        logger.error(f"Error processing message: {str(e)}")
-                        logger.error(f"Message that caused error: {message}")
-                        
+            logger.info(f"Starting Redis subscriber for main API events ({self.mode} mode)...")
+            self._start_workers()
+            if self.mode == "streams":
+                await self._consume_streams()
+            else:
+                await self._consume_pubsub()
         except Exception as e:
             logger.error(f"Fatal error in Redis subscription: {str(e)}")
             raise
+        finally:
+            self._listener_done.set()
 
-    async def stop(self):
-        """Gracefully stop the subscriber"""
-        logger.info("Stopping Redis subscriber...")
-        self._running = False
-        self.pubsub.unsubscribe()
-        self.pubsub.close()
-        logger.info("Redis subscriber stopped successfully") 
+    async def _consume_pubsub(self):
+        logger.info(f"Subscribing to channels: {', '.join(self.CHANNELS)}")
+        await self.pubsub.subscribe(*self.CHANNELS)
+        
+        self._running = True
+        logger.info("Starting message loop...")
+        while self._running:
+            self._stats["loop_iterations"] += 1
+            cpu_started = time.thread_time()
+            try:
+                # Blocks for up to poll_timeout instead of spinning while idle
+                message = await self.pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=self.poll_timeout
+                )
+            except (RedisConnectionError, RedisTimeoutError) as e:
+                if not self._running:
+                    break
+                await self._reconnect(e)
+                continue
+            
+            if not message:
+                self._stats["idle_polls"] += 1
+                self._stats["idle_cpu_seconds"] += time.thread_time() - cpu_started
+                continue
+            
+            self._stats["messages_received"] += 1
+            self._reconnect_backoff = 1.0
+            try:
+                if message["type"] == "message":
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode("utf-8")
+                    
+                    queue = self._queues.get(channel)
+                    if queue is None:
+                        logger.warning(f"Received message on unexpected channel: {channel}")
+                        continue
+                    event = decode_event(channel, message["data"])
+                    # Blocks while the channel's queue is full, which
+                    # stops reading from Redis until workers catch up
+                    await queue.put((event, None, time.monotonic()))
+                
+            except EventDecodeError as e:
+                EVENTS.labels(e.channel, "invalid").inc()
+                logger.error(str(e))
+            except Exception as e:
+                # The payload carries recipient addresses and user data, so it is not logged
+                logger.error(f"Error processing message on {message.get('channel')}: {str(e)}")
 
-    async def _handle_subscription_event(self, data: dict):
-        """Handle subscription-related events"""
-        event_type = data.get('event_type')
-        email = data.get('email')
-        subscription_data = data.get('subscription_data', {})
+    def _stream_key(self, channel: str) -> str:
+        return f"{self.stream_prefix}{channel}"
 
-        if not email:
-            logger.error("No email provided in subscription event")
-            return
+    async def _ensure_groups(self):
+        for channel in self.CHANNELS:
+            try:
+                await self.redis.xgroup_create(self._stream_key(channel), self.stream_group, id="$", mkstream=True)
+                logger.info(f"Created consumer group {self.stream_group} on {self._stream_key(channel)}")
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def _consume_streams(self):
+        """Read channel streams through a consumer group so replicas share the load
+        
+        Entries stay pending until a worker acknowledges them after a successful
+        send; entries left pending by a crashed or failing consumer are reclaimed
+        by _claim_stale_entries.
+        """
+        await self._ensure_groups()
+        streams = {self._stream_key(channel): ">" for channel in self.CHANNELS}
+        
+        self._running = True
+        self._claim_task = asyncio.create_task(self._claim_stale_entries())
+        logger.info(f"Reading streams as {self.stream_group}/{self.stream_consumer}...")
+        while self._running:
+            self._stats["loop_iterations"] += 1
+            cpu_started = time.thread_time()
+            try:
+                response = await self.redis.xreadgroup(
+                    self.stream_group,
+                    self.stream_consumer,
+                    streams,
+                    count=self.stream_batch_size,
+                    block=int(self.poll_timeout * 1000)
+                )
+            except (RedisConnectionError, RedisTimeoutError) as e:
+                if not self._running:
+                    break
+                self._stats["reconnects"] += 1
+                REDIS_RECONNECTS.inc()
+                logger.error(f"Lost Redis stream connection: {str(e)}; retrying in {self._reconnect_backoff:.0f}s")
+                await asyncio.sleep(self._reconnect_backoff)
+                self._reconnect_backoff = min(self._reconnect_backoff * 2, self.reconnect_max_backoff)
+                continue
+            
+            if not response:
+                self._stats["idle_polls"] += 1
+                self._stats["idle_cpu_seconds"] += time.thread_time() - cpu_started
+                continue
+            
+            self._reconnect_backoff = 1.0
+            for stream, entries in response:
+                channel = stream[len(self.stream_prefix):]
+                for entry_id, fields in entries:
+                    self._stats["messages_received"] += 1
+                    await self._enqueue_entry(channel, entry_id, fields)
 
+    async def _enqueue_entry(self, channel: str, entry_id: str, fields: Optional[dict]):
+        raw = (fields or {}).get("data")
         try:
-            logger.info(f"Processing {event_type} for user {email}")
+            event = decode_event(channel, raw)
+        except EventDecodeError as e:
+            EVENTS.labels(channel, "invalid").inc()
+            await self._dead_letter(channel, entry_id, raw, str(e))
+            return
+        await self._queues[channel].put((event, entry_id, time.monotonic()))
+
+    async def _claim_stale_entries(self):
+        """Periodically take over entries another consumer left pending for too long"""
+        while self._running:
+            await asyncio.sleep(self.stream_claim_interval)
+            for channel in self.CHANNELS:
+                try:
+                    await self._claim_stream(channel)
+                except Exception as e:
+                    logger.error(f"Error reclaiming pending entries on {channel}: {str(e)}")
+
+    async def _claim_stream(self, channel: str):
+        stream = self._stream_key(channel)
+        start_id = "0-0"
+        while self._running:
+            result = await self.redis.xautoclaim(
+                stream,
+                self.stream_group,
+                self.stream_consumer,
+                min_idle_time=self.stream_claim_idle_ms,
+                start_id=start_id,
+                count=self.stream_batch_size
+            )
+            start_id, entries = result[0], result[1]
+            live = [(entry_id, fields) for entry_id, fields in entries if fields is not None]
+            deleted = [entry_id for entry_id, fields in entries if fields is None]
+            if deleted:
+                await self.redis.xack(stream, self.stream_group, *deleted)
+            
+            if live:
+                # One round trip for every claimed entry's delivery count
+                pipe = self.redis.pipeline(transaction=False)
+                for entry_id, _ in live:
+                    pipe.xpending_range(stream, self.stream_group, min=entry_id, max=entry_id, count=1)
+                pending = await pipe.execute()
+                for (entry_id, fields), info in zip(live, pending):
+                    deliveries = info[0]["times_delivered"] if info else 0
+                    if deliveries > self.stream_max_deliveries:
+                        await self._dead_letter(channel, entry_id, fields.get("data"), f"exceeded {self.stream_max_deliveries} deliveries")
+                    else:
+                        self._stats["claimed_entries"] += 1
+                        await self._enqueue_entry(channel, entry_id, fields)
             
-            if event_type == 'subscription_created':
-                await self.email_service.send_subscription_receipt(email, subscription_data)
-            elif event_type == 'subscription_cancelled':
-                await self.email_service.send_subscription_cancelled(email, subscription_data)
-            elif event_type == 'subscription_downgraded':
-                # Handle downgrade event with account change notification
-                await self.email_service.send_account_change_notification(email, subscription_data)
+            if start_id in ("0-0", b"0-0"):
+                break
+
+    async def _dead_letter(self, channel: str, entry_id: str, raw: Optional[str], reason: str):
+        logger.error(f"Moving {channel} entry {entry_id} to dead-letter stream: {reason}")
+        self._stats["dead_lettered"] += 1
+        await self.redis.xadd(
+            self.stream_dead_letter_key,
+            {"channel": channel, "entry_id": entry_id, "data": raw or "", "reason": reason},
+            maxlen=self.stream_dead_letter_maxlen,
+            approximate=True
+        )
+        await self.redis.xack(self._stream_key(channel), self.stream_group, entry_id)
+
+    async def _reconnect(self, error: Exception):
+        """Back off, then open a fresh pub/sub connection and resubscribe
+
+        Keeps trying until the subscribe succeeds or the subscriber is
+        stopped: returning without a connection would leave the loop reading
+        from a pub/sub object that has none.
+        """
+        self._stats["reconnects"] += 1
+        REDIS_RECONNECTS.inc()
+        logger.error(f"Lost Redis pub/sub connection: {str(error)}; reconnecting in {self._reconnect_backoff:.0f}s")
+        while self._running:
+            await asyncio.sleep(self._reconnect_backoff)
+            self._reconnect_backoff = min(self._reconnect_backoff * 2, self.reconnect_max_backoff)
+            if not self._running:
+                return
+            try:
+                await self.pubsub.aclose()
+                await self.pubsub.subscribe(*self.CHANNELS)
+                logger.info("Resubscribed to Redis channels")
+                return
+            except Exception as e:
+                logger.error(f"Redis resubscribe failed: {str(e)}; retrying in {self._reconnect_backoff:.0f}s")
+
+    def _start_workers(self):
+        """Start a bounded queue and a fixed set of workers for every channel
+        
+        Each channel has its own queue and workers, so a flood on one channel
+        cannot occupy the workers that deliver another channel's mail.
+        """
+        for channel in self.CHANNELS:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self._queues[channel] = queue
+            worker_count = self.channel_concurrency.get(channel, 1)
+            for i in range(worker_count):
+                task = asyncio.create_task(self._worker(channel, queue), name=f"{channel}-worker-{i}")
+                self._workers.append(task)
+            logger.info(f"Started {worker_count} worker(s) for {channel}")
+
+    def _idempotency_key(self, channel: str, event: Event) -> str:
+        event_id = event.event_id
+        if not event_id:
+            # No id from the publisher: identical events on a channel count as one
+            event_id = hashlib.sha256(orjson.dumps(event, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        return f"{self.idempotency_prefix}{channel}:{event_id}"
+
+    async def _claim_event(self, channel: str, event: Event):
+        """Mark an event as in progress with SET NX
+
+        Returns ``(claimed, key)``. ``claimed`` is None for a duplicate of an
+        event still in progress and False for one already handled. ``key`` is
+        None when idempotency is off or Redis could not be reached; the event
+        is then processed anyway.
+        """
+        if not self.idempotency_enabled:
+            return True, None
+        key = self._idempotency_key(channel, event)
+        try:
+            if await self.redis.set(key, "processing", nx=True, ex=self.idempotency_processing_ttl):
+                return True, key
+            state = await self.redis.get(key)
+        except Exception as e:
+            logger.warning(f"Idempotency check failed, processing event anyway: {str(e)}")
+            return True, None
+        return (False if state == "done" else None), key
+
+    async def _finish_event(self, key: Optional[str], result: Optional[bool]):
+        if key is None:
+            return
+        try:
+            if result is False:
+                # Let the retried delivery through
+                await self.redis.delete(key)
             else:
-                logger.warning(f"Unknown subscription event type: {event_type}")
+                await self.redis.set(key, "done", ex=self.idempotency_ttl)
         except Exception as e:
-            logger.error(f"Error processing subscription event: {str(e)}") 
+            logger.warning(f"Failed to record event outcome for {key}: {str(e)}")
 
-    async def _handle_marketing_event(self, data: dict):
-        """Handle marketing-related events"""
-        event_type = data.get('event_type')
-        user_data = data.get('data', {})
-        email = user_data.get('email')
+    async def _worker(self, channel: str, queue: asyncio.Queue):
+        while True:
+            event, entry_id, enqueued_at = await queue.get()
+            try:
+                claimed, key = await self._claim_event(channel, event)
+                if not claimed:
+                    self._stats["duplicates_skipped"] += 1
+                    EVENTS.labels(channel, "duplicate").inc()
+                    logger.info(f"Skipping duplicate {channel} event {key}")
+                    # A duplicate of an event still in progress stays pending, so
+                    # it is redelivered if the worker handling it dies
+                    if entry_id is not None and claimed is False:
+                        await self.redis.xack(self._stream_key(channel), self.stream_group, entry_id)
+                    continue
+                try:
+                    result = await self._process_event(channel, event)
+                except Exception:
+                    await self._finish_event(key, False)
+                    raise
+                await self._finish_event(key, result)
+                EVENTS.labels(channel, "failed" if result is False else "processed").inc()
+                EVENT_SECONDS.labels(channel).observe(time.monotonic() - enqueued_at)
+                # Stream entries whose send failed stay pending and are retried
+                # once _claim_stale_entries reclaims them
+                if entry_id is not None and result is not False:
+                    await self.redis.xack(self._stream_key(channel), self.stream_group, entry_id)
+            except Exception as e:
+                EVENTS.labels(channel, "failed").inc()
+                logger.error(f"Error processing {channel} event: {str(e)}")
+            finally:
+                queue.task_done()
 
+    async def _process_event(self, channel: str, event: Event) -> Optional[bool]:
+        """Dispatch one event; returns False when delivery failed and should be retried"""
+        handler = self._routes.get((channel, event.event_type)) or self._routes.get((channel, None))
+        if handler is None:
+            logger.warning(f"Unknown {channel} event type: {event.event_type}")
+            return
+        return await handler(event)
+
+    async def _send_event(self, route: EventRoute, event: Event) -> Optional[bool]:
+        email, email_data = route.extract(event)
         if not email:
-            logger.error("No email provided in marketing event")
+            logger.error(f"No email provided in {route.email_type} event")
             return
 
         try:
-            logger.info(f"Processing marketing event {event_type} for user {email}")
-            
-            if event_type == 'marketing:oauth_signup' or event_type == 'marketing:email_verified':
-                await self.email_service.send_welcome_email(email, user_data)
-            elif event_type == 'marketing:trial_expired':
-                await self.email_service.send_trial_expired_email(email, user_data)
-            else:
-                logger.warning(f"Unknown marketing event type: {event_type}")
+            logger.info(f"Sending {route.email_type} email to {email}")
+            return await self.email_service.send(route.email_type, email, email_data)
+        except Exception as e:
+            logger.error(f"Error processing {route.email_type} event: {str(e)}")
+            return False
+
+    def queue_depths(self) -> dict:
+        return {channel: queue.qsize() for channel, queue in self._queues.items()}
+
+    def stats(self) -> dict:
+        """Loop counters used to confirm the listener blocks rather than spins while idle"""
+        return {
+            "running": self._running,
+            **self._stats,
+            "queue_depths": self.queue_depths()
+        }
+
+    async def stop(self):
+        """Gracefully stop the subscriber, letting queued events drain first"""
+        logger.info("Stopping Redis subscriber...")
+        self._running = False
+        if self._listener_done is not None:
+            # The loop notices the flag after its current blocking read returns;
+            # waiting keeps unsubscribe from racing that read on the connection
+            try:
+                await asyncio.wait_for(self._listener_done.wait(), timeout=self.poll_timeout + 1)
+            except asyncio.TimeoutError:
+                logger.warning("Subscriber loop did not exit before unsubscribe")
+        if self._claim_task is not None:
+            self._claim_task.cancel()
+        if self.mode == "pubsub":
+            try:
+                await self.pubsub.unsubscribe()
+            except Exception as e:
+                logger.warning(f"Error unsubscribing from Redis channels: {str(e)}")
+        
+        if self._queues:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(queue.join() for queue in self._queues.values())),
+                    timeout=self.drain_timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Subscriber queues not drained within {self.drain_timeout}s: {self.queue_depths()}")
+        
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        
+        await self.pubsub.aclose()
+        logger.info("Redis subscriber stopped successfully") 
+
+    async def _handle_bulk_event(self, event: MarketingEvent):
+        """Hand a bulk campaign off to the batch sender; the event is done once the job is queued"""
+        if self.batch_sender is None:
+            logger.error("Received bulk marketing event but batch sending is not enabled")
+            return
+        data = event.data
+        recipients = data.get('recipients')
+        if not isinstance(recipients, list) or len(recipients) > settings.BATCH_MAX_RECIPIENTS:
+            logger.error(f"Invalid recipients in bulk marketing event for campaign {data.get('campaign')}")
+            return
+        if not all(isinstance(r, dict) and r.get('email') for r in recipients):
+            logger.error("Every recipient in a bulk marketing event needs an email")
+            return
+
+        try:
+            job_id = await self.batch_sender.submit(data.get('campaign'), recipients, job_id=data.get('job_id'))
+            logger.info(f"Queued bulk marketing event as batch job {job_id}")
+            return True
+        except ValueError as e:
+            logger.error(f"Rejected bulk marketing event: {str(e)}")
         except Exception as e:
-            logger.error(f"Error processing marketing event: {str(e)}") 
\ No newline at end of file
+            logger.error(f"Error queuing bulk marketing event: {str(e)}")
+            return False
@@ -0,0 +1,88 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+from ..config import settings
+from .template_engine import get_template_env
+from ..utils.metrics import TEMPLATE_RENDER_SECONDS
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+def _init_worker():
+    # Runs once in each worker process: load, optimize and compile every
+    # template up front so the first chunk does not pay for it
+    get_template_env()
+
+def _warm() -> int:
+    return os.getpid()
+
+def _render_chunk(template_name: str, contexts: Sequence[dict]) -> List[Tuple[Optional[str], float, Optional[str]]]:
+    """Render one chunk in a worker process; returns (html, seconds, error) per context"""
+    template = get_template_env().get_template(template_name)
+    results = []
+    for context in contexts:
+        started = time.perf_counter()
+        try:
+            html, error = template.render(context), None
+        except Exception as e:
+            html, error = None, str(e) or type(e).__name__
+        results.append((html, time.perf_counter() - started, error))
+    return results
+
+class RenderPool:
+    """Renders templates in worker processes so large campaigns use every core
+
+    Each worker compiles the templates once when it starts, and contexts are
+    sent over in chunks of ``chunk_size`` so the pickling round trip is paid
+    per chunk rather than per email. The event loop only awaits the results
+    and stays free for SMTP sends and HTTP requests.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.workers = workers or settings.RENDER_POOL_WORKERS or os.cpu_count() or 1
+        self.chunk_size = chunk_size or settings.RENDER_POOL_CHUNK_SIZE
+        # Workers are spawned rather than forked: the service process already
+        # runs SMTP and database threads, which fork would copy mid-flight
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+
+    async def start(self):
+        """Start every worker now so campaign sends do not wait for template compilation"""
+        loop = asyncio.get_running_loop()
+        try:
+            pids = await asyncio.gather(*(loop.run_in_executor(self._executor, _warm) for _ in range(self.workers)))
+            logger.info(f"Render pool ready with {len(set(pids))} worker processes")
+        except Exception as e:
+            logger.error(f"Failed to start render pool: {str(e)}")
+
+    async def render_many(self, template_name: str, contexts: Sequence[dict]) -> List[Optional[str]]:
+        """Render ``contexts`` with one template, in order; a context that fails to render yields None"""
+        loop = asyncio.get_running_loop()
+        chunks = [contexts[i:i + self.chunk_size] for i in range(0, len(contexts), self.chunk_size)]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _render_chunk, template_name, chunk) for chunk in chunks
+        ))
+        bodies = []
+        histogram = TEMPLATE_RENDER_SECONDS.labels(template_name)
+        for html, seconds, error in (result for chunk in results for result in chunk):
+            histogram.observe(seconds)
+            if error is not None:
+                logger.error(f"Error rendering {template_name} in render pool: {error}")
+            bodies.append(html)
+        return bodies
+
+    def close(self):
+        logger.info("Shutting down render pool...")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+@lru_cache
+def get_render_pool() -> RenderPool:
+    """Process-wide render pool; only created when RENDER_POOL_ENABLED is set"""
+    return RenderPool()
@@ -0,0 +1,184 @@
+from collections import deque
+from emails.backend import SMTPBackend
+from typing import Optional
+from ..config import settings
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class PoolTimeoutError(Exception):
+    """Raised when no SMTP connection becomes available in time"""
+
+class PooledConnection:
+    """An authenticated SMTP session plus the bookkeeping the pool needs to recycle it"""
+
+    __slots__ = ("backend", "created_at", "last_used", "messages_sent")
+
+    def __init__(self, backend: SMTPBackend):
+        self.backend = backend
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+
+    def is_alive(self) -> bool:
+        """Health check via NOOP; the session is considered dead on any error"""
+        try:
+            code, _ = self.backend.get_client().noop()
+            return code == 250
+        except Exception:
+            return False
+
+    def set_timeout(self, seconds: float):
+        """Bound each socket operation on this session, and any reconnect during a send, to ``seconds``"""
+        self.backend.smtp_cls_kwargs.update(timeout=seconds)
+        client = self.backend._client
+        if client is not None and client.sock is not None:
+            client.sock.settimeout(seconds)
+
+    def close(self):
+        self.backend.close()
+
+class SMTPConnectionPool:
+    """Thread-safe pool of persistent SMTP sessions
+
+    Sessions keep their STARTTLS/AUTH state between messages. Idle sessions
+    are closed after ``idle_timeout`` (down to ``min_size``), sessions that
+    sat idle longer than ``health_check_interval`` are probed with NOOP
+    before reuse, and a session is retired after ``max_messages`` sends.
+    """
+
+    def __init__(
+        self,
+        smtp_options: dict,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        max_messages: Optional[int] = None,
+        health_check_interval: Optional[float] = None
+    ):
+        self.smtp_options = smtp_options
+        self.min_size = settings.SMTP_POOL_MIN_SIZE if min_size is None else min_size
+        self.max_size = max_size or settings.SMTP_POOL_MAX_SIZE
+        self.idle_timeout = idle_timeout or settings.SMTP_POOL_IDLE_TIMEOUT
+        self.max_messages = max_messages or settings.SMTP_POOL_MAX_MESSAGES
+        self.health_check_interval = (
+            settings.SMTP_POOL_HEALTH_CHECK_INTERVAL if health_check_interval is None else health_check_interval
+        )
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _connect(self) -> PooledConnection:
+        backend = SMTPBackend(**self.smtp_options)
+        # Opens the TCP session and runs STARTTLS/AUTH up front
+        backend.get_client()
+        return PooledConnection(backend)
+
+    def _open(self) -> PooledConnection:
+        """Open a connection for a slot already reserved in ``_size``"""
+        try:
+            return self._connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def _discard(self, conn: PooledConnection):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f"Error closing SMTP connection: {str(e)}")
+
+    def fill(self):
+        """Open connections until the pool holds ``min_size`` sessions"""
+        while True:
+            with self._condition:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            conn = self._open()
+            with self._condition:
+                self._idle.append(conn)
+                self._condition.notify()
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            conn = None
+            with self._condition:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("SMTP connection pool is closed")
+                    if self._idle:
+                        # LIFO keeps the warmest sessions busy and lets the rest age out
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeoutError("Timed out waiting for an SMTP connection")
+                    self._condition.wait(remaining)
+
+            if conn is None:
+                return self._open()
+
+            idle_for = time.monotonic() - conn.last_used
+            if idle_for > self.idle_timeout:
+                self._discard(conn)
+                continue
+            if idle_for > self.health_check_interval and not conn.is_alive():
+                logger.info("Discarding SMTP connection that failed NOOP health check")
+                self._discard(conn)
+                continue
+            return conn
+
+    def release(self, conn: PooledConnection, discard: bool = False):
+        conn.messages_sent += 1
+        conn.last_used = time.monotonic()
+        if discard or self._closed or conn.messages_sent >= self.max_messages:
+            self._discard(conn)
+            return
+        with self._condition:
+            self._idle.append(conn)
+            self._condition.notify()
+        self.prune()
+
+    def prune(self):
+        """Close sessions idle past ``idle_timeout``, keeping at least ``min_size``"""
+        expired = []
+        now = time.monotonic()
+        with self._condition:
+            # Oldest idle sessions sit at the left end of the deque
+            while self._idle and self._size - len(expired) > self.min_size:
+                if now - self._idle[0].last_used <= self.idle_timeout:
+                    break
+                expired.append(self._idle.popleft())
+        for conn in expired:
+            self._discard(conn)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._condition.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size
+            }
@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+from emails import Message
+from functools import lru_cache
+from typing import Optional
+from ..config import settings
+from .smtp_pool import PoolTimeoutError, SMTPConnectionPool
+from ..utils.metrics import SMTP_SEND_SECONDS, SMTP_SLOT_WAIT_SECONDS
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class PrioritySlots:
+    """Semaphore that hands a freed slot to the waiter with the lowest priority value, FIFO within a priority"""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority: int = 0):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Cancelled waiters stay in the heap and are skipped by release();
+            # one that was handed a slot just before cancelling passes it on
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._value += 1
+
+class SendOutcomeUnknown(asyncio.TimeoutError):
+    """The send timeout passed while the message was still being handed to the relay
+
+    The relay may yet accept it, so it must not be retried automatically.
+    """
+
+class SMTPTransport:
+    """Delivers messages on a bounded thread pool so sends overlap without blocking the event loop"""
+
+    def __init__(self, max_concurrency: Optional[int] = None, send_timeout: Optional[float] = None):
+        self.max_concurrency = max_concurrency or settings.SMTP_MAX_CONCURRENCY
+        self.send_timeout = send_timeout or settings.SMTP_SEND_TIMEOUT
+        self.smtp_options = {
+            "host": settings.SMTP_HOST,
+            "port": settings.SMTP_PORT,
+            "user": settings.SMTP_USER,
+            "password": settings.SMTP_PASSWORD,
+            "tls": settings.SMTP_TLS,
+            "timeout": self.send_timeout
+        }
+        self.pool = SMTPConnectionPool(self.smtp_options)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="smtp-send"
+        )
+        # Only messages holding a slot are handed to the executor, and a slot
+        # is held until its thread returns, so the send timeout measures SMTP
+        # time rather than time spent queued behind an overrunning send
+        self._slots = PrioritySlots(self.max_concurrency)
+
+    def _send_blocking(self, message: Message, to: str, deadline: Optional[float] = None):
+        if deadline is None:
+            deadline = time.monotonic() + self.send_timeout
+        # A 4xx reply (421 in particular) usually means the relay is done with
+        # this session, so retry once on a freshly opened connection
+        for attempt in range(2):
+            conn = self.pool.acquire(timeout=max(0.0, deadline - time.monotonic()))
+            try:
+                # Nothing has been sent yet, so running out of time here is safe to retry
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError("Send timeout passed before the message was sent")
+                conn.set_timeout(remaining)
+                response = message.send(to=to, smtp=conn.backend)
+            except Exception:
+                self.pool.release(conn, discard=True)
+                raise
+            status_code = response.status_code
+            reconnect = status_code is None or 400 <= status_code < 500
+            self.pool.release(conn, discard=reconnect)
+            if not reconnect or attempt:
+                return response
+            logger.warning(f"SMTP replied {status_code}, reconnecting and retrying once")
+        return response
+
+    async def start(self):
+        """Warm the connection pool up to its minimum size"""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self.pool.fill)
+        except Exception as e:
+            logger.error(f"Failed to warm SMTP connection pool: {str(e)}")
+
+    async def send(self, message: Message, to: str, priority: int = 0):
+        """Send a message, raising SendOutcomeUnknown if it is still in flight after the send timeout
+
+        The sending thread works to the same deadline and normally fails on
+        its own first. When every slot is busy, waiting sends with a lower
+        ``priority`` value go first.
+        """
+        loop = asyncio.get_running_loop()
+        queued_at = time.perf_counter()
+        await self._slots.acquire(priority)
+        future = None
+        try:
+            SMTP_SLOT_WAIT_SECONDS.observe(time.perf_counter() - queued_at)
+            deadline = time.monotonic() + self.send_timeout
+            future = loop.run_in_executor(self._executor, self._send_blocking, message, to, deadline)
+            future.add_done_callback(lambda _: self._slots.release())
+            with SMTP_SEND_SECONDS.time():
+                # asyncio.wait neither cancels the thread's future nor raises on
+                # timeout, so a TimeoutError from inside the thread (a connect
+                # timeout, say) surfaces as itself and is retried as transient
+                done, _ = await asyncio.wait({future}, timeout=self.send_timeout)
+            if not done:
+                raise SendOutcomeUnknown(f"SMTP send to {to} still in progress after {self.send_timeout:.0f}s")
+            return future.result()
+        finally:
+            if future is None:
+                self._slots.release()
+
+    def close(self):
+        logger.info("Shutting down SMTP transport...")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.pool.close()
+
+@lru_cache
+def get_smtp_transport() -> SMTPTransport:
+    """Process-wide transport shared by every EmailService instance"""
+    return SMTPTransport()
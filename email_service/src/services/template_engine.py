@@ -0,0 +1,110 @@
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from premailer import Premailer
+from functools import lru_cache
+from datetime import datetime
+from ..config import settings
+from .asset_cache import get_asset_cache
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
+
+def format_date(value):
+    """Convert ISO date string to a more readable format"""
+    if not value:
+        return ""
+    try:
+        if isinstance(value, str):
+            dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        else:
+            dt = value
+        return dt.strftime("%B %d, %Y")
+    except Exception as e:
+        logger.error(f"Error formatting date: {str(e)}")
+        return value
+
+# Conditional comments (<!--[if mso]>) carry Outlook markup and must survive
+_HTML_COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.S)
+_WHITESPACE = re.compile(r"\s+")
+_JINJA_EXPRESSION = re.compile(r"\{\{.*?\}\}", re.S)
+_PLACEHOLDER = re.compile(r"__jinja_expr_(\d+)__")
+
+def inline_css(source: str) -> str:
+    """Move <style> rules onto the elements they match; rules that cannot be
+    inlined (media queries) stay in a <style> tag"""
+    # Premailer URL-quotes <img src>, which would turn {{ logo_src }} into
+    # {{%20logo_src%20}}; swap expressions for plain tokens while it runs
+    expressions = []
+    def shield(match):
+        expressions.append(match.group(0))
+        return f"__jinja_expr_{len(expressions) - 1}__"
+    inlined = Premailer(
+        _JINJA_EXPRESSION.sub(shield, source),
+        keep_style_tags=False,
+        remove_classes=False,
+        strip_important=False,
+        disable_validation=True,
+        allow_network=False,
+        cssutils_logging_level=logging.CRITICAL
+    ).transform()
+    return _PLACEHOLDER.sub(lambda match: expressions[int(match.group(1))], inlined)
+
+def minify_html(source: str) -> str:
+    """Drop comments and collapse whitespace runs to a single space"""
+    return _WHITESPACE.sub(" ", _HTML_COMMENT.sub("", source)).strip()
+
+def optimize_template_source(source: str) -> str:
+    if settings.TEMPLATE_INLINE_CSS and "<style" in source:
+        source = inline_css(source)
+    if settings.TEMPLATE_MINIFY:
+        source = minify_html(source)
+    return source
+
+class OptimizingLoader(FileSystemLoader):
+    """FileSystemLoader that inlines CSS and minifies markup when a template is loaded
+
+    The work happens once per compile, on the static template source, so
+    rendering only fills in the dynamic fields.
+    """
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        return optimize_template_source(source), filename, uptodate
+
+def build_template_env() -> Environment:
+    """Build a template environment with filters, static globals and every template compiled"""
+    bytecode_cache = None
+    if settings.TEMPLATE_BYTECODE_CACHE_DIR:
+        os.makedirs(settings.TEMPLATE_BYTECODE_CACHE_DIR, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(settings.TEMPLATE_BYTECODE_CACHE_DIR)
+
+    env = Environment(
+        loader=OptimizingLoader(TEMPLATE_DIR),
+        autoescape=True,
+        # Without auto-reload a cached template is returned without stat()ing its source
+        auto_reload=settings.DEBUG,
+        bytecode_cache=bytecode_cache
+    )
+    env.filters['date'] = format_date
+    env.globals.update({
+        'service_name': settings.SERVICE_NAME,
+        'service_url': settings.MAIN_APP_URL,
+        'site_url': settings.SITE_URL,
+        'current_year': datetime.now().year,
+        # Asset sources (logo_src, ...) are fixed per process, so templates
+        # never read or encode an image while rendering
+        **get_asset_cache().template_globals()
+    })
+
+    for name in env.list_templates(extensions=["html"]):
+        env.get_template(name)
+    logger.info(f"Compiled {len(env.list_templates(extensions=['html']))} email templates")
+    return env
+
+@lru_cache
+def get_template_env() -> Environment:
+    """Process-wide template environment shared by every EmailService instance"""
+    return build_template_env()
@@ -2,56 +2,74 @@ from redis import Redis
 from datetime import datetime, timedelta
 import secrets
 import json
-from typing import Optional
+from typing import Dict, Iterable, Tuple
 from ..config import settings
 
+VERIFICATION_CHANNEL = "kaupskip:verification"
+
+# Compare, delete and publish in one atomic step: two concurrent requests
+# with the right code cannot both succeed, and a hit costs one round trip
+_VERIFY_SCRIPT = """
+local data = redis.call('GET', KEYS[1])
+if not data then
+    return false
+end
+local ok, record = pcall(cjson.decode, data)
+if not ok or type(record) ~= 'table' or record['code'] ~= ARGV[1] then
+    return false
+end
+redis.call('DEL', KEYS[1])
+redis.call('PUBLISH', ARGV[2], cjson.encode({
+    user_id = ARGV[3],
+    verified = true,
+    email = record['email'],
+    verified_at = ARGV[4]
+}))
+return 1
+"""
+
 class VerificationService:
     def __init__(self, redis_client: Redis):
         self.redis = redis_client
+        self._verify = redis_client.register_script(_VERIFY_SCRIPT)
         
-    async def create_verification(self, user_id: str, email: str) -> str:
-        code = secrets.token_urlsafe(32)
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"kaupskip:verification:{user_id}"
         
+    @staticmethod
+    def _new_record(email: str) -> Tuple[str, str]:
+        code = secrets.token_urlsafe(32)
         verification_data = {
             "code": code,
             "email": email,
             "created_at": datetime.utcnow().isoformat()
         }
+        return code, json.dumps(verification_data)
+        
+    async def create_verification(self, user_id: str, email: str) -> str:
+        code, record = self._new_record(email)
         
         # Store in Redis with expiry
-        key = f"kaupskip:verification:{user_id}"
-        await self.redis.setex(
-            key,
-            settings.VERIFICATION_EXPIRY_HOURS * 3600,
-            json.dumps(verification_data)
-        )
+        await self.redis.setex(self._key(user_id), settings.VERIFICATION_EXPIRY_HOURS * 3600, record)
         
         return code
         
-    async def verify_code(self, user_id: str, code: str) -> bool:
-        key = f"kaupskip:verification:{user_id}"
-        data = await self.redis.get(key)
+    async def create_verifications(self, users: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+        """Create verifications for many (user_id, email) pairs in one round trip; returns user_id -> code"""
+        codes = {}
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, email in users:
+            codes[user_id], record = self._new_record(email)
+            pipe.setex(self._key(user_id), settings.VERIFICATION_EXPIRY_HOURS * 3600, record)
+        if codes:
+            await pipe.execute()
+        return codes
         
-        if not data:
-            return False
-            
-        try:
-            verification_data = json.loads(data)
-            if verification_data["code"] != code:
-                return False
-                
-            # Publish verification event
-            event_data = {
-                "user_id": user_id,
-                "verified": True,
-                "email": verification_data["email"],
-                "verified_at": datetime.utcnow().isoformat()
-            }
-            await self.redis.publish("kaupskip:verification", json.dumps(event_data))
-            
-            # Delete the verification data
-            await self.redis.delete(key)
-            return True
-            
-        except (json.JSONDecodeError, KeyError):
-            return False
\ No newline at end of file
+    async def verify_code(self, user_id: str, code: str) -> bool:
+        """Consume the user's verification if ``code`` matches and publish the verified event"""
+        result = await self._verify(
+            keys=[self._key(user_id)],
+            args=[code, VERIFICATION_CHANNEL, user_id, datetime.utcnow().isoformat()]
+        )
+        return bool(result)
@@ -1,63 +1,139 @@
 import pytest
+import asyncio
+import json
+import time
 from datetime import datetime
-from unittest.mock import Mock, patch
-from sqlalchemy.orm import Session
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.services.email_service import EmailService
 from src.services.verification_service import VerificationService
+from src.services.smtp_transport import SendOutcomeUnknown, SMTPTransport
+from src.services.smtp_pool import PoolTimeoutError, SMTPConnectionPool, PooledConnection
+from src.services.redis_subscriber import RedisSubscriber
 from src.models.email_log import EmailLog
 from src.utils.redis_manager import RedisManager
+from src.config import settings
+from src.schemas.events import EventDecodeError, RegistrationEvent, SubscriptionEvent, decode_event
 
 @pytest.fixture
 def mock_db():
-    return Mock(spec=Session)
+    db = AsyncMock(spec=AsyncSession)
+    db.add = Mock()
+    return db
+
+@pytest.fixture
+def mock_session_factory(mock_db):
+    factory = MagicMock()
+    factory.return_value.__aenter__.return_value = mock_db
+    return factory
 
 @pytest.fixture
 def mock_redis():
     return Mock(spec=RedisManager)
 
 @pytest.fixture
-def email_service(mock_db):
-    return EmailService(mock_db)
+def email_service(mock_session_factory):
+    return EmailService(mock_session_factory)
+
+@pytest.fixture
+def verification_redis():
+    redis = Mock()
+    redis.setex = AsyncMock()
+    redis.register_script.return_value = AsyncMock(return_value=None)
+    redis.pipeline.return_value.execute = AsyncMock()
+    return redis
 
 @pytest.fixture
-def verification_service(mock_redis):
-    return VerificationService(mock_redis)
+def verification_service(verification_redis):
+    return VerificationService(verification_redis)
 
 class TestEmailService:
-    @patch('emails.Message')
-    async def test_send_verification_email_success(self, mock_message, email_service, mock_db):
+    def test_send_verification_email_success(self, mock_session_factory, mock_db):
         # Arrange
-        mock_message_instance = Mock()
-        mock_message.return_value = mock_message_instance
-        mock_message_instance.send.return_value.status_code = 250
+        transport = Mock(send=AsyncMock(return_value=Mock(status_code=250, status_text=b"OK", error=None)))
+        service = EmailService(mock_session_factory, transport=transport)
         
         # Act
-        result = await email_service.send_verification_email("test@example.com", "test-code")
+        result = asyncio.run(service.send_verification_email("test@example.com", "test-code"))
         
         # Assert
-        assert result is True
-        mock_db.add.assert_called_once()
-        mock_db.commit.assert_called_once()
+        assert result == "sent"
+        message = transport.send.call_args[0][0]
+        assert message.subject == "Verify Your Email"
+        assert "test-code" in message.html
+        assert transport.send.call_args.kwargs == {"to": "test@example.com", "priority": 0}
+        log_entry = mock_db.add.call_args[0][0]
+        assert (log_entry.email_to, log_entry.email_type, log_entry.status) == ("test@example.com", "verification", "sent")
+        mock_db.commit.assert_awaited_once()
         
-    @patch('emails.Message')
-    async def test_send_verification_email_failure(self, mock_message, email_service, mock_db):
+    def test_send_verification_email_failure(self, mock_session_factory, mock_db):
         # Arrange
-        mock_message_instance = Mock()
-        mock_message.return_value = mock_message_instance
-        mock_message_instance.send.return_value.status_code = 500
+        transport = Mock(send=AsyncMock(return_value=Mock(status_code=550, status_text=b"No such user", error=None)))
+        service = EmailService(mock_session_factory, transport=transport)
         
         # Act
-        result = await email_service.send_verification_email("test@example.com", "test-code")
+        result = asyncio.run(service.send_verification_email("test@example.com", "test-code"))
         
         # Assert
-        assert result is False
-        mock_db.add.assert_called_once()
-        mock_db.commit.assert_called_once()
+        assert result == "failed"
+        transport.send.assert_awaited_once()
+        log_entry = mock_db.add.call_args[0][0]
+        assert (log_entry.email_type, log_entry.status) == ("verification", "failed")
+        assert log_entry.meta_data == {"smtp_status": 550, "error": "No such user"}
+        mock_db.commit.assert_awaited_once()
+        
+    def test_verification_request_reports_a_deferred_send(self, mock_session_factory):
+        # Arrange
+        from fastapi import Response
+        from src.main import request_email_verification
+        from src.schemas.email import EmailVerificationRequest
+        transport = Mock(send=AsyncMock(return_value=Mock(status_code=451, status_text=b"Try later", error=None)))
+        retry_queue = Mock(defer=AsyncMock(return_value=True))
+        service = EmailService(mock_session_factory, transport=transport, retry_queue=retry_queue)
+        verification_service = Mock(create_verification=AsyncMock(return_value="test-code"))
+        response = Response()
+        
+        # Act
+        result = asyncio.run(request_email_verification(
+            EmailVerificationRequest(user_id="u", email="test@example.com"),
+            response,
+            verification_service=verification_service,
+            email_service=service
+        ))
+        
+        # Assert
+        assert response.status_code == 202
+        assert (result.success, result.status) == (True, "deferred")
+        assert "queued for retry" in result.message
+        
+    def test_render_template_uses_shared_environment(self, email_service, mock_session_factory):
+        # Act
+        html = email_service._render_template("verification.html", {
+            "code": "test-code",
+            "verification_url": "https://example.com/verify?token=test-code",
+            "expiry_hours": 24
+        })
+        
+        # Assert
+        assert EmailService(mock_session_factory).jinja_env is email_service.jinja_env
+        assert "https://example.com/verify?token=test-code" in html
+        assert str(datetime.now().year) in html
+        
+    def test_templates_have_css_inlined_and_markup_minified(self, email_service):
+        # Act
+        html = email_service._render_template("welcome.html", {"email": "test@example.com", "user_data": {}})
+        
+        # Assert
+        assert '<body style=' in html
+        assert 'class="container" style="background-color:#24273a' in html
+        assert "@media" in html
+        assert "<!--" not in html
+        assert "\n" not in html
         
     def test_log_email(self, email_service, mock_db):
         # Act
-        email_service._log_email("test@example.com", "verification", "sent")
+        asyncio.run(email_service._log_email("test@example.com", "verification", "sent"))
         
         # Assert
         mock_db.add.assert_called_once()
@@ -68,43 +144,1339 @@ class TestEmailService:
         assert log_entry.email_type == "verification"
         assert log_entry.status == "sent"
 
+class TestEmailLogWriter:
+    @pytest.fixture
+    def session_factory(self):
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from sqlalchemy.pool import StaticPool
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        return async_sessionmaker(engine, expire_on_commit=False)
+        
+    def test_buffers_rows_and_flushes_in_batches(self, session_factory):
+        # Arrange
+        from sqlalchemy import select
+        from src.database import Base
+        from src.services.email_log_writer import EmailLogWriter
+        writer = EmailLogWriter(session_factory, batch_size=3, flush_interval=5, max_buffer=10)
+        inserted_batches = []
+        insert = writer._insert
+        
+        async def record_insert(rows):
+            inserted_batches.append(len(rows))
+            await insert(rows)
+        writer._insert = record_insert
+        
+        async def run():
+            async with session_factory.kw["bind"].begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            writer.start()
+            for i in range(7):
+                await writer.write(f"user{i}@example.com", "verification", "sent")
+            await asyncio.sleep(0.1)
+            await writer.close()
+            async with session_factory() as session:
+                return (await session.execute(select(EmailLog))).scalars().all()
+        
+        # Act
+        logs = asyncio.run(run())
+        
+        # Assert
+        assert len(logs) == 7
+        assert all(log.sent_at is not None for log in logs)
+        assert inserted_batches == [3, 3, 1]
+        
+    def test_failed_insert_is_retried_then_dropped_and_counted(self):
+        # Arrange
+        from prometheus_client import REGISTRY
+        from src.services.email_log_writer import EmailLogWriter
+        writer = EmailLogWriter(Mock(), write_retries=2, retry_delay=0.001)
+        writer._insert = AsyncMock(side_effect=[OSError("database is locked"), None])
+        dropped_before = REGISTRY.get_sample_value("kaupskip_email_log_rows_dropped_total") or 0
+        
+        # Act
+        asyncio.run(writer._flush([{"id": "1"}, {"id": "2"}]))
+        writer._insert = AsyncMock(side_effect=OSError("database is gone"))
+        asyncio.run(writer._flush([{"id": "3"}]))
+        
+        # Assert
+        assert writer._insert.await_count == 3
+        assert REGISTRY.get_sample_value("kaupskip_email_log_rows_dropped_total") - dropped_before == 1
+
+class TestEmailLogQuery:
+    def test_keyset_pages_are_disjoint_and_ordered(self):
+        # Arrange
+        from datetime import timedelta
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from sqlalchemy.pool import StaticPool
+        from src.database import Base
+        from src.services.email_log_query import build_log_page_query, encode_cursor
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        base_time = datetime(2024, 1, 1)
+        
+        async def run():
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            async with session_factory() as session:
+                for i in range(5):
+                    session.add(EmailLog(
+                        id=f"log-{i}",
+                        email_to="test@example.com",
+                        email_type="welcome" if i % 2 else "verification",
+                        status="sent",
+                        # Two rows share a timestamp so the id tiebreaker matters
+                        created_at=base_time + timedelta(minutes=min(i, 3))
+                    ))
+                await session.commit()
+                
+                pages, cursor = [], None
+                while True:
+                    logs = (await session.execute(build_log_page_query(2, cursor))).scalars().all()
+                    pages.append([log.id for log in logs])
+                    if len(logs) < 2:
+                        break
+                    cursor = encode_cursor(logs[-1].created_at, logs[-1].id)
+                welcome = (await session.execute(build_log_page_query(10, email_type="welcome"))).scalars().all()
+                return pages, [log.id for log in welcome]
+        
+        # Act
+        pages, welcome = asyncio.run(run())
+        
+        # Assert
+        assert pages == [["log-4", "log-3"], ["log-2", "log-1"], ["log-0"]]
+        assert welcome == ["log-3", "log-1"]
+        
+    def test_export_streams_ndjson_and_csv(self):
+        # Arrange
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from sqlalchemy.pool import StaticPool
+        from src.database import Base
+        from src.services.email_log_query import stream_log_export
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        
+        async def run():
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            async with session_factory() as session:
+                for i in range(3):
+                    session.add(EmailLog(
+                        email_to=f"user{i}@example.com",
+                        email_type="welcome",
+                        status="sent" if i else "failed",
+                        meta_data={"attempt": i},
+                        created_at=datetime(2024, 1, 1, i)
+                    ))
+                await session.commit()
+            ndjson = [chunk async for chunk in stream_log_export(session_factory, "ndjson", batch_size=2)]
+            csv_text = "".join([chunk async for chunk in stream_log_export(session_factory, "csv", status="sent")])
+            return ndjson, csv_text
+        
+        # Act
+        ndjson, csv_text = asyncio.run(run())
+        
+        # Assert
+        rows = [json.loads(line) for line in "".join(ndjson).splitlines()]
+        assert len(ndjson) == 2
+        assert [row["email_to"] for row in rows] == ["user0@example.com", "user1@example.com", "user2@example.com"]
+        assert rows[0]["meta_data"] == {"attempt": 0}
+        assert rows[0]["created_at"] == "2024-01-01T00:00:00"
+        lines = csv_text.splitlines()
+        assert lines[0] == "id,email_to,email_type,status,meta_data,created_at,sent_at"
+        assert len(lines) == 3
+        
+    def test_invalid_cursor_is_rejected(self):
+        from src.services.email_log_query import build_log_page_query
+        with pytest.raises(ValueError):
+            build_log_page_query(10, "not-a-cursor")
+
+class TestLogRetention:
+    @pytest.fixture
+    def session_factory(self):
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from sqlalchemy.pool import StaticPool
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        return async_sessionmaker(engine, expire_on_commit=False)
+
+    def test_rollups_are_maintained_incrementally(self, session_factory):
+        # Arrange
+        from sqlalchemy import select
+        from src.database import Base
+        from src.models.email_log_rollup import EmailLogRollup
+        from src.services.email_log_writer import EmailLogWriter
+        writer = EmailLogWriter(session_factory)
+
+        async def run():
+            async with session_factory.kw["bind"].begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            for status in ["sent", "sent", "failed"]:
+                await writer.write("user@example.com", "verification", status)
+            await writer.write("user@example.com", "welcome", "sent")
+            async with session_factory() as session:
+                return (await session.execute(select(EmailLogRollup))).scalars().all()
+
+        # Act
+        rollups = asyncio.run(run())
+
+        # Assert
+        counts = {(r.email_type, r.status): r.count for r in rollups}
+        assert counts == {("verification", "sent"): 2, ("verification", "failed"): 1, ("welcome", "sent"): 1}
+
+    def test_sqlite_rotates_and_drops_expired_months(self, session_factory):
+        # Arrange
+        from sqlalchemy import func, insert, select, text
+        from src.database import Base
+        from src.models.email_log_rollup import EmailLogRollup
+        from src.services.log_retention import LogRetentionManager, record_rollups
+        engine = session_factory.kw["bind"]
+        manager = LogRetentionManager(engine, retention_days=30)
+        rows = [
+            {"id": f"log{i}", "email_to": "user@example.com", "email_type": "verification",
+             "status": "sent", "created_at": created_at}
+            for i, created_at in enumerate([
+                datetime(2026, 8, 20), datetime(2026, 9, 10), datetime(2026, 10, 2), datetime(2026, 10, 3)
+            ])
+        ]
+
+        async def tables(conn):
+            result = await conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'email_logs%' ORDER BY name"
+            ))
+            return result.scalars().all()
+
+        async def run():
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            async with session_factory() as session:
+                await session.execute(insert(EmailLog), rows)
+                await record_rollups(session, rows)
+                await session.commit()
+
+            first = await manager.run_once(now=datetime(2026, 10, 15))
+            async with engine.connect() as conn:
+                after_first = (await tables(conn), await conn.scalar(select(func.count()).select_from(EmailLog)))
+            second = await manager.run_once(now=datetime(2026, 12, 15))
+            async with engine.connect() as conn:
+                after_second = await tables(conn)
+                rollup_total = await conn.scalar(select(func.sum(EmailLogRollup.count)))
+            return first, after_first, second, after_second, rollup_total
+
+        # Act
+        first, after_first, second, after_second, rollup_total = asyncio.run(run())
+
+        # Assert
+        assert first == []
+        assert after_first == (["email_logs", "email_logs_p202609"], 2)
+        assert second == ["email_logs_p202609"]
+        assert after_second == ["email_logs", "email_logs_p202611"]
+        assert rollup_total == 4
+
+class TestBatchSender:
+    @pytest.fixture
+    def redis(self):
+        jobs = {}
+        redis = AsyncMock()
+        async def hset(key, field=None, value=None, mapping=None):
+            jobs.setdefault(key, {}).update(mapping or {field: value})
+        async def hgetall(key):
+            return {k: str(v) for k, v in jobs.get(key, {}).items()}
+        redis.hset.side_effect = hset
+        redis.hgetall.side_effect = hgetall
+        return redis
+
+    def test_sends_with_bounded_concurrency_and_reports_progress(self, redis):
+        # Arrange
+        from src.services.batch_sender import BatchSender
+        in_flight = 0
+        peak = 0
+        contexts = []
+        async def send(campaign, email, context, html=None):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            contexts.append(context)
+            return email != "user3@example.com"
+        email_service = Mock()
+        email_service.send = AsyncMock(side_effect=send)
+        sender = BatchSender(redis, email_service, concurrency=4, progress_interval=5)
+        recipients = [{"email": f"user{i}@example.com", "context": {"name": f"User {i}"}} for i in range(20)]
+
+        async def run():
+            job_id = await sender.submit("trial_expired", recipients)
+            queued = await sender.get_job(job_id)
+            await asyncio.gather(*sender._tasks.values())
+            return queued, await sender.get_job(job_id)
+
+        # Act
+        queued, job = asyncio.run(run())
+
+        # Assert
+        assert queued["status"] == "queued" and queued["total"] == 20
+        assert job["status"] == "completed"
+        assert (job["sent"], job["failed"]) == (19, 1)
+        assert peak == 4
+        assert {"name": "User 0", "email": "user0@example.com"} in contexts
+
+    def test_render_pool_renders_chunks_before_sending(self, redis):
+        # Arrange
+        from src.services.batch_sender import BatchSender
+        render_pool = Mock(chunk_size=3)
+        render_pool.render_many = AsyncMock(side_effect=lambda template, contexts: [
+            None if c["email"] == "user4@example.com" else f"<p>{c['user_data']['name']}</p>" for c in contexts
+        ])
+        email_service = Mock()
+        email_service.send = AsyncMock(return_value=True)
+        sender = BatchSender(redis, email_service, concurrency=2, render_pool=render_pool)
+        recipients = [{"email": f"user{i}@example.com", "context": {"name": f"User {i}"}} for i in range(7)]
+
+        async def run():
+            job_id = await sender.submit("welcome", recipients)
+            await asyncio.gather(*sender._tasks.values())
+            return await sender.get_job(job_id)
+
+        # Act
+        job = asyncio.run(run())
+
+        # Assert
+        assert (job["status"], job["sent"]) == ("completed", 7)
+        assert [len(c.args[1]) for c in render_pool.render_many.call_args_list] == [3, 3, 1]
+        assert render_pool.render_many.call_args.args[0] == "welcome.html"
+        calls = {c.args[1]: c for c in email_service.send.call_args_list}
+        assert calls["user0@example.com"].kwargs == {"html": "<p>User 0</p>"}
+        # A body the pool could not render is rendered inline by the send pipeline
+        assert calls["user4@example.com"].kwargs == {"html": None}
+
+    def test_unknown_campaign_is_rejected(self, redis):
+        # Arrange
+        from src.services.batch_sender import BatchSender
+        sender = BatchSender(redis, Mock())
+
+        # Act / Assert
+        with pytest.raises(ValueError):
+            asyncio.run(sender.submit("newsletter", [{"email": "user@example.com"}]))
+        redis.hset.assert_not_called()
+
+    def test_bulk_marketing_event_queues_a_job(self):
+        # Arrange
+        redis_manager = Mock()
+        redis_manager.get_main_connection.return_value.pubsub.return_value = AsyncMock()
+        batch_sender = Mock(submit=AsyncMock(return_value="job-1"))
+        subscriber = RedisSubscriber(redis_manager, Mock(), batch_sender=batch_sender)
+        recipients = [{"email": "user@example.com", "context": {"name": "Ada"}}]
+        event = {"event_type": "marketing:bulk", "data": {"campaign": "welcome", "recipients": recipients}}
+
+        # Act
+        result = asyncio.run(subscriber._process_event("kaupskip:marketing", decode_event("kaupskip:marketing", json.dumps(event))))
+
+        # Assert
+        assert result is True
+        batch_sender.submit.assert_awaited_once_with("welcome", recipients, job_id=None)
+
+class TestRenderPool:
+    def test_matches_inline_rendering(self):
+        # Arrange
+        from src.services.render_pool import RenderPool
+        from src.services.template_engine import get_template_env
+        contexts = [
+            {"email": f"user{i}@example.com", "user_data": {
+                "email": f"user{i}@example.com",
+                "total_characters": 1,
+                "characters": [{"name": f"Character {i}", "personality": "Curious"}]
+            }}
+            for i in range(5)
+        ]
+        pool = RenderPool(workers=1, chunk_size=2)
+
+        # Act
+        try:
+            bodies = asyncio.run(pool.render_many("trial_expired.html", contexts))
+        finally:
+            pool.close()
+
+        # Assert
+        template = get_template_env().get_template("trial_expired.html")
+        assert bodies == [template.render(context) for context in contexts]
+
+class TestAssetCache:
+    @pytest.fixture
+    def logo(self, tmp_path):
+        path = tmp_path / "logo.png"
+        path.write_bytes(b"\x89PNG fake logo")
+        return str(path)
+
+    def test_content_id_is_keyed_by_content_hash(self, logo, tmp_path):
+        # Arrange
+        from src.services.asset_cache import AssetCache
+        other = tmp_path / "other.png"
+        other.write_bytes(b"\x89PNG another logo")
+
+        # Act
+        first = AssetCache({"logo": logo})
+        second = AssetCache({"logo": logo})
+        changed = AssetCache({"logo": str(other)})
+
+        # Assert
+        assert first.assets["logo"].content_id == second.assets["logo"].content_id
+        assert first.assets["logo"].content_id != changed.assets["logo"].content_id
+        assert first.assets["logo"].content_id.endswith("@kaupskip")
+        assert first.assets["logo"].mime_type == "image/png"
+
+    def test_messages_share_one_inline_part(self, logo):
+        # Arrange
+        from emails import Message
+        from src.services.asset_cache import AssetCache
+        cache = AssetCache({"logo": logo})
+        messages = [Message(subject="Hi", html="<p>Hi</p>", mail_from=("Kaupskip", "noreply@example.com")) for _ in range(2)]
+
+        # Act
+        with patch.object(settings, "EMAIL_ASSET_MODE", "cid"):
+            for message in messages:
+                cache.attach(message)
+            src = cache.template_globals()["logo_src"]
+
+        # Assert
+        (first,), (second,) = (list(message.attachments) for message in messages)
+        assert first is second
+        assert src == f"cid:{first.content_id}"
+        assert f"<{first.content_id}>" in messages[0].as_string()
+        assert AssetCache.attached(messages[1]) == ["logo"]
+
+    def test_data_uri_mode_embeds_without_attaching(self, logo):
+        # Arrange
+        from emails import Message
+        from src.services.asset_cache import AssetCache
+        message = Message(subject="Hi", html="<p>Hi</p>", mail_from=("Kaupskip", "noreply@example.com"))
+
+        # Act
+        with patch.object(settings, "EMAIL_ASSET_MODE", "data_uri"):
+            cache = AssetCache({"logo": logo})
+            cache.attach(message)
+            src = cache.template_globals()["logo_src"]
+
+        # Assert
+        assert src.startswith("data:image/png;base64,")
+        assert len(message.attachments) == 0
+
+    def test_missing_asset_is_left_out(self, tmp_path):
+        # Arrange
+        from src.services.asset_cache import AssetCache
+
+        # Act
+        with patch.object(settings, "EMAIL_ASSETS", {"logo": str(tmp_path / "missing.png")}):
+            cache = AssetCache()
+            template_globals = cache.template_globals()
+
+        # Assert
+        assert cache.assets == {}
+        assert template_globals == {"logo_src": None}
+
+class TestOutboundQueue:
+    @pytest.fixture
+    def pipe(self):
+        return Mock(execute=AsyncMock())
+
+    @pytest.fixture
+    def queue(self, pipe):
+        from src.services.outbound_queue import OutboundQueue
+        redis = AsyncMock()
+        redis.register_script = Mock(return_value=AsyncMock(return_value=[]))
+        redis.pipeline = Mock(return_value=pipe)
+        return OutboundQueue(
+            redis,
+            transport=Mock(send=AsyncMock(), send_timeout=1),
+            log_writer=Mock(write=AsyncMock()),
+            max_attempts=3,
+            base_delay=10,
+            max_delay=60
+        )
+
+    def test_backoff_doubles_with_jitter_and_caps(self, queue):
+        # Act
+        delays = [queue.backoff(attempts) for attempts in range(1, 6)]
+
+        # Assert
+        for delay, ceiling in zip(delays, [10, 20, 40, 60, 60]):
+            assert ceiling / 2 <= delay <= ceiling
+
+    def test_transient_failure_is_scheduled_for_retry(self, queue, pipe):
+        # Arrange
+        from emails import Message
+        message = Message(subject="Hi", html="<p>Hi</p>", mail_from=("Kaupskip", "noreply@example.com"))
+        before = time.time()
+
+        # Act
+        scheduled = asyncio.run(queue.defer(message, "user@example.com", "welcome", 421, "try later"))
+
+        # Assert
+        assert scheduled is True
+        job = json.loads(pipe.hset.call_args[0][2])
+        assert (job["to"], job["subject"], job["attempts"]) == ("user@example.com", "Hi", 1)
+        (due,) = pipe.zadd.call_args[0][1].values()
+        assert before + 5 <= due <= time.time() + 10
+        pipe.lpush.assert_not_called()
+        queue.log_writer.write.assert_awaited_once()
+        assert queue.log_writer.write.call_args[0][2] == "deferred"
+
+    def test_permanent_failure_is_dead_lettered(self, queue, pipe):
+        # Arrange
+        from emails import Message
+        message = Message(subject="Hi", html="<p>Hi</p>", mail_from=("Kaupskip", "noreply@example.com"))
+
+        # Act
+        scheduled = asyncio.run(queue.defer(message, "user@example.com", "welcome", 550, "no such user"))
+
+        # Assert
+        assert scheduled is False
+        pipe.zadd.assert_not_called()
+        assert json.loads(pipe.lpush.call_args[0][1])["last_status"] == 550
+        assert queue.log_writer.write.call_args[0][2] == "failed"
+
+    def test_retry_dead_letters_after_max_attempts(self, queue, pipe):
+        # Arrange
+        job = {"id": "job-1", "to": "user@example.com", "email_type": "welcome", "subject": "Hi",
+               "html": "<p>Hi</p>", "mail_from": ["Kaupskip", "noreply@example.com"], "attempts": 2}
+        queue.redis.hget.return_value = json.dumps(job)
+        queue.transport.send.return_value = Mock(status_code=451, status_text=b"busy", error=None)
+
+        # Act
+        asyncio.run(queue._attempt("job-1"))
+
+        # Assert
+        queue.transport.send.assert_awaited_once()
+        assert json.loads(pipe.lpush.call_args[0][1])["attempts"] == 3
+        pipe.hdel.assert_called_once_with(queue.jobs_key, "job-1")
+
+    def test_retry_success_removes_message(self, queue, pipe):
+        # Arrange
+        job = {"id": "job-1", "to": "user@example.com", "email_type": "welcome", "subject": "Hi",
+               "html": "<p>Hi</p>", "mail_from": ["Kaupskip", "noreply@example.com"], "attempts": 1}
+        queue.redis.hget.return_value = json.dumps(job)
+        queue.transport.send.return_value = Mock(status_code=250, status_text=b"ok", error=None)
+
+        # Act
+        asyncio.run(queue._attempt("job-1"))
+
+        # Assert
+        pipe.zrem.assert_called_once_with(queue.retry_key, "job-1")
+        queue.log_writer.write.assert_awaited_once_with("user@example.com", "welcome", "sent", {"attempts": 2})
+
+    def test_retry_reattaches_inline_assets(self, queue):
+        # Arrange
+        from emails import Message
+        from src.services.asset_cache import AssetCache, get_asset_cache
+        message = Message(subject="Hi", html="<p>Hi</p>", mail_from=("Kaupskip", "noreply@example.com"))
+        get_asset_cache().attach(message)
+        asyncio.run(queue.defer(message, "user@example.com", "welcome", 421, "try later"))
+        job = json.loads(queue.redis.pipeline.return_value.hset.call_args[0][2])
+        queue.redis.hget.return_value = json.dumps({**job, "id": "job-1"})
+        queue.transport.send.return_value = Mock(status_code=250, status_text=b"ok", error=None)
+
+        # Act
+        asyncio.run(queue._attempt("job-1"))
+
+        # Assert
+        assert job["assets"] == AssetCache.attached(message)
+        retried = queue.transport.send.call_args[0][0]
+        assert AssetCache.attached(retried) == job["assets"]
+
+    def test_unknown_outcome_is_not_retried(self, queue, pipe):
+        # Arrange
+        job = {"id": "job-1", "to": "user@example.com", "email_type": "welcome", "subject": "Hi",
+               "html": "<p>Hi</p>", "mail_from": ["Kaupskip", "noreply@example.com"], "attempts": 1}
+        queue.redis.hget.return_value = json.dumps(job)
+        queue.transport.send.side_effect = SendOutcomeUnknown("still in progress")
+
+        # Act
+        asyncio.run(queue._attempt("job-1"))
+
+        # Assert
+        pipe.zadd.assert_not_called()
+        pipe.lpush.assert_not_called()
+        pipe.hdel.assert_called_once_with(queue.jobs_key, "job-1")
+        assert queue.log_writer.write.call_args[0][2] == "unknown"
+
+    def test_email_service_does_not_defer_unknown_outcomes(self, mock_session_factory):
+        # Arrange
+        transport = Mock(send=AsyncMock(side_effect=SendOutcomeUnknown("still in progress")))
+        retry_queue = Mock(defer=AsyncMock())
+        log_writer = Mock(write=AsyncMock())
+        service = EmailService(mock_session_factory, transport=transport, log_writer=log_writer, retry_queue=retry_queue)
+
+        # Act
+        result = asyncio.run(service.send_welcome_email("user@example.com", {"name": "Ada"}))
+
+        # Assert
+        assert result is True
+        retry_queue.defer.assert_not_awaited()
+        assert log_writer.write.call_args[0][:3] == ("user@example.com", "welcome", "unknown")
+
+    def test_email_service_hands_failed_sends_to_queue(self, mock_session_factory):
+        # Arrange
+        transport = Mock(send=AsyncMock(side_effect=ConnectionResetError("reset")))
+        retry_queue = Mock(defer=AsyncMock(return_value=True))
+        service = EmailService(mock_session_factory, transport=transport, retry_queue=retry_queue)
+
+        # Act
+        result = asyncio.run(service.send_welcome_email("user@example.com", {"name": "Ada"}))
+
+        # Assert
+        assert result is True
+        _, to, email_type, status_code, error = retry_queue.defer.call_args[0]
+        assert (to, email_type, status_code, error) == ("user@example.com", "welcome", None, "reset")
+
+class TestEmailTypes:
+    def test_send_builds_message_from_registered_type(self, mock_session_factory):
+        # Arrange
+        transport = Mock(send=AsyncMock(return_value=Mock(status_code=250, status_text=b"ok", error=None)))
+        service = EmailService(mock_session_factory, transport=transport, log_writer=Mock(write=AsyncMock()))
+        
+        # Act
+        result = asyncio.run(service.send_subscription_receipt("user@example.com", {"tier": "Premium", "price": "9.99"}))
+        
+        # Assert
+        assert result is True
+        message = transport.send.call_args.args[0]
+        assert message.subject.endswith("Premium Plan Receipt")
+        assert message.mail_from[1] == settings.SMTP_USER
+        assert "9.99" in message.html
+        assert transport.send.call_args.kwargs == {"to": "user@example.com", "priority": 1}
+        
+    def test_missing_fields_are_logged_as_failed(self, mock_session_factory):
+        # Arrange
+        transport = Mock(send=AsyncMock())
+        log_writer = Mock(write=AsyncMock())
+        service = EmailService(mock_session_factory, transport=transport, log_writer=log_writer)
+        
+        # Act
+        result = asyncio.run(service.send("subscription_receipt", "user@example.com", {}))
+        
+        # Assert
+        assert result is False
+        transport.send.assert_not_called()
+        email_to, email_type, status, meta = log_writer.write.call_args.args
+        assert (email_to, email_type, status) == ("user@example.com", "subscription_receipt", "failed")
+        assert "tier" in meta["error"]
+        
+    def test_events_are_routed_by_channel_and_event_type(self):
+        # Arrange
+        redis_manager = Mock()
+        redis_manager.get_main_connection.return_value.pubsub.return_value = AsyncMock()
+        email_service = Mock(send=AsyncMock(return_value=True))
+        subscriber = RedisSubscriber(redis_manager, email_service)
+        downgrade = {"event_type": "subscription_downgraded", "user_id": "u", "email": "user@example.com",
+                     "tier": "Basic", "subscription_data": {"tier": "Basic"}}
+        trial = {"event_type": "marketing:trial_expired", "data": {"email": "user@example.com", "characters": []}}
+        
+        events = [
+            ("kaupskip:subscription", downgrade),
+            ("kaupskip:marketing", trial),
+            ("kaupskip:subscription", {**downgrade, "event_type": "refunded"}),
+            ("kaupskip:marketing", {"event_type": "marketing:trial_expired", "data": {}})
+        ]
+        
+        async def run():
+            return [
+                await subscriber._process_event(channel, decode_event(channel, json.dumps(event)))
+                for channel, event in events
+            ]
+        
+        # Act
+        results = asyncio.run(run())
+        
+        # Assert
+        assert results == [True, True, None, None]
+        assert [c.args for c in email_service.send.call_args_list] == [
+            ("account_change", "user@example.com", {"tier": "Basic"}),
+            ("trial_expired", "user@example.com", trial["data"])
+        ]
+
+class TestEventDecoding:
+    def test_valid_events_become_typed_objects(self):
+        # Arrange
+        raw = json.dumps({"event_type": "subscription_created", "user_id": 42, "email": "user@example.com",
+                          "tier": "Premium", "subscription_data": {"tier": "Premium"}, "unused": "dropped"})
+        
+        # Act
+        event = decode_event("kaupskip:subscription", raw.encode())
+        
+        # Assert
+        assert isinstance(event, SubscriptionEvent)
+        assert (event.user_id, event.tier, event.event_id) == (42, "Premium", None)
+        assert not hasattr(event, "__dict__")
+        
+    def test_numeric_event_ids_are_accepted_as_strings(self):
+        # Arrange
+        raw = json.dumps({"event_id": 42, "event_type": "marketing:welcome", "data": {"email": "user@example.com"}})
+        
+        # Act
+        event = decode_event("kaupskip:marketing", raw)
+        
+        # Assert
+        assert event.event_id == "42"
+        
+    def test_malformed_events_are_rejected_with_reasons(self):
+        # Act
+        with pytest.raises(EventDecodeError) as missing:
+            decode_event("user_registration", json.dumps({"user_id": "u", "email": ["not", "a", "string"]}))
+        with pytest.raises(EventDecodeError) as undecodable:
+            decode_event("kaupskip:marketing", "{not json")
+        
+        # Assert
+        fields = {error["field"] for error in missing.value.errors}
+        assert fields == {"email", "verification_token", "verification_url"}
+        assert "verification_token: Field required" in str(missing.value)
+        assert undecodable.value.errors[0]["error"].startswith("undecodable JSON")
+        
+    def test_invalid_stream_entries_are_dead_lettered(self):
+        # Arrange
+        redis_manager = Mock()
+        redis_manager.get_main_connection.return_value = AsyncMock(pubsub=Mock())
+        subscriber = RedisSubscriber(redis_manager, Mock())
+        subscriber._queues["user_registration"] = asyncio.Queue()
+        
+        # Act
+        asyncio.run(subscriber._enqueue_entry("user_registration", "1-0", {"data": json.dumps({"user_id": "u"})}))
+        
+        # Assert
+        assert subscriber._queues["user_registration"].empty()
+        fields = subscriber.redis.xadd.call_args[0][1]
+        assert fields["reason"].startswith("Invalid user_registration event: email: Field required")
+
+class TestRateLimiter:
+    @pytest.fixture
+    def limiter(self):
+        from src.services.rate_limiter import RateLimiter
+        redis = Mock()
+        redis.register_script = Mock(side_effect=lambda script: AsyncMock())
+        return RateLimiter(redis, domain_rates={"gmail.com": 20}, max_wait=0.5)
+
+    def test_waits_for_tokens_from_domain_and_relay_buckets(self, limiter):
+        # Arrange
+        limiter._acquire.side_effect = [["0.05", "1"], ["0", "1"]]
+
+        # Act
+        started = time.monotonic()
+        asyncio.run(limiter.acquire("User@Gmail.com"))
+
+        # Assert
+        assert time.monotonic() - started >= 0.05
+        keys = limiter._acquire.call_args.kwargs["keys"]
+        assert keys == ["kaupskip:ratelimit:domain:gmail.com", "kaupskip:ratelimit:relay"]
+        assert limiter._acquire.call_args.kwargs["args"][0] == 20
+
+    def test_gives_up_after_max_wait(self, limiter):
+        # Arrange
+        from src.services.rate_limiter import RateLimitExceeded
+        limiter._acquire.return_value = ["5", "0.5"]
+
+        # Act / Assert
+        with pytest.raises(RateLimitExceeded):
+            asyncio.run(limiter.acquire("user@outlook.com"))
+
+    def test_throttle_replies_slow_the_domain_and_successes_recover_it(self, limiter):
+        # Arrange
+        limiter._adjust.side_effect = ["0.5", "0.55"]
+
+        async def run():
+            await limiter.observe("user@outlook.com", 250)
+            await limiter.observe("user@outlook.com", 421)
+            throttled = limiter.throttled_domains()
+            await limiter.observe("user@outlook.com", 250)
+            return throttled
+
+        # Act
+        throttled = asyncio.run(run())
+
+        # Assert
+        assert throttled == {"outlook.com": 0.5}
+        assert [c.kwargs["args"][0] for c in limiter._adjust.call_args_list] == ["down", "up"]
+        assert limiter.throttled_domains() == {"outlook.com": 0.55}
+
+class TestMetrics:
+    def test_hot_paths_are_instrumented(self, email_service, mock_redis):
+        # Arrange
+        from prometheus_client import REGISTRY
+        from src.utils.metrics import render_metrics, update_runtime_gauges
+        def sample(name, **labels):
+            return REGISTRY.get_sample_value(name, labels) or 0
+        renders = sample("kaupskip_template_render_seconds_count", template="verification.html")
+        logged = sample("kaupskip_emails_total", email_type="verification", status="sent")
+        subscriber = Mock(queue_depths=Mock(return_value={"user_registration": 7}))
+        transport = Mock()
+        transport.pool.stats.return_value = {"size": 3, "idle": 1, "in_use": 2, "max_size": 10}
+
+        # Act
+        email_service._render_template("verification.html", {"code": "1", "verification_url": "u", "expiry_hours": 1})
+        asyncio.run(email_service._log_email("test@example.com", "verification", "sent"))
+        redis_manager = Mock()
+        redis_manager.stats.return_value = {"size": 4, "idle": 3, "in_use": 1, "max_size": 50}
+        update_runtime_gauges(subscriber, transport, redis_manager)
+        body = render_metrics().decode()
+
+        # Assert
+        assert sample("kaupskip_template_render_seconds_count", template="verification.html") == renders + 1
+        assert sample("kaupskip_emails_total", email_type="verification", status="sent") == logged + 1
+        assert sample("kaupskip_subscriber_backlog", channel="user_registration") == 7
+        assert sample("kaupskip_smtp_pool_connections", state="in_use") == 2
+        assert sample("kaupskip_redis_pool_connections", state="idle") == 3
+        assert "kaupskip_redis_reconnects_total" in body
+
+class TestLeaderElection:
+    @pytest.fixture
+    def scripts(self):
+        return Mock(lease=AsyncMock(return_value=1), release=AsyncMock(return_value=1))
+
+    @pytest.fixture
+    def election(self, scripts):
+        from src.services.leader_election import LeaderElection
+        redis = Mock()
+        redis.register_script = Mock(side_effect=[scripts.lease, scripts.release])
+        return LeaderElection(
+            redis,
+            on_elected=AsyncMock(),
+            on_demoted=AsyncMock(),
+            identity="host-1",
+            lease_ttl=10,
+            renew_interval=2
+        )
+
+    def test_taking_the_lease_starts_leader_duties_once(self, election, scripts):
+        # Act
+        asyncio.run(election.tick())
+        asyncio.run(election.tick())
+
+        # Assert
+        assert election.is_leader is True
+        election.on_elected.assert_awaited_once()
+        assert scripts.lease.call_args.kwargs["keys"] == [settings.LEADER_KEY]
+        identity, _, ttl_ms = scripts.lease.call_args.kwargs["args"]
+        assert (identity, ttl_ms) == ("host-1", 10000)
+
+    def test_follower_stays_idle(self, election, scripts):
+        # Arrange
+        scripts.lease.return_value = 0
+
+        # Act
+        asyncio.run(election.tick())
+
+        # Assert
+        assert election.is_leader is False
+        election.on_elected.assert_not_awaited()
+        election.on_demoted.assert_not_awaited()
+
+    def test_lost_lease_stops_leader_duties(self, election, scripts):
+        # Arrange
+        asyncio.run(election.tick())
+        scripts.lease.return_value = 0
+
+        # Act
+        asyncio.run(election.tick())
+
+        # Assert
+        assert election.is_leader is False
+        election.on_demoted.assert_awaited_once()
+
+    def test_steps_down_before_an_unrenewable_lease_expires(self, election, scripts):
+        # Arrange
+        asyncio.run(election.tick())
+        scripts.lease.side_effect = ConnectionError("down")
+
+        # Act
+        asyncio.run(election.tick())
+        still_leader = election.is_leader
+        election._lease_deadline = time.monotonic() + 1
+        asyncio.run(election.tick())
+
+        # Assert
+        assert still_leader is True
+        assert election.is_leader is False
+        election.on_demoted.assert_awaited_once()
+
+    def test_dead_leader_duties_give_up_the_lease(self, election, scripts):
+        # Arrange
+        election.is_healthy = Mock(return_value=True)
+        asyncio.run(election.tick())
+        asyncio.run(election.tick())
+        election.is_healthy.return_value = False
+
+        # Act
+        asyncio.run(election.tick())
+
+        # Assert
+        scripts.release.assert_awaited_once_with(keys=[settings.LEADER_KEY], args=["host-1"])
+        election.on_demoted.assert_awaited_once()
+        assert election.is_leader is False
+
+        # Act
+        election.is_healthy.return_value = True
+        asyncio.run(election.tick())
+
+        # Assert
+        assert election.is_leader is True
+        assert election.on_elected.await_count == 2
+
+    def test_stop_releases_the_lease(self, election, scripts):
+        # Arrange
+        asyncio.run(election.tick())
+
+        # Act
+        asyncio.run(election.stop())
+
+        # Assert
+        scripts.release.assert_awaited_once_with(keys=[settings.LEADER_KEY], args=["host-1"])
+        election.on_demoted.assert_awaited_once()
+        assert election.is_leader is False
+
+    def test_status_reports_leader_and_lease_age(self, election):
+        # Arrange
+        pipe = Mock(execute=AsyncMock(return_value=[
+            {"id": "host-2", "acquired_at": "2026-10-18T12:00:00+00:00", "ttl_ms": "10000"},
+            8500
+        ]))
+        election.redis.pipeline = Mock(return_value=pipe)
+
+        # Act
+        result = asyncio.run(election.status())
+
+        # Assert
+        assert result == {
+            "leader": "host-2",
+            "leader_since": "2026-10-18T12:00:00+00:00",
+            "lease_age": 1.5,
+            "lease_expires_in": 8.5,
+            "identity": "host-1",
+            "is_leader": False
+        }
+
+class TestRedisManager:
+    def test_shares_one_bounded_pool(self):
+        # Arrange
+        manager = RedisManager(max_connections=3, pool_timeout=0.5)
+        
+        # Act
+        first = manager.get_main_connection()
+        second = manager.get_main_connection()
+        stats = manager.stats()
+        
+        # Assert
+        assert first is second
+        assert first.connection_pool is manager.pool
+        assert manager.pool.max_connections == 3
+        assert manager.pool.timeout == 0.5
+        assert stats == {"size": 0, "idle": 0, "in_use": 0, "max_size": 3}
+        
+    def test_close_releases_pool(self):
+        # Arrange
+        manager = RedisManager()
+        pool = manager.pool
+        pool.disconnect = AsyncMock()
+        
+        # Act
+        asyncio.run(manager.close())
+        
+        # Assert
+        pool.disconnect.assert_awaited_once()
+        assert manager.redis is None
+        assert manager.stats()["size"] == 0
+
 class TestVerificationService:
-    async def test_create_verification(self, verification_service, mock_redis):
+    def test_create_verification(self, verification_service, verification_redis):
         # Arrange
         user_id = "test-user"
         email = "test@example.com"
         
         # Act
-        code = await verification_service.create_verification(user_id, email)
+        code = asyncio.run(verification_service.create_verification(user_id, email))
         
         # Assert
         assert code is not None
-        mock_redis.setex.assert_called_once()
-        key = f"verification:{user_id}"
-        assert mock_redis.setex.call_args[0][0] == key
+        verification_redis.setex.assert_called_once()
+        key, _, record = verification_redis.setex.call_args[0]
+        assert key == f"kaupskip:verification:{user_id}"
+        assert json.loads(record)["code"] == code
         
-    async def test_verify_code_success(self, verification_service, mock_redis):
+    def test_create_verifications_uses_one_pipeline(self, verification_service, verification_redis):
+        # Arrange
+        users = [(f"user-{i}", f"user{i}@example.com") for i in range(3)]
+        pipe = verification_redis.pipeline.return_value
+        
+        # Act
+        codes = asyncio.run(verification_service.create_verifications(users))
+        
+        # Assert
+        assert list(codes) == ["user-0", "user-1", "user-2"]
+        verification_redis.pipeline.assert_called_once_with(transaction=False)
+        assert [c[0][0] for c in pipe.setex.call_args_list] == [f"kaupskip:verification:user-{i}" for i in range(3)]
+        pipe.execute.assert_awaited_once()
+        verification_redis.setex.assert_not_called()
+        
+    def test_verify_code_success(self, verification_service, verification_redis):
         # Arrange
         user_id = "test-user"
         code = "test-code"
-        mock_redis.get.return_value = {"code": code}
+        script = verification_redis.register_script.return_value
+        script.return_value = 1
         
         # Act
-        result = await verification_service.verify_code(user_id, code)
+        result = asyncio.run(verification_service.verify_code(user_id, code))
         
         # Assert
         assert result is True
-        mock_redis.delete.assert_called_once_with(f"verification:{user_id}")
+        script.assert_awaited_once()
+        kwargs = script.call_args.kwargs
+        assert kwargs["keys"] == [f"kaupskip:verification:{user_id}"]
+        assert kwargs["args"][:3] == [code, "kaupskip:verification", user_id]
         
-    async def test_verify_code_failure(self, verification_service, mock_redis):
+    def test_verify_code_failure(self, verification_service, verification_redis):
         # Arrange
         user_id = "test-user"
         code = "test-code"
-        mock_redis.get.return_value = {"code": "different-code"}
+        verification_redis.register_script.return_value.return_value = None
         
         # Act
-        result = await verification_service.verify_code(user_id, code)
+        result = asyncio.run(verification_service.verify_code(user_id, code))
         
         # Assert
         assert result is False
-        mock_redis.delete.assert_not_called() 
\ No newline at end of file
+
+class TestSMTPTransport:
+    def test_sends_overlap(self):
+        # Arrange
+        transport = SMTPTransport(max_concurrency=4, send_timeout=5)
+        transport._send_blocking = lambda message, to, deadline: time.sleep(0.2) or to
+        
+        async def send_all():
+            return await asyncio.gather(*(transport.send(Mock(), f"user{i}@example.com") for i in range(4)))
+        
+        # Act
+        started = time.monotonic()
+        results = asyncio.run(send_all())
+        elapsed = time.monotonic() - started
+        transport.close()
+        
+        # Assert
+        assert results == [f"user{i}@example.com" for i in range(4)]
+        assert elapsed < 0.6
+        
+    def test_send_timeout(self):
+        # Arrange
+        transport = SMTPTransport(max_concurrency=1, send_timeout=0.05)
+        transport._send_blocking = lambda message, to, deadline: time.sleep(0.3)
+        
+        # Act / Assert
+        with pytest.raises(SendOutcomeUnknown):
+            asyncio.run(transport.send(Mock(), "test@example.com"))
+        transport.close()
+        
+    def test_overrunning_send_keeps_its_slot(self):
+        # Arrange
+        transport = SMTPTransport(max_concurrency=1, send_timeout=0.1)
+        sends = []
+        def send_blocking(message, to, deadline):
+            sends.append(to)
+            time.sleep(0.3 if to == "slow@example.com" else 0.01)
+            return to
+        transport._send_blocking = send_blocking
+        
+        async def send_both():
+            slow = asyncio.create_task(transport.send(Mock(), "slow@example.com"))
+            await asyncio.sleep(0.01)
+            fast = asyncio.create_task(transport.send(Mock(), "fast@example.com"))
+            return await asyncio.gather(slow, fast, return_exceptions=True)
+        
+        # Act
+        slow, fast = asyncio.run(send_both())
+        transport.close()
+        
+        # Assert
+        assert isinstance(slow, SendOutcomeUnknown)
+        # The second send waited for the slot, not for the executor, so its
+        # own timeout only covered its own SMTP time
+        assert fast == "fast@example.com"
+        assert sends == ["slow@example.com", "fast@example.com"]
+        
+    def test_timeout_inside_the_thread_is_retried_not_unknown(self, mock_session_factory):
+        # Arrange
+        import socket
+        transport = SMTPTransport(max_concurrency=1, send_timeout=5)
+        def connect_timeout(message, to, deadline):
+            raise socket.timeout("timed out")
+        transport._send_blocking = connect_timeout
+        retry_queue = Mock(defer=AsyncMock(return_value=True))
+        log_writer = Mock(write=AsyncMock())
+        service = EmailService(mock_session_factory, transport=transport, log_writer=log_writer, retry_queue=retry_queue)
+        
+        # Act
+        with pytest.raises(socket.timeout) as raised:
+            asyncio.run(transport.send(Mock(), "test@example.com"))
+        result = asyncio.run(service.send_welcome_email("user@example.com", {"name": "Ada"}))
+        transport.close()
+        
+        # Assert
+        assert not isinstance(raised.value, SendOutcomeUnknown)
+        assert result is True
+        retry_queue.defer.assert_awaited_once()
+        assert retry_queue.defer.call_args[0][3] is None
+        log_writer.write.assert_not_awaited()
+        
+    def test_send_past_its_deadline_is_not_attempted(self):
+        # Arrange
+        transport = SMTPTransport(max_concurrency=1)
+        transport.pool = Mock()
+        message = Mock()
+        
+        # Act / Assert
+        with pytest.raises(PoolTimeoutError):
+            transport._send_blocking(message, "test@example.com", time.monotonic() - 1)
+        message.send.assert_not_called()
+        transport.pool.release.assert_called_once()
+        transport.close()
+        
+    def test_waiting_sends_take_free_slots_by_priority(self):
+        # Arrange
+        transport = SMTPTransport(max_concurrency=1, send_timeout=5)
+        order = []
+        transport._send_blocking = lambda message, to, deadline: time.sleep(0.05) or order.append(to)
+        
+        async def send_all():
+            first = asyncio.create_task(transport.send(Mock(), "first@example.com"))
+            await asyncio.sleep(0.01)
+            queued = [
+                transport.send(Mock(), "campaign@example.com", priority=2),
+                transport.send(Mock(), "verification@example.com", priority=0),
+                transport.send(Mock(), "receipt@example.com", priority=1)
+            ]
+            await asyncio.gather(first, *queued)
+        
+        # Act
+        asyncio.run(send_all())
+        transport.close()
+        
+        # Assert
+        assert order == ["first@example.com", "verification@example.com", "receipt@example.com", "campaign@example.com"]
+
+class TestSMTPConnectionPool:
+    @pytest.fixture
+    def pool(self):
+        pool = SMTPConnectionPool({}, min_size=0, max_size=2, idle_timeout=60, max_messages=2, health_check_interval=60)
+        pool._connect = lambda: PooledConnection(Mock())
+        return pool
+        
+    def test_reuses_connections(self, pool):
+        # Act
+        first = pool.acquire()
+        pool.release(first)
+        second = pool.acquire()
+        
+        # Assert
+        assert second is first
+        assert pool.stats()["size"] == 1
+        
+    def test_recycles_after_max_messages(self, pool):
+        # Arrange
+        conn = pool.acquire()
+        pool.release(conn)
+        conn = pool.acquire()
+        
+        # Act
+        pool.release(conn)
+        
+        # Assert
+        conn.backend.close.assert_called_once()
+        assert pool.stats()["size"] == 0
+        
+    def test_reconnects_on_421(self, pool):
+        # Arrange
+        transport = SMTPTransport(max_concurrency=1)
+        transport.pool = pool
+        message = Mock()
+        message.send.side_effect = [Mock(status_code=421), Mock(status_code=250)]
+        
+        # Act
+        response = transport._send_blocking(message, "test@example.com")
+        transport.close()
+        
+        # Assert
+        assert response.status_code == 250
+        first_backend = message.send.call_args_list[0].kwargs["smtp"]
+        second_backend = message.send.call_args_list[1].kwargs["smtp"]
+        assert first_backend is not second_backend
+        first_backend.close.assert_called_once()
+
+class TestRedisSubscriber:
+    @pytest.fixture
+    def subscriber(self):
+        redis_manager = Mock()
+        redis_manager.get_main_connection.return_value.pubsub.return_value = AsyncMock()
+        redis_manager.get_main_connection.return_value.set = AsyncMock(return_value=True)
+        async def slow_send(*args, **kwargs):
+            await asyncio.sleep(0.1)
+        email_service = Mock()
+        email_service.send = AsyncMock(side_effect=slow_send)
+        return RedisSubscriber(redis_manager, email_service, channel_concurrency={"user_registration": 4})
+        
+    def test_workers_process_events_concurrently_and_drain_on_stop(self, subscriber):
+        # Arrange
+        event = {"user_id": "u", "email": "test@example.com", "verification_token": "t", "verification_url": "url"}
+        
+        async def run():
+            subscriber._start_workers()
+            for _ in range(4):
+                await subscriber._queues["user_registration"].put((RegistrationEvent(**event), None, time.monotonic()))
+            started = time.monotonic()
+            await subscriber.stop()
+            return time.monotonic() - started
+        
+        # Act
+        elapsed = asyncio.run(run())
+        
+        # Assert
+        assert subscriber.email_service.send.await_count == 4
+        assert subscriber.email_service.send.call_args.args == (
+            "verification", "test@example.com", {"code": "t", "verification_url": "url"}
+        )
+        assert elapsed < 0.3
+        assert subscriber._workers == []
+        
+    def test_idle_loop_blocks_and_reconnects(self, subscriber):
+        # Arrange
+        from redis.exceptions import ConnectionError as RedisConnectionError
+        calls = []
+        
+        async def get_message(ignore_subscribe_messages, timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                raise RedisConnectionError("connection lost")
+            await asyncio.sleep(timeout)
+            return None
+        
+        subscriber.pubsub.get_message = get_message
+        subscriber.poll_timeout = 0.05
+        subscriber._reconnect_backoff = 0.01
+        
+        async def run():
+            listener = asyncio.create_task(subscriber.start_listening())
+            await asyncio.sleep(0.3)
+            await subscriber.stop()
+            await listener
+        
+        # Act
+        asyncio.run(run())
+        stats = subscriber.stats()
+        
+        # Assert
+        assert stats["reconnects"] == 1
+        assert subscriber.pubsub.subscribe.await_count == 2
+        assert 0 < stats["idle_polls"] <= 10
+        assert stats["loop_iterations"] == stats["idle_polls"] + 1
+        
+    def test_keeps_resubscribing_until_redis_is_back(self, subscriber):
+        # Arrange
+        from redis.exceptions import ConnectionError as RedisConnectionError
+        event = {"user_id": "u", "email": "test@example.com", "verification_token": "t", "verification_url": "url"}
+        messages = [RedisConnectionError("connection lost"),
+                    {"type": "message", "channel": "user_registration", "data": json.dumps(event)}]
+        
+        async def get_message(ignore_subscribe_messages, timeout):
+            if messages:
+                message = messages.pop(0)
+                if isinstance(message, Exception):
+                    raise message
+                return message
+            await asyncio.sleep(timeout)
+            return None
+        
+        subscriber.pubsub.get_message = get_message
+        # Initial subscribe works, the first resubscribe fails, the second works
+        subscriber.pubsub.subscribe = AsyncMock(side_effect=[None, RedisConnectionError("refused"), None])
+        subscriber.poll_timeout = 0.05
+        subscriber._reconnect_backoff = 0.01
+        
+        async def run():
+            listener = asyncio.create_task(subscriber.start_listening())
+            await asyncio.sleep(0.4)
+            await subscriber.stop()
+            await listener
+        
+        # Act
+        asyncio.run(run())
+        
+        # Assert
+        assert subscriber.pubsub.subscribe.await_count == 3
+        assert subscriber.stats()["reconnects"] == 1
+        subscriber.email_service.send.assert_awaited_once()
+        
+    def test_stream_entries_acked_only_after_successful_send(self, subscriber):
+        # Arrange
+        event = {"user_id": "u", "email": "test@example.com", "verification_token": "t", "verification_url": "url"}
+        subscriber.redis = AsyncMock()
+        subscriber.email_service.send = AsyncMock(side_effect=[True, False])
+        
+        async def run():
+            subscriber._start_workers()
+            await subscriber._enqueue_entry("user_registration", "1-0", {"data": json.dumps(event)})
+            await subscriber._enqueue_entry("user_registration", "2-0", {"data": json.dumps(event)})
+            await subscriber._queues["user_registration"].join()
+            await subscriber.stop()
+        
+        # Act
+        asyncio.run(run())
+        
+        # Assert
+        subscriber.redis.xack.assert_awaited_once_with("kaupskip:stream:user_registration", "kaupskip-email", "1-0")
+        
+    def test_stale_entries_past_max_deliveries_are_dead_lettered(self, subscriber):
+        # Arrange
+        subscriber.redis = AsyncMock()
+        subscriber.redis.pipeline = Mock(return_value=Mock(execute=AsyncMock(return_value=[[{"times_delivered": 6}]])))
+        subscriber.redis.xautoclaim.return_value = ["0-0", [("1-0", {"data": "{}"})], []]
+        subscriber._running = True
+        
+        # Act
+        asyncio.run(subscriber._claim_stream("user_registration"))
+        
+        # Assert
+        subscriber.redis.xadd.assert_awaited_once()
+        assert subscriber.redis.xadd.call_args[0][0] == "kaupskip:stream:dead_letter"
+        subscriber.redis.xack.assert_awaited_once_with("kaupskip:stream:user_registration", "kaupskip-email", "1-0")
+        
+    def test_duplicate_events_are_skipped_before_sending(self, subscriber):
+        # Arrange
+        store = {}
+        async def redis_set(key, value, nx=False, ex=None):
+            if nx and key in store:
+                return None
+            store[key] = value
+            return True
+        subscriber.redis = AsyncMock()
+        subscriber.redis.set.side_effect = redis_set
+        subscriber.redis.get.side_effect = store.get
+        subscriber.redis.delete.side_effect = store.pop
+        subscriber.email_service.send = AsyncMock(side_effect=[False, True, True])
+        event = {"user_id": "u", "email": "test@example.com", "verification_token": "t", "verification_url": "url"}
+        receipt = {"event_id": "evt-1", "user_id": "u", "email": "test@example.com", "tier": "pro",
+                   "subscription_data": {"tier": "pro"}, "event_type": "subscription_created"}
+        
+        async def run():
+            subscriber._start_workers()
+            # The first send fails, so the redelivered copy must go through
+            for _ in range(3):
+                await subscriber._enqueue_entry("user_registration", None, {"data": json.dumps(event)})
+                await subscriber._queues["user_registration"].join()
+            for payload in [receipt, {**receipt, "tier": "changed"}]:
+                await subscriber._queues["kaupskip:subscription"].put(
+                    (decode_event("kaupskip:subscription", json.dumps(payload)), "1-0", time.monotonic())
+                )
+                await subscriber._queues["kaupskip:subscription"].join()
+            await subscriber.stop()
+        
+        # Act
+        asyncio.run(run())
+        
+        # Assert
+        email_types = [c.args[0] for c in subscriber.email_service.send.call_args_list]
+        assert email_types == ["verification", "verification", "subscription_receipt"]
+        assert subscriber.stats()["duplicates_skipped"] == 2
+        assert subscriber.redis.xack.await_count == 2
@@ -0,0 +1,88 @@
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Labels are limited to small fixed sets (email type, status, template,
+# channel) so the number of series stays constant no matter how much mail
+# goes out; recipients and event ids are never used as labels.
+
+EMAILS = Counter(
+    "kaupskip_emails_total",
+    "Emails logged, by email type and status (sent, failed, deferred, unknown)",
+    ["email_type", "status"]
+)
+TEMPLATE_RENDER_SECONDS = Histogram(
+    "kaupskip_template_render_seconds",
+    "Time to render an email template",
+    ["template"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+)
+SMTP_SLOT_WAIT_SECONDS = Histogram(
+    "kaupskip_smtp_slot_wait_seconds",
+    "Time a send waited for one of the transport's concurrency slots",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+)
+SMTP_SEND_SECONDS = Histogram(
+    "kaupskip_smtp_send_seconds",
+    "Time to hand one message to the SMTP relay, including reconnects",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+EMAIL_LOG_WRITE_SECONDS = Histogram(
+    "kaupskip_email_log_write_seconds",
+    "Time to write email log rows: one bulk insert (batch) or one row (inline)",
+    ["mode"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+EMAIL_LOG_ROWS_DROPPED = Counter(
+    "kaupskip_email_log_rows_dropped_total",
+    "Email log rows that could not be written and were dropped"
+)
+EVENTS = Counter(
+    "kaupskip_events_total",
+    "Subscriber events by channel and outcome (processed, failed, duplicate, invalid)",
+    ["channel", "outcome"]
+)
+EVENT_SECONDS = Histogram(
+    "kaupskip_event_seconds",
+    "Time from an event being queued by the subscriber to its email being handled",
+    ["channel"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+SUBSCRIBER_BACKLOG = Gauge(
+    "kaupskip_subscriber_backlog",
+    "Events queued in the subscriber waiting for a worker",
+    ["channel"]
+)
+SUBSCRIBER_LEADER = Gauge(
+    "kaupskip_subscriber_leader",
+    "1 while this process holds the subscriber leader lease and consumes pub/sub"
+)
+REDIS_RECONNECTS = Counter(
+    "kaupskip_redis_reconnects_total",
+    "Times the subscriber lost its Redis connection and reconnected"
+)
+SMTP_POOL_CONNECTIONS = Gauge(
+    "kaupskip_smtp_pool_connections",
+    "SMTP pool connections by state (in_use, idle) and the pool's max_size",
+    ["state"]
+)
+REDIS_POOL_CONNECTIONS = Gauge(
+    "kaupskip_redis_pool_connections",
+    "Shared Redis pool connections by state (in_use, idle) and the pool's max_size",
+    ["state"]
+)
+
+def update_runtime_gauges(redis_subscriber=None, transport=None, redis_manager=None):
+    """Refresh gauges that mirror live state; called on each scrape so the hot path pays nothing"""
+    if redis_subscriber is not None:
+        for channel, depth in redis_subscriber.queue_depths().items():
+            SUBSCRIBER_BACKLOG.labels(channel).set(depth)
+    if transport is not None:
+        stats = transport.pool.stats()
+        for state in ("in_use", "idle", "max_size"):
+            SMTP_POOL_CONNECTIONS.labels(state).set(stats[state])
+    if redis_manager is not None:
+        stats = redis_manager.stats()
+        for state in ("in_use", "idle", "max_size"):
+            REDIS_POOL_CONNECTIONS.labels(state).set(stats[state])
+
+def render_metrics() -> bytes:
+    return generate_latest()
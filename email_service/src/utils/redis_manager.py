@@ -1,4 +1,5 @@
-from redis.asyncio import Redis
+from redis.asyncio import BlockingConnectionPool, Redis
+from typing import Optional
 from ..config import settings
 import logging
 import json
@@ -6,28 +7,55 @@ import json
 logger = logging.getLogger(__name__)
 
 class RedisManager:
-    def __init__(self):
+    """One Redis client and connection pool shared by every component
+
+    The pool is capped at ``REDIS_MAX_CONNECTIONS``; when all connections are
+    busy a command waits up to ``REDIS_POOL_TIMEOUT`` for one to be released
+    instead of opening another. Connections are opened lazily, so creating
+    the manager succeeds even while Redis is down.
+    """
+
+    def __init__(self, max_connections: Optional[int] = None, pool_timeout: Optional[float] = None):
         logger.info("Initializing Redis connection...")
+        self.pool = None
+        self.redis = None
+        self.max_connections = max_connections or settings.REDIS_MAX_CONNECTIONS
+        self.pool_timeout = settings.REDIS_POOL_TIMEOUT if pool_timeout is None else pool_timeout
         
         try:
-            self.redis = Redis.from_url(
-                settings.REDIS_URL,
-                decode_responses=True,
-                health_check_interval=30
-            )
+            self._connect()
             logger.info(f"Successfully connected to Redis at {settings.REDIS_URL}")
         except Exception as e:
             logger.error(f"Failed to connect to Redis: {str(e)}")
-            self.redis = None
+            
+    def _connect(self):
+        self.pool = BlockingConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=self.max_connections,
+            timeout=self.pool_timeout,
+            decode_responses=True,
+            health_check_interval=30
+        )
+        self.redis = Redis(connection_pool=self.pool)
             
     def get_main_connection(self):
         if not self.redis:
             try:
-                self.redis = Redis.from_url(
-                    settings.REDIS_URL,
-                    decode_responses=True,
-                    health_check_interval=30
-                )
+                self._connect()
             except Exception as e:
                 logger.error(f"Failed to reconnect to Redis: {str(e)}")
-        return self.redis
\ No newline at end of file
+        return self.redis
+        
+    def stats(self) -> dict:
+        if not self.pool:
+            return {"size": 0, "idle": 0, "in_use": 0, "max_size": self.max_connections}
+        idle = len(self.pool._available_connections)
+        in_use = len(self.pool._in_use_connections)
+        return {"size": idle + in_use, "idle": idle, "in_use": in_use, "max_size": self.max_connections}
+        
+    async def close(self):
+        """Close the client and every pooled connection"""
+        if self.redis:
+            await self.redis.aclose(close_connection_pool=True)
+        self.redis = None
+        self.pool = None